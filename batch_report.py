@@ -0,0 +1,255 @@
+"""Batch report generator: the streamlit app's charts for many windows at once.
+
+Reads a JSON spec of jobs, each a window of one chart, and renders them on a
+process pool, writing for each job ``<name>.json`` (the plotly figure),
+``<name>.html`` and ``<name>.csv`` (the window's stats) to the output
+directory, and ``<name>.events.csv`` (its band crossings) for jobs that ask
+for them, plus ``index.json`` listing every job:
+    python batch_report.py weekly.json --out reports/ --workers 8
+
+The spec is a list of jobs, or an object with ``jobs`` and ``defaults``
+(options every job gets unless it sets them):
+    {"defaults": {"series": "spread", "bands": "Window"},
+     "jobs": [{"name": "spread_2y", "window": "2y"},
+              {"name": "gfc", "start": "2007-01-01", "end": "2009-12-31",
+               "bands": "Percentiles"},
+              {"name": "pe_10y", "chart": "pe", "window": "10y"}]}
+Job options:
+    name         output file name (default job_<i>)
+    chart        'spread' (create_std_graph, the default) or 'pe'
+                 (create_inverse_graph)
+    window       a warmup window spec ('2y', 'ytd', 'all', 'since 2007-01-01');
+                 or start / end dates, each defaulting to the data's ends
+    series       spread series (default dataset.DEFAULT_SERIES)
+    bands        one of the app's BAND_MODES (default 'Window')
+    show_lines   draw the mean and std lines (default true)
+    crossings    mark the band crossings on the chart and list them in
+                 <name>.events.csv (default false; spread charts only)
+
+The dataset is loaded once, by the parent, as the app loads it (through the
+app's refresher and shared store, streamlit_charts.app_datasets) but without
+importing the app. Each worker attaches the saved Dataset once when it
+starts, memory-mapping the same files, so tasks only carry their job
+options. Workers are spawned and import streamlit_charts, not the app, so
+they load no data of their own. Figures come from its window_result
+and pe_result, so windows the app already drew are reused from the result
+cache.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import tempfile
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+# the report only reads the published dataset; no windows warmed behind it
+os.environ.setdefault('SPREAD_WARMUP', '0')
+
+import dataset
+import fast_figures
+import metrics
+import streamlit_charts
+import warmup
+
+CHARTS = ['spread', 'pe']
+PLOTLYJS = ['cdn', 'directory', 'inline']
+
+# center and bands are the mean and stds, or the median and percentiles
+BAND_COLUMNS = ['center', 'up1', 'down1', 'up2', 'down2']
+STATS_COLUMNS = {
+    'spread': ['job', 'chart', 'series', 'bands', 'start', 'end', 'rows',
+               *BAND_COLUMNS, 'last'],
+    'pe': ['job', 'chart', 'start', 'end', 'rows', 'inverse_last', 'inverse_min',
+           'inverse_max', 'inverse_mean', 'spx_last', 'spx_min', 'spx_max'],
+}
+
+# set in each worker by _attach
+_data = None
+_plotlyjs = None
+
+
+def read_spec(path):
+    with open(path) as f:
+        spec = json.load(f)
+    if isinstance(spec, list):
+        spec = {'jobs': spec}
+    defaults = spec.get('defaults', {})
+    return [dict(defaults, **dict({'name': f'job_{i}'}, **job))
+            for i, job in enumerate(spec['jobs'])]
+
+
+def resolve_job(job, data):
+    """``job`` with its window as ``start`` / ``end`` Timestamps and every
+    option filled in; raises ValueError for a job that can't be rendered."""
+    job = dict(job)
+    first, last = data.frame.date.iloc[0], data.frame.date.iloc[-1]
+    if 'window' in job:
+        job['start'], job['end'] = warmup.window_dates(job.pop('window'), first, last)
+    job['start'] = pd.Timestamp(job.get('start', first))
+    job['end'] = pd.Timestamp(job.get('end', last))
+    job.setdefault('chart', 'spread')
+    job.setdefault('series', dataset.DEFAULT_SERIES)
+    job.setdefault('bands', 'Window')
+    job.setdefault('show_lines', True)
+    job.setdefault('crossings', False)
+
+    name = job['name']
+    if job['chart'] not in CHARTS:
+        raise ValueError(f"{name}: unknown chart {job['chart']!r}, use one of {CHARTS}")
+    if job['series'] not in data.series:
+        raise ValueError(f"{name}: unknown series {job['series']!r}, "
+                         f"the dataset has {data.series}")
+    band_modes = streamlit_charts.BAND_MODES
+    if job['bands'] not in band_modes:
+        raise ValueError(f"{name}: unknown bands {job['bands']!r}, use one of {band_modes}")
+    if job['crossings'] and job['chart'] != 'spread':
+        raise ValueError(f'{name}: crossings are only marked on spread charts')
+    if job['start'] > job['end']:
+        raise ValueError(f'{name}: window starts after it ends')
+    start, stop = data.index.slice(job['start'], job['end'])
+    if stop == start:
+        raise ValueError(f"{name}: no rows between {job['start'].date()} "
+                         f"and {job['end'].date()}")
+    return job
+
+
+def _attach(path, plotlyjs):
+    global _data, _plotlyjs
+    _data = dataset.Dataset.attach(path)
+    _plotlyjs = plotlyjs
+
+
+def _spread_report(job):
+    result = streamlit_charts.window_result(_data, job['start'], job['end'], job['series'],
+                                            job['show_lines'], job['bands'], job['crossings'])
+    start, stop = _data.index.slice(job['start'], job['end'])
+    values = _data.values[start:stop, _data.index.column(job['series'])]
+    stats = dict(zip(BAND_COLUMNS, result.bands),
+                 last=values[-1])
+    return json.loads(result.figure), result.figure, stop - start, stats
+
+
+# the crossings of a spread job with its regimes named, as on the chart
+def _write_events(job, bands, path):
+    events = streamlit_charts.window_crossings(_data, job['start'], job['end'], job['series'],
+                                               job['bands'], bands)
+    percentiles = job['bands'] == 'Percentiles'
+    names = fast_figures.regime_labels(fast_figures.PERCENTILE_LABELS if percentiles
+                                       else fast_figures.BAND_LABELS)
+    events = events.assign(date=events.date.dt.date,
+                           before=[names[r] for r in events.before],
+                           after=[names[r] for r in events.after])
+    events.to_csv(path, index=False)
+
+
+def _pe_report(job):
+    result = streamlit_charts.pe_result(_data, job['start'], job['end'])
+    start, stop = _data.index.slice(job['start'], job['end'])
+    window = _data.frame.iloc[start:stop]
+    inverse_min, inverse_max = result.bands
+    spx_min, spx_max = _data.spx_pyramid.window_extrema(int(start), int(stop))
+    stats = dict(inverse_last=window.inverse.values[-1], inverse_min=inverse_min,
+                 inverse_max=inverse_max, inverse_mean=window.inverse.mean(),
+                 spx_last=window.spx_price.values[-1], spx_min=spx_min, spx_max=spx_max)
+    return json.loads(result.figure), result.figure, stop - start, stats
+
+
+REPORTS = {'spread': _spread_report, 'pe': _pe_report}
+
+
+def run_job(job, out_dir):
+    """Render one resolved job in a worker; returns its index.json entry."""
+    import plotly.io as pio
+
+    t = time.perf_counter()
+    with metrics.timer('batch_job'):
+        figure, figure_json, rows, stats = REPORTS[job['chart']](job)
+        entry = dict(name=job['name'], chart=job['chart'], series=job['series'],
+                     bands=job['bands'], start=str(job['start'].date()),
+                     end=str(job['end'].date()), rows=int(rows))
+
+        base = os.path.join(out_dir, job['name'])
+        with open(base + '.json', 'w') as f:
+            f.write(figure_json)
+        pio.write_html(figure, base + '.html', include_plotlyjs=_plotlyjs, validate=False)
+        with open(base + '.csv', 'w', newline='') as f:
+            writer = csv.DictWriter(f, STATS_COLUMNS[job['chart']], extrasaction='ignore')
+            writer.writeheader()
+            writer.writerow(dict(entry, job=job['name'], **stats))
+        files = [job['name'] + ext for ext in ('.json', '.html', '.csv')]
+        if job['crossings']:
+            _write_events(job, [stats[c] for c in BAND_COLUMNS], base + '.events.csv')
+            files.append(job['name'] + '.events.csv')
+
+    return dict(entry, files=files,
+                seconds=time.perf_counter() - t, pid=os.getpid())
+
+
+# the directory of a saved copy of data: the app's shared store if the
+# version is there, else a temporary store
+def _saved_dataset(datasets, data, tmp_dir):
+    store = datasets.shared
+    if store is None or not store.has(data.version):
+        store = dataset.SharedStore(tmp_dir)
+        store.save(data)
+    return os.path.join(store.path, data.version)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('spec', help='JSON file of jobs')
+    parser.add_argument('--out', default='reports', help='output directory')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='worker processes (default: one per core)')
+    parser.add_argument('--plotlyjs', choices=PLOTLYJS, default='directory',
+                        help="how the HTML files get plotly.js: from a CDN, one "
+                             "plotly.min.js next to them (the default), or inlined in each")
+    args = parser.parse_args(argv)
+
+    datasets = streamlit_charts.app_datasets()
+    data = datasets.current
+    try:
+        jobs = [resolve_job(job, data) for job in read_spec(args.spec)]
+    except (OSError, KeyError, ValueError) as e:
+        parser.error(f'bad spec {args.spec}: {e}')
+    names = [job['name'] for job in jobs]
+    if len(set(names)) != len(names):
+        parser.error('job names must be unique')
+
+    os.makedirs(args.out, exist_ok=True)
+    if args.plotlyjs == 'directory':
+        import plotly.offline
+        with open(os.path.join(args.out, 'plotly.min.js'), 'w') as f:
+            f.write(plotly.offline.get_plotlyjs())
+
+    t = time.perf_counter()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = _saved_dataset(datasets, data, tmp_dir)
+        # spawned, not forked: a forked worker would carry the refresher
+        # (restarted after the fork, see dataset) and loaded frame with it
+        with ProcessPoolExecutor(max_workers=args.workers,
+                                 mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_attach,
+                                 initargs=(path, args.plotlyjs)) as pool:
+            entries = []
+            for entry in pool.map(run_job, jobs, [args.out] * len(jobs)):
+                print(f"{entry['name']:<32} {entry['seconds'] * 1000:>9.1f} ms",
+                      file=sys.stderr)
+                entries.append(entry)
+    seconds = time.perf_counter() - t
+
+    with open(os.path.join(args.out, 'index.json'), 'w') as f:
+        json.dump(dict(version=data.version, workers=args.workers, seconds=seconds,
+                       jobs=entries), f, indent=1)
+    print(f'{len(jobs)} jobs on {args.workers} workers in {seconds:.2f} s '
+          f'({len(jobs) / seconds:.1f} jobs/s)', file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,358 @@
+"""Benchmarks for the load -> reformat -> stats -> figure -> serialize path.
+
+Runs offline on synthetic data (see synthetic_data) and times each stage on
+its own, plus the end-to-end request paths: the dash callback through the
+flask test client and the streamlit page functions (run bare, outside
+``streamlit run``). Results are written as JSON so runs can be compared.
+    python benchmarks.py --sizes 1000 100000 1000000 10000000 --out bench.json
+
+The full resolution figures are also built with every trace forced to SVG
+(``scatter``) and to WebGL (``scattergl``), recording the serialized payload
+size of each next to its build time. The dash callback is timed with and
+without gzip / brotli, uncached and from the precompressed payloads, with
+the bytes sent each time.
+
+The workbook parse is timed on its own synthetic .xlsx files, ``--excel-rows``
+rows with ``--excel-columns`` filler columns next to Date / Spread / SPX_Price
+(writing them is slow, so they are smaller than ``--sizes``): pd.read_excel
+of the whole sheet against excel_reader keeping only the columns used, with
+the peak memory traced by tracemalloc for each.
+
+``--series`` adds spread series to the synthetic data (the real workbook has
+one); the window stats of all of them come from one call either way.
+
+The apps are imported once against a small synthetic workbook, then pointed
+at each synthetic dataset in turn.
+"""
+import argparse
+import atexit
+import base64
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import plotly.utils
+
+# data_cache, dataset and the apps read these at import: a throwaway cache
+# and no shared store, so the synthetic datasets never land where the real
+# apps look for theirs; no background refresh replacing the benchmark
+# datasets, nor warm-up filling the result cache behind the timed stages
+# (it's timed on its own)
+CACHE_DIR = tempfile.mkdtemp(prefix='spread-benchmarks-')
+atexit.register(shutil.rmtree, CACHE_DIR, ignore_errors=True)
+os.environ['SPREAD_CACHE_DIR'] = CACHE_DIR
+os.environ['SPREAD_SHARED_DIR'] = ''
+os.environ['SPREAD_REFRESH_SECONDS'] = '0'
+os.environ['SPREAD_WARMUP'] = '0'
+
+import data_cache
+import dataset
+import downsample
+import streamlit_charts
+import synthetic_data
+
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000, 10000000]
+# rows and filler columns of the synthetic workbooks parsed by bench_excel
+DEFAULT_EXCEL_ROWS = [10000, 50000]
+DEFAULT_EXCEL_COLUMNS = 40
+# the go.Figure / unindexed variants are skipped above this many rows
+FULL_RESOLUTION_LIMIT = 1000000
+# fast_figures.WEBGL_POINTS forcing each trace type
+RENDER_PATHS = {'svg': float('inf'), 'webgl': 0}
+
+
+def timed(func, repeat):
+    seconds = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - t)
+    return seconds
+
+
+# import both apps against a small local workbook instead of google drive
+def load_apps(tmp_dir):
+    os.environ['SPREAD_SOURCE'] = synthetic_data.write_workbook(
+        os.path.join(tmp_dir, 'spread.xlsx'), 1000)
+
+    import earnings_spread
+    try:
+        import earnings_spread_streamlit
+    except ImportError:
+        earnings_spread_streamlit = None
+    return earnings_spread, earnings_spread_streamlit
+
+
+# point an app module at another dataset, building its derived indexes
+def use_frame(app, frame, version):
+    data = dataset.Dataset(frame, version)
+    app.datasets.publish(data)
+    app.window_results.memory.clear()
+    if hasattr(app, 'figure_responses'):
+        app.figure_responses.clear()
+    return data
+
+
+# body of the dash request the submit button sends
+def dash_callback_payload(start_date, end_date, n_clicks=1, series='spread', bands='std'):
+    return {
+        'output': 'my_graph.figure',
+        'outputs': {'id': 'my_graph', 'property': 'figure'},
+        'inputs': [{'id': 'submit_button', 'property': 'n_clicks', 'value': n_clicks}],
+        'changedPropIds': ['submit_button.n_clicks'],
+        'state': [{'id': 'my_date_range', 'property': 'start_date', 'value': str(start_date)},
+                  {'id': 'my_date_range', 'property': 'end_date', 'value': str(end_date)},
+                  {'id': 'my_series', 'property': 'value', 'value': series},
+                  {'id': 'my_bands', 'property': 'value', 'value': bands}],
+    }
+
+
+# build() with the traces drawn as the given render path
+def with_render_path(fast_figures, path, build):
+    def run():
+        saved = fast_figures.WEBGL_POINTS
+        fast_figures.WEBGL_POINTS = RENDER_PATHS[path]
+        try:
+            return build()
+        finally:
+            fast_figures.WEBGL_POINTS = saved
+    return run
+
+
+def dash_auth_headers(app):
+    username, password = app.USERNAME_PASSWORD_PAIRS[0]
+    token = base64.b64encode(f'{username}:{password}'.encode()).decode()
+    return {'Authorization': 'Basic ' + token}
+
+
+def bench_size(n_rows, es, ess, repeat, n_series=1):
+    raw = synthetic_data.raw_frame(n_rows, extra_series=n_series - 1)
+    frame = es.reformat_df(raw)
+    version = f'synthetic-{n_rows}x{n_series}'
+    start, end = frame.date.iloc[0], frame.date.iloc[-1]
+    # a two year window ending at the last date, like a typical zoomed view
+    window_start = max(start, end - pd.DateOffset(years=2))
+
+    data = use_frame(es, frame, version)
+    index, pyramid = data.index, data.pyramids['spread']
+    values = data.values
+
+    stages = {
+        'reformat_df': lambda: es.reformat_df(raw),
+        'build_window_index': lambda: es.window_stats.WindowIndex(frame.date.values, values,
+                                                                  data.series),
+        'build_pyramid': lambda: downsample.MinMaxPyramid(frame.date.values,
+                                                          frame.spread.values),
+        'rolling_bands_3y': lambda: es.window_stats.rolling_bands(index, values, 3),
+        'window_all_series': lambda: index.window(window_start, end),
+        'calc_stds_all': lambda: es.calc_stds(frame, start, end, index),
+        'calc_stds_2y': lambda: es.calc_stds(frame, window_start, end, index),
+        'build_quantile_index': lambda: es.window_stats.QuantileIndex(frame.spread.values),
+        'calc_percentiles_all': lambda: es.calc_percentiles(frame, start, end, index,
+                                                            data.quantiles()),
+        'calc_percentiles_2y': lambda: es.calc_percentiles(frame, window_start, end, index,
+                                                           data.quantiles()),
+    }
+
+    period, m, u1, d1, u2, d2 = es.calc_stds(frame, start, end, index)
+    stages['build_crossings_all'] = lambda: es.window_stats.CrossingIndex(
+        frame.date.values, frame.spread.values, (m, u1, d1, u2, d2))
+    stages['crossing_events_3y_2y'] = lambda: data.crossings(3).events(window_start, end)
+    stages['create_graph'] = lambda: es.create_graph(period, m, u1, d1, u2, d2, pyramid)
+    figure = es.create_graph(period, m, u1, d1, u2, d2, pyramid)
+    stages['serialize_figure'] = lambda: es.result_cache.figure_json(figure)
+    # what dash and the result cache used before figure_json's own encoder
+    stages['serialize_figure_plotly'] = lambda: json.dumps(figure,
+                                                           cls=plotly.utils.PlotlyJSONEncoder)
+
+    client = es.server.test_client()
+    headers = dash_auth_headers(es)
+    body = json.dumps(dash_callback_payload(start.date(), end.date()))
+
+    def dash_request(clear, accept_encoding=''):
+        if clear:
+            es.window_results.memory.clear()
+            es.figure_responses.clear()
+        response = client.post('/_dash-update-component', data=body,
+                               headers=dict(headers, **{'Accept-Encoding': accept_encoding}),
+                               content_type='application/json')
+        assert response.status_code == 200, response.status_code
+        return response
+
+    def warm():
+        es.window_results.memory.clear()
+        es.warmup.warm(data, es.window_figure)
+
+    stages['warmup'] = warm
+
+    # the cached requests are answered from the precompressed payloads
+    payload_bytes = {}
+    for stage, clear, accept_encoding in [('dash_callback', True, ''),
+                                          ('dash_callback_gzip', True, 'gzip'),
+                                          ('dash_callback_cached', False, ''),
+                                          ('dash_callback_cached_gzip', False, 'gzip'),
+                                          ('dash_callback_cached_br', False, 'br, gzip')]:
+        stages[stage] = lambda clear=clear, accept=accept_encoding: dash_request(clear, accept)
+        payload_bytes[stage] = len(stages[stage]().data)
+
+    if n_rows <= FULL_RESOLUTION_LIMIT:
+        stages['calc_stds_all_pandas'] = lambda: es.calc_stds(frame, start, end)
+        stages['calc_percentiles_all_pandas'] = lambda: es.calc_percentiles(frame, start, end)
+        stages['create_graph_full'] = lambda: es.create_graph(period, m, u1, d1, u2, d2)
+
+    # full resolution figures as SVG and as WebGL, and the size of each payload
+    if n_rows <= FULL_RESOLUTION_LIMIT:
+        figures = {'create_graph_full': lambda: es.create_graph(period, m, u1, d1, u2, d2)}
+        if ess is not None:
+            figures['create_inverse_graph_full'] = (
+                lambda: streamlit_charts.create_inverse_graph(frame))
+        for name, build in figures.items():
+            for path in RENDER_PATHS:
+                stage = f'{name}_{path}'
+                stages[stage] = with_render_path(es.fast_figures, path, build)
+                payload_bytes[stage] = len(es.result_cache.figure_json(stages[stage]()))
+
+    if ess is not None:
+        data = use_frame(ess, frame, version)
+
+        # the page functions also keep their figures in the session's page cache
+        def earnings_recalc():
+            ess.window_results.memory.clear()
+            ess.session_state().pop('_page_cache', None)
+            ess.earnings_recalc()
+
+        def adjuted_pe():
+            ess.window_results.memory.clear()
+            ess.session_state().pop('_page_cache', None)
+            ess.adjuted_pe()
+
+        stages['create_std_graph'] = lambda: streamlit_charts.create_std_graph(
+            period, m, u1, d1, u2, d2, True, pyramid)
+        stages['create_inverse_graph'] = lambda: streamlit_charts.create_inverse_graph(
+            frame, (data.inverse_pyramid, data.spx_pyramid))
+        pe_start, pe_end = data.index.slice(window_start, end)
+        stages['inverse_extrema_2y'] = lambda: data.inverse_pyramid.window_extrema(pe_start,
+                                                                                 pe_end)
+        stages['streamlit_earnings_recalc'] = earnings_recalc
+        stages['streamlit_adjuted_pe'] = adjuted_pe
+
+        # a whole script rerun past the login (what every widget click costs),
+        # in a session that drew this page before and in a new one
+        def rerun(new_session):
+            state = ess.session_state()
+            state['logged_in'] = True
+            if new_session:
+                state.pop('_page_cache', None)
+            ess.create_app_with_pages()
+
+        stages['streamlit_rerun'] = lambda: rerun(False)
+        stages['streamlit_rerun_new_session'] = lambda: rerun(True)
+        if n_rows <= FULL_RESOLUTION_LIMIT:
+            stages['create_inverse_graph_full'] = (
+                lambda: streamlit_charts.create_inverse_graph(frame))
+
+    results = []
+    for stage, func in stages.items():
+        seconds = timed(func, repeat)
+        result = dict(rows=n_rows, series=n_series, stage=stage, repeat=repeat,
+                      seconds=seconds,
+                      min=min(seconds), median=statistics.median(seconds),
+                      mean=statistics.mean(seconds))
+        line = f"{n_rows:>10,} {stage:<32} {min(seconds) * 1000:>11.3f} ms"
+        if stage in payload_bytes:
+            result['bytes'] = payload_bytes[stage]
+            line += f" {payload_bytes[stage] / 2**20:>9.2f} MB"
+        results.append(result)
+        print(line, file=sys.stderr)
+    return results
+
+
+# peak bytes allocated by one call of func
+def traced_peak(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_excel(n_rows, n_columns, es, repeat, tmp_dir):
+    path = synthetic_data.write_workbook(os.path.join(tmp_dir, f'wide-{n_rows}.xlsx'), n_rows,
+                                         extra_columns=n_columns)
+    with open(path, 'rb') as f:
+        content = f.read()
+
+    stages = {
+        'parse_excel_read_excel': lambda: data_cache.read_workbook(content),
+        'parse_excel_columns': lambda: data_cache.read_workbook(content, es.SOURCE_COLUMNS),
+        'parse_excel_columns_reformat': lambda: es.reformat_df(
+            data_cache.read_workbook(content, es.SOURCE_COLUMNS)),
+    }
+
+    results = []
+    for stage, func in stages.items():
+        seconds = timed(func, repeat)
+        peak = traced_peak(func)
+        results.append(dict(rows=n_rows, columns=n_columns + 3, stage=stage, repeat=repeat,
+                            seconds=seconds, min=min(seconds),
+                            median=statistics.median(seconds), mean=statistics.mean(seconds),
+                            bytes=len(content), peak_bytes=peak))
+        print(f"{n_rows:>10,} {stage:<32} {min(seconds) * 1000:>11.3f} ms"
+              f" {peak / 2**20:>9.2f} MB peak", file=sys.stderr)
+    return results
+
+
+def environment():
+    import plotly
+    return dict(timestamp=datetime.now().isoformat(timespec='seconds'),
+                python=platform.python_version(),
+                platform=platform.platform(),
+                numpy=np.__version__,
+                pandas=pd.__version__,
+                plotly=plotly.__version__)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help='row counts of the synthetic datasets')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per stage')
+    parser.add_argument('--series', type=int, default=1, help='spread series per dataset')
+    parser.add_argument('--excel-rows', type=int, nargs='*', default=DEFAULT_EXCEL_ROWS,
+                        help='row counts of the synthetic workbooks parsed')
+    parser.add_argument('--excel-columns', type=int, default=DEFAULT_EXCEL_COLUMNS,
+                        help='filler columns of the synthetic workbooks')
+    parser.add_argument('--out', default='-', help="JSON output file ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        es, ess = load_apps(tmp_dir)
+        if ess is None:
+            print('streamlit not importable, skipping the streamlit stages', file=sys.stderr)
+
+        results = []
+        for n_rows in args.excel_rows:
+            results += bench_excel(n_rows, args.excel_columns, es, args.repeat, tmp_dir)
+        for n_rows in args.sizes:
+            results += bench_size(n_rows, es, ess, args.repeat, args.series)
+
+    report = dict(environment=environment(), results=results)
+    if args.out == '-':
+        json.dump(report, sys.stdout, indent=1)
+    else:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
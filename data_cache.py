@@ -0,0 +1,223 @@
+"""Local on-disk cache for the reformatted spread workbook.
+
+The reformatted frame is stored as one ``.npy`` file per column so it can be
+memory-mapped back without touching the .xlsx. An entry is keyed on the source
+(url or path) and validated against a sha256 of the source bytes and the
+format the frame was made in (FORMAT, the columns read and the code of the
+reformat function), so changing any of those rebuilds it; for http
+sources the ETag / Last-Modified headers are also sent so an unchanged file
+can be answered with a 304 and never downloaded. When the workbook did
+change, only the rows appended since the cached version are reformatted.
+    frame, version = data_cache.load_frame(url, reformat_df, columns=SOURCE_COLUMNS)
+With ``columns`` an .xlsx is read by excel_reader, keeping only the columns
+reformat_df uses, instead of pd.read_excel of the whole sheet.
+"""
+import hashlib
+import inspect
+import io
+import json
+import os
+import shutil
+import tempfile
+import urllib.error
+import urllib.request
+
+import numpy as np
+import pandas as pd
+
+import excel_reader
+import metrics
+from spread_store import SpreadStore
+
+FETCH_TIMEOUT = 30
+CACHE_DIR = os.environ.get('SPREAD_CACHE_DIR',
+                           os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache'))
+# bumped when the stored layout changes
+FORMAT = 2
+# versions kept per entry: the one just stored and the one before it, which
+# another process may have read from meta.json and not mapped yet
+KEEP_VERSIONS = 2
+
+
+# google drive share links -> direct download url; anything else (another
+# url, a local path) is returned as is
+def drive_download_url(url):
+    if 'drive.google.com/file/d/' not in url:
+        return url
+    file_id = url.split('/')[-2]
+    return "https://drive.google.com/uc?id=" + file_id
+
+
+# the raw sheet; with ``columns`` (a header regex) only the matching columns
+# of an .xlsx are read
+def read_workbook(content, columns=None):
+    if columns is not None and content[:4] == b'PK\x03\x04':
+        return excel_reader.read_columns(content, columns)
+    return pd.read_excel(io.BytesIO(content))
+
+
+def _is_http(source):
+    return source.startswith('http://') or source.startswith('https://')
+
+
+def _entry_dir(source, cache_dir):
+    key = hashlib.sha1(source.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_dir, key)
+
+
+# the format a frame is made in: FORMAT, the columns read and the code of
+# the reformat function (its name, if the source isn't available)
+def _format(reformat, columns):
+    try:
+        code = inspect.getsource(reformat)
+    except (OSError, TypeError):
+        code = getattr(reformat, '__qualname__', repr(reformat))
+    return hashlib.sha1(json.dumps([FORMAT, columns, code]).encode()).hexdigest()[:16]
+
+
+# the version of a frame: the source bytes' sha256 and its format
+def _version(digest, fmt):
+    return hashlib.sha256(f'{digest}:{fmt}'.encode()).hexdigest()
+
+
+# the entry's meta.json, or None if there is none or it was made in
+# another format
+def _read_meta(entry, fmt):
+    try:
+        with open(os.path.join(entry, 'meta.json')) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return meta if meta.get('format') == fmt else None
+
+
+def _write_meta(entry, meta):
+    fd, tmp = tempfile.mkstemp(dir=entry, suffix='.json')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp, os.path.join(entry, 'meta.json'))
+
+
+# fetch the source bytes, or None if the server says our copy is current
+def _fetch(source, meta):
+    if not _is_http(source):
+        path = source[len('file://'):] if source.startswith('file://') else source
+        with open(path, 'rb') as f:
+            return f.read(), {}
+
+    headers = {}
+    if meta is not None:
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+    request = urllib.request.Request(source, headers=headers)
+    try:
+        with urllib.request.urlopen(request, timeout=FETCH_TIMEOUT) as response:
+            validators = {'etag': response.headers.get('ETag'),
+                          'last_modified': response.headers.get('Last-Modified')}
+            return response.read(), validators
+    except urllib.error.HTTPError as e:
+        if e.code == 304 and meta is not None:
+            return None, {}
+        raise
+
+
+def _load_version(entry, meta):
+    version_dir = os.path.join(entry, meta['version'])
+    columns = {c: np.load(os.path.join(version_dir, c + '.npy'), mmap_mode='r')
+               for c in meta['columns']}
+    return pd.DataFrame(columns, copy=False)
+
+
+def _has_version(entry, meta):
+    return meta is not None and os.path.isdir(os.path.join(entry, meta['version']))
+
+
+def _store_version(entry, version, frame):
+    version_dir = os.path.join(entry, version)
+    tmp_dir = tempfile.mkdtemp(dir=entry)
+    for c in frame.columns:
+        np.save(os.path.join(tmp_dir, c + '.npy'), frame[c].to_numpy(), allow_pickle=False)
+    try:
+        os.rename(tmp_dir, version_dir)
+    except OSError:
+        # another worker stored the same version first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    # drop all but the newest versions, leaving any half-written tmp dirs of
+    # other workers alone
+    others = [os.path.join(entry, name) for name in os.listdir(entry)
+              if name != version and not name.startswith('tmp')
+              and os.path.isdir(os.path.join(entry, name))]
+    others.sort(key=os.path.getmtime, reverse=True)
+    for path in others[KEEP_VERSIONS - 1:]:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+# the cached version as a store, so a changed workbook that only gained rows
+# is ingested incrementally
+def _previous_store(entry, meta, reformat):
+    if not _has_version(entry, meta) or 'raw_digest' not in meta:
+        return SpreadStore(reformat)
+    return SpreadStore.from_frame(reformat, _load_version(entry, meta),
+                                  meta['raw_rows'], meta['raw_digest'])
+
+
+def cached_frame(source, reformat, cache_dir=None, columns=None):
+    """The last ``(frame, version)`` cached for ``source`` by load_frame with
+    the same ``reformat`` and ``columns``, without going to the source, or
+    None if nothing is cached."""
+    entry = _entry_dir(source, cache_dir or CACHE_DIR)
+    meta = _read_meta(entry, _format(reformat, columns))
+    if not _has_version(entry, meta):
+        return None
+    return _load_version(entry, meta), meta['version']
+
+
+def load_frame(source, reformat, cache_dir=None, columns=None):
+    """Return ``(reformat(read_workbook(source, columns)), version)``, serving
+    the frame from the local cache when the source has not changed.
+
+    ``version`` is a sha256 of the source bytes and the format the frame was
+    made in. If the source can't be reached but a cached copy exists, the
+    cached copy is served.
+    """
+    entry = _entry_dir(source, cache_dir or CACHE_DIR)
+    os.makedirs(entry, exist_ok=True)
+    fmt = _format(reformat, columns)
+    meta = _read_meta(entry, fmt)
+
+    try:
+        with metrics.timer('fetch'):
+            content, validators = _fetch(source, meta)
+    except (OSError, urllib.error.URLError):
+        if not _has_version(entry, meta):
+            raise
+        return _load_version(entry, meta), meta['version']
+
+    if content is None:
+        return _load_version(entry, meta), meta['version']
+
+    digest = hashlib.sha256(content).hexdigest()
+    version = _version(digest, fmt)
+    if _has_version(entry, meta) and meta['version'] == version:
+        meta.update(validators)
+        _write_meta(entry, meta)
+        return _load_version(entry, meta), version
+
+    with metrics.timer('parse_excel'):
+        raw = read_workbook(content, columns)
+    with metrics.timer('reformat'):
+        store = _previous_store(entry, meta, reformat)
+        store.ingest(raw)
+    frame = store.frame()
+
+    _store_version(entry, version, frame)
+    meta = dict(validators, sha256=digest, format=fmt, version=version,
+                columns=list(frame.columns), raw_rows=store.raw_rows,
+                raw_digest=store.raw_digest)
+    _write_meta(entry, meta)
+
+    return frame, version
@@ -0,0 +1,553 @@
+"""Versioned snapshots of the spread data, refreshed in the background.
+
+A ``Dataset`` is one immutable version of the reformatted frame together with
+everything derived from it (window index, downsample pyramids, rolling
+bands, quantile and crossing indexes), all in read-only arrays. Every
+``spread`` / ``spread_*`` column of the frame is a series; they are held as
+one ``(rows, series)`` array on the shared date axis, so window stats for all
+of them come from one vectorized call.
+
+A ``Refresher`` holds the current one and replaces it wholesale when a
+background thread finds a new version, so a request that takes
+``refresher.current`` once at its start sees one consistent snapshot even if a
+swap happens halfway through.
+    datasets = dataset.refresher('app', source, load, load_cached)
+    data = datasets.current
+    data.frame, data.version, data.series, data.index, data.pyramids['spread']
+
+At startup the last cached version (if any) is served immediately and the
+first refresh runs in the background.
+
+Datasets are also saved, arrays and all, to a ``SharedStore`` directory
+per app and source (under SPREAD_SHARED_DIR, by default under the
+data_cache directory; set it empty to turn this off). Every process on the host memory-maps the same files, so
+gunicorn workers share one copy of the data and only one of them loads and
+builds each new version.
+"""
+import contextlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # windows: no cross-process lock
+    fcntl = None
+
+import data_cache
+import window_stats
+from downsample import MinMaxPyramid
+from window_stats import WindowIndex
+
+REFRESH_SECONDS = float(os.environ.get('SPREAD_REFRESH_SECONDS', 3600))
+SHARED_DIR = os.environ.get('SPREAD_SHARED_DIR', os.path.join(data_cache.CACHE_DIR, 'datasets'))
+# versions kept in a shared store: the current one and the one before it,
+# which workers that haven't refreshed yet may still be attaching
+KEEP_VERSIONS = 2
+
+# the series shown by default; its column also feeds the P/E page
+DEFAULT_SERIES = 'spread'
+
+log = logging.getLogger(__name__)
+
+
+# spread columns of a reformatted frame, the default one first
+def series_columns(frame):
+    return sorted((c for c in frame.columns if c == DEFAULT_SERIES or c.startswith('spread_')),
+                  key=lambda c: c != DEFAULT_SERIES)
+
+
+# name shown in the series selectors: spread_tech_sector -> Tech Sector
+def series_label(name):
+    if name == DEFAULT_SERIES:
+        return 'S&P 500'
+    return name[len('spread_'):].replace('_', ' ').title()
+
+
+def _prefixed(prefix, arrays):
+    return {prefix + name: a for name, a in arrays.items()}
+
+
+def _unprefixed(prefix, arrays):
+    return {name[len(prefix):]: a for name, a in arrays.items() if name.startswith(prefix)}
+
+
+# a copy of frame as read-only arrays: its float columns stacked in one
+# block (see _block_frame) and its dates, unless they already are read-only
+# (e.g. memory-mapped from the column cache)
+def _read_only_frame(frame):
+    columns = _block_columns(frame.columns)
+    block = np.stack([frame[c].to_numpy(dtype=float) for c in columns])
+    dates = frame.date.to_numpy()
+    if dates.flags.writeable:
+        dates = dates.copy()
+    _freeze([block, dates])
+    return _block_frame(dates, columns, block)
+
+
+def _freeze(arrays):
+    for a in arrays:
+        a.flags.writeable = False
+
+
+# the frame's columns other than date, as saved in one block
+def _block_columns(columns):
+    return [c for c in columns if c != 'date']
+
+
+# a frame of dates and the (columns, rows) float array block, built around
+# both without a copy. block is laid out as pandas holds a block of columns
+# of one dtype, so there is nothing for pandas to consolidate: a frame built
+# from separate float columns gets them merged into a new, private and
+# writable array (at construction in pandas 1.2, on the first .query in 1.5)
+def _block_frame(dates, columns, block):
+    return pd.concat([pd.DataFrame(dates[:, None], columns=['date'], copy=False),
+                      pd.DataFrame(block.T, columns=columns, copy=False)],
+                     axis=1, copy=False)
+
+
+class Dataset:
+    """One version of the data and its derived indexes.
+
+    Every array, the frame's columns included, is read-only: one Dataset is
+    shared by reference by every request or streamlit session in the process
+    (and, attached from a SharedStore, by every process), so nothing may
+    change it in place.
+    """
+    def __init__(self, frame, version):
+        frame = _read_only_frame(frame)
+        self.frame = frame
+        self.version = version
+        self.series = series_columns(frame)
+
+        dates = frame.date.values
+        self.values = np.column_stack([frame[c].to_numpy(dtype=float) for c in self.series])
+        self.index = WindowIndex(dates, self.values, self.series)
+        self.pyramids = {c: MinMaxPyramid(dates, self.values[:, j])
+                         for j, c in enumerate(self.series)}
+        self.inverse_pyramid = MinMaxPyramid(dates, frame.inverse.values)
+        self.spx_pyramid = MinMaxPyramid(dates, frame.spx_price.values)
+        self._rolling = {}
+        self._quantiles = {}
+        self._crossings = {}
+        self._freeze_indexes()
+
+    def _freeze_indexes(self):
+        _freeze([self.values, *self.index.arrays().values()])
+        for pyramid in self._all_pyramids().values():
+            _freeze(pyramid.lows + pyramid.highs)
+        for bands in self._rolling.values():
+            _freeze([bands.mean, bands.std, bands.zscore])
+
+    def extended(self, frame, version):
+        """The Dataset of ``frame`` if it is this one's frame with rows
+        appended, else None. Its window index, pyramids and rolling bands
+        are this one's extended with the new rows (see WindowIndex.extend
+        and MinMaxPyramid.extend) rather than rebuilt; quantile and crossing
+        indexes are built again on first use."""
+        old = len(self.frame)
+        columns = _block_columns(frame.columns)
+        if columns != _block_columns(self.frame.columns) or len(frame) <= old:
+            return None
+        frame = _read_only_frame(frame)
+        if not np.array_equal(frame.date.values[:old], self.frame.date.values) \
+                or not all(np.array_equal(frame[c].values[:old], self.frame[c].values,
+                                          equal_nan=True) for c in columns):
+            return None
+
+        data = Dataset.__new__(Dataset)
+        data.frame = frame
+        data.version = version
+        data.series = self.series
+        dates = frame.date.values
+        data.values = np.column_stack([frame[c].to_numpy(dtype=float) for c in data.series])
+        data.index = self.index.extend(dates, data.values[old:])
+        data.pyramids = {c: self.pyramids[c].extend(dates, data.values[:, j])
+                         for j, c in enumerate(data.series)}
+        data.inverse_pyramid = self.inverse_pyramid.extend(dates, frame.inverse.values)
+        data.spx_pyramid = self.spx_pyramid.extend(dates, frame.spx_price.values)
+        data._rolling = {years: window_stats.rolling_bands(data.index, data.values, years, bands)
+                         for years, bands in self._rolling.items()}
+        data._quantiles = {}
+        data._crossings = {}
+        data._freeze_indexes()
+        return data
+
+    def quantiles(self, series=DEFAULT_SERIES):
+        """The window_stats.QuantileIndex of one series, built on first use."""
+        index = self._quantiles.get(series)
+        if index is None:
+            index = window_stats.QuantileIndex(self.values[:, self.index.column(series)])
+            _freeze(index.arrays().values())
+            index = self._quantiles.setdefault(series, index)
+        return index
+
+    def rolling(self, years, series=DEFAULT_SERIES):
+        """Trailing ``years`` bands (window_stats.RollingBands) of one series.
+        The bands of all series are computed together on first use."""
+        bands = self._rolling.get(years)
+        if bands is None:
+            bands = window_stats.rolling_bands(self.index, self.values, years)
+            _freeze([bands.mean, bands.std, bands.zscore])
+            bands = self._rolling.setdefault(years, bands)
+        j = self.index.column(series)
+        return window_stats.RollingBands(bands.dates, bands.values[:, j], bands.mean[:, j],
+                                         bands.std[:, j], bands.zscore[:, j])
+
+    def crossings(self, years, series=DEFAULT_SERIES):
+        """The window_stats.CrossingIndex of one series against its trailing
+        ``years`` bands, built on first use; any window's crossings are a
+        binary search into it. Cheap to build, so it isn't saved."""
+        index = self._crossings.get((years, series))
+        if index is None:
+            bands = self.rolling(years, series)
+            index = window_stats.CrossingIndex(
+                bands.dates, bands.values,
+                (bands.mean, bands.mean + bands.std, bands.mean - bands.std,
+                 bands.mean + 2 * bands.std, bands.mean - 2 * bands.std))
+            _freeze(index.arrays().values())
+            index = self._crossings.setdefault((years, series), index)
+        return index
+
+    # every pyramid by name; series names all start with 'spread' so they
+    # can't clash with the other two
+    def _all_pyramids(self):
+        return dict(self.pyramids, inverse=self.inverse_pyramid, spx_price=self.spx_pyramid)
+
+    def save(self, path):
+        """Write the frame and every derived array to ``path`` as .npy files.
+        The rolling bands of all ROLLING_WINDOWS and the quantile indexes of
+        all series are computed first so they get shared too."""
+        for years in window_stats.ROLLING_WINDOWS.values():
+            self.rolling(years)
+        for series in self.series:
+            self.quantiles(series)
+
+        columns = _block_columns(self.frame.columns)
+        arrays = {'frame.date': self.frame.date.to_numpy(),
+                  'frame.block': np.stack([self.frame[c].to_numpy(dtype=float)
+                                           for c in columns])}
+        arrays['values'] = self.values
+        arrays.update(_prefixed('index.', self.index.arrays()))
+        for name, pyramid in self._all_pyramids().items():
+            arrays.update(_prefixed(f'pyramid.{name}.', pyramid.arrays()))
+        for years, bands in self._rolling.items():
+            for field in ('mean', 'std', 'zscore'):
+                arrays[f'rolling.{years}.{field}'] = getattr(bands, field)
+        for series, index in self._quantiles.items():
+            arrays.update(_prefixed(f'quantiles.{series}.', index.arrays()))
+
+        for name, a in arrays.items():
+            np.save(os.path.join(path, name + '.npy'), a, allow_pickle=False)
+        meta = dict(version=self.version, series=self.series, columns=columns,
+                    pyramids=list(self._all_pyramids()), rolling=list(self._rolling),
+                    quantiles=list(self._quantiles), arrays=list(arrays))
+        with open(os.path.join(path, 'dataset.json'), 'w') as f:
+            json.dump(meta, f)
+
+    @classmethod
+    def attach(cls, path):
+        """The Dataset saved to ``path``, every array memory-mapped read-only
+        so processes attaching the same files share their pages."""
+        with open(os.path.join(path, 'dataset.json')) as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+                  for name in meta['arrays']}
+
+        data = cls.__new__(cls)
+        data.version = meta['version']
+        data.series = meta['series']
+        columns = _block_columns(meta['columns'])
+        if 'frame.block' in arrays:
+            block = arrays['frame.block']
+        else:  # saved a column per file, before the block layout
+            block = np.stack([arrays['frame.' + c].astype(float) for c in columns])
+            block.flags.writeable = False
+        data.frame = _block_frame(arrays['frame.date'], columns, block)
+        data.values = arrays['values']
+
+        dates = arrays['frame.date']
+        data.index = WindowIndex.from_arrays(dates, _unprefixed('index.', arrays), data.series)
+        pyramids = {}
+        for name in meta['pyramids']:
+            if name in data.series:
+                values = data.values[:, data.series.index(name)]
+            else:
+                values = data.frame[name].to_numpy()
+            pyramids[name] = MinMaxPyramid.from_arrays(dates, values,
+                                                       _unprefixed(f'pyramid.{name}.', arrays))
+        data.inverse_pyramid = pyramids.pop('inverse')
+        data.spx_pyramid = pyramids.pop('spx_price')
+        data.pyramids = pyramids
+
+        data._rolling = {}
+        for years in meta['rolling']:
+            data._rolling[years] = window_stats.RollingBands(
+                dates, data.values, *(arrays[f'rolling.{years}.{field}']
+                                      for field in ('mean', 'std', 'zscore')))
+        data._crossings = {}
+        data._quantiles = {
+            series: window_stats.QuantileIndex.from_arrays(
+                _unprefixed(f'quantiles.{series}.', arrays))
+            for series in meta.get('quantiles', [])}
+        return data
+
+
+class SharedStore:
+    """Saved Datasets under ``path`` for every process on the host to attach.
+
+    Each version is written to a temporary directory and renamed into place,
+    then the ``current`` file is replaced to name it, so readers never see a
+    half-written version. Versions past the newest KEEP_VERSIONS are deleted;
+    processes that still have one mapped keep their pages until they swap.
+    ``lock`` serializes loading and building across processes.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    @contextlib.contextmanager
+    def lock(self):
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, '.lock'), 'a') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def has(self, version):
+        return os.path.isdir(os.path.join(self.path, version))
+
+    def current(self):
+        """``(version, seconds since it was last confirmed)`` of the current
+        version, or ``(None, None)``."""
+        current = os.path.join(self.path, 'current')
+        try:
+            with open(current) as f:
+                version = f.read().strip()
+            age = time.time() - os.path.getmtime(current)
+        except OSError:
+            return None, None
+        if not version or not self.has(version):
+            return None, None
+        return version, age
+
+    def attach(self, version):
+        return Dataset.attach(os.path.join(self.path, version))
+
+    def save(self, data):
+        """Save ``data`` unless it is already there and make it current."""
+        if not self.has(data.version):
+            tmp_dir = tempfile.mkdtemp(dir=self.path)
+            data.save(tmp_dir)
+            os.rename(tmp_dir, os.path.join(self.path, data.version))
+        self.set_current(data.version)
+        self._prune()
+
+    def set_current(self, version):
+        fd, tmp = tempfile.mkstemp(dir=self.path)
+        with os.fdopen(fd, 'w') as f:
+            f.write(version)
+        os.replace(tmp, os.path.join(self.path, 'current'))
+
+    # drop all but the newest versions, leaving tmp dirs of other builders
+    def _prune(self):
+        versions = [os.path.join(self.path, name) for name in os.listdir(self.path)
+                    if not name.startswith('tmp')
+                    and os.path.isdir(os.path.join(self.path, name))]
+        versions.sort(key=os.path.getmtime, reverse=True)
+        for path in versions[KEEP_VERSIONS:]:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+class Refresher:
+    """Keeps ``current`` pointed at the newest Dataset.
+
+    ``load()`` returns ``(frame, version)`` from the source; ``load_cached()``
+    returns the last locally cached ``(frame, version)`` or None. With
+    ``interval`` <= 0 there is no background thread and ``start`` loads
+    from the source.
+
+    With a ``shared`` SharedStore, each version is built once, saved there
+    and attached from there. A version another process confirmed less than
+    ``interval`` ago is attached without going to the source at all.
+
+    Functions added with ``add_listener`` are called with each Dataset as it
+    is published.
+    """
+    def __init__(self, load, load_cached=None, interval=REFRESH_SECONDS, shared=None):
+        self.load = load
+        self.load_cached = load_cached
+        self.interval = interval
+        self.shared = shared
+        self.last_error = None
+        self._current = None
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._listeners = []
+        self._listeners_lock = threading.Lock()
+
+    @property
+    def current(self):
+        return self._current
+
+    def publish(self, data):
+        # a single reference assignment, so readers see the old or new one
+        self._current = data
+        log.info('published dataset version %s (%d rows)', data.version[:12], len(data.frame))
+        for _, listener in list(self._listeners):
+            listener(data)
+
+    def add_listener(self, listener, name=None):
+        """Call ``listener(data)`` on each published Dataset, starting with
+        the current one. Adding a listener under a ``name`` that is already
+        taken only replaces it (a streamlit rerun adding its listener again
+        doesn't run it again)."""
+        with self._listeners_lock:
+            for i, (other, _) in enumerate(self._listeners):
+                if name is not None and other == name:
+                    self._listeners[i] = (name, listener)
+                    return
+            self._listeners.append((name, listener))
+        if self._current is not None:
+            listener(self._current)
+
+    def _shared_lock(self):
+        return self.shared.lock() if self.shared is not None else contextlib.nullcontext()
+
+    # a new Dataset of a loaded version, extending the current one's indexes
+    # if the frame only gained rows
+    def _build(self, frame, version):
+        if self._current is not None:
+            data = self._current.extended(frame, version)
+            if data is not None:
+                return data
+        return Dataset(frame, version)
+
+    # the Dataset for a loaded version: attached from the shared store, built
+    # and saved there first if no one has yet
+    def _dataset(self, frame, version):
+        if self.shared is None:
+            return self._build(frame, version)
+        if self.shared.has(version):
+            self.shared.set_current(version)
+        else:
+            self.shared.save(self._build(frame, version))
+        return self.shared.attach(version)
+
+    # the shared current version if another process confirmed it recently
+    def _recent_shared(self):
+        if self.shared is None or self.interval <= 0:
+            return None
+        version, age = self.shared.current()
+        if version is None or age >= self.interval:
+            return None
+        return version
+
+    def refresh(self):
+        """Load from the source and publish a new Dataset if the version
+        changed. Returns True if it did."""
+        with self._refresh_lock, self._shared_lock():
+            version = self._recent_shared()
+            if version is not None:
+                if self._current is not None and self._current.version == version:
+                    return False
+                self.publish(self.shared.attach(version))
+                return True
+
+            frame, version = self.load()
+            if self._current is not None and self._current.version == version:
+                if self.shared is not None:
+                    self.shared.set_current(version)
+                return False
+            self.publish(self._dataset(frame, version))
+            return True
+
+    # the shared current version, else the locally cached one, or None
+    def _cached_dataset(self):
+        with self._refresh_lock, self._shared_lock():
+            if self.shared is not None:
+                version, _ = self.shared.current()
+                if version is not None:
+                    return self.shared.attach(version)
+            cached = self.load_cached() if self.load_cached else None
+            if cached is not None:
+                return self._dataset(*cached)
+        return None
+
+    def start(self):
+        data = self._cached_dataset() if self.interval > 0 else None
+        if data is not None:
+            self.publish(data)
+            first_wait = 0
+        else:
+            self.refresh()
+            first_wait = self.interval
+
+        if self.interval > 0:
+            self._start_thread(first_wait)
+            # gunicorn --preload forks the workers after this ran in the
+            # master, and threads don't survive a fork
+            if hasattr(os, 'register_at_fork'):
+                os.register_at_fork(after_in_child=self._after_fork)
+        return self
+
+    def _start_thread(self, wait):
+        self._thread = threading.Thread(target=self._run, args=(wait,),
+                                        name='dataset-refresher', daemon=True)
+        self._thread.start()
+
+    def _after_fork(self):
+        self._refresh_lock = threading.Lock()
+        if not self._stop.is_set():
+            self._start_thread(self.interval)
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self, wait):
+        while not self._stop.wait(wait):
+            try:
+                self.refresh()
+                self.last_error = None
+            except Exception as e:
+                # keep serving the current version and try again next time
+                self.last_error = e
+                log.exception('dataset refresh failed')
+            wait = self.interval
+
+
+# refreshers by name; module level so streamlit reruns share one
+_refreshers = {}
+_refreshers_lock = threading.Lock()
+
+
+def store_dir(name, source, shared_dir=None):
+    """The SharedStore directory of app ``name``'s datasets of ``source``,
+    under ``shared_dir`` (default SHARED_DIR)."""
+    return data_cache._entry_dir(source, os.path.join(shared_dir or SHARED_DIR, name))
+
+
+def refresher(name, source, load, load_cached=None, interval=REFRESH_SECONDS):
+    """The started Refresher registered under ``name`` for ``source`` (the
+    url or path ``load`` reads), created on first call.
+
+    Its datasets are shared through a directory under SHARED_DIR/<name> keyed
+    on the source, as data_cache keys its entries, unless SHARED_DIR is empty;
+    a version saved from another source is never served for this one.
+    """
+    with _refreshers_lock:
+        if (name, source) not in _refreshers:
+            shared = SharedStore(store_dir(name, source)) if SHARED_DIR else None
+            _refreshers[name, source] = Refresher(load, load_cached, interval, shared).start()
+        return _refreshers[name, source]
@@ -0,0 +1,190 @@
+"""Min/max decimation of long series for plotting.
+
+A chart can't show more than a couple of points per pixel column, so for long
+windows only the lowest and highest point of each bucket of rows is sent.
+That keeps every peak and trough (and so the axis ranges) exactly, as well as
+the first and last points.
+
+``MinMaxPyramid`` precomputes the per-bucket min/max rows for buckets of
+2, 4, 8, ... rows, each level built from the one below it, so a window query
+reads the coarsest level that still gives enough points instead of scanning
+the raw rows:
+    pyramid = MinMaxPyramid(df.date.values, df.spread.values)
+    dates, spread = pyramid.decimate(start_date, end_date)
+
+The same levels answer the min and max of any window from at most two
+buckets per level, for axis ranges without reading the window's rows:
+    low, high = pyramid.extrema(start_date, end_date)
+
+When the series only gains rows, ``extend`` keeps the buckets of old rows
+and merges only the rest:
+    pyramid = pyramid.extend(df.date.values, df.spread.values)
+
+Statistics should still be computed on the full series.
+"""
+import os
+
+import numpy as np
+
+from window_stats import to_datetime64
+
+# approximate plot width in pixels; two points (min and max) per pixel
+CHART_WIDTH = int(os.environ.get('CHART_WIDTH', 1400))
+TARGET_POINTS = 2 * CHART_WIDTH
+
+
+# pick, for each pair of neighbouring buckets, the row with the lower (or
+# higher) value
+def _merge_level(idx, key, pick_lower):
+    if len(idx) % 2:
+        idx = np.append(idx, idx[-1])
+    left, right = idx[0::2], idx[1::2]
+    if pick_lower:
+        take_right = key[right] < key[left]
+    else:
+        take_right = key[right] > key[left]
+    return np.where(take_right, right, left)
+
+
+class MinMaxPyramid:
+    """Row positions of the min and max of each 2**k row bucket, per level."""
+    def __init__(self, dates, values):
+        self.dates = np.asarray(dates, dtype='datetime64[ns]')
+        self.values = np.asarray(values, dtype=float)
+
+        # NaNs should never be picked as an extreme
+        nan = np.isnan(self.values)
+        lo_key = np.where(nan, np.inf, self.values)
+        hi_key = np.where(nan, -np.inf, self.values)
+
+        self._build(lo_key, hi_key)
+
+    # merge the levels above level 0, keeping the first ``kept`` rows'
+    # buckets of ``previous`` (a pyramid of those rows)
+    def _build(self, lo_key, hi_key, previous=None, kept=0):
+        rows = np.arange(len(self.values))
+        self.lows = [rows]
+        self.highs = [rows]
+        while len(self.lows[-1]) > 1:
+            level = len(self.lows)
+            # buckets of this level made of old rows only
+            kept //= 2
+            if previous is None or level >= len(previous.lows):
+                kept = 0
+            self.lows.append(np.concatenate((
+                previous.lows[level][:kept] if kept else rows[:0],
+                _merge_level(self.lows[-1][2 * kept:], lo_key, True))))
+            self.highs.append(np.concatenate((
+                previous.highs[level][:kept] if kept else rows[:0],
+                _merge_level(self.highs[-1][2 * kept:], hi_key, False))))
+
+    @classmethod
+    def from_arrays(cls, dates, values, arrays):
+        """A pyramid over the levels saved by ``arrays`` (e.g. memory
+        mapped), without rebuilding them."""
+        pyramid = cls.__new__(cls)
+        pyramid.dates = dates
+        pyramid.values = values
+        # level 0 is every row and is never read by rows(); a range stands
+        # in for np.arange so attaching doesn't allocate per process
+        rows = range(len(values))
+        n_levels = 1 + sum(1 for name in arrays if name.startswith('lows.'))
+        pyramid.lows = [rows] + [arrays[f'lows.{k}'] for k in range(1, n_levels)]
+        pyramid.highs = [rows] + [arrays[f'highs.{k}'] for k in range(1, n_levels)]
+        return pyramid
+
+    def extend(self, dates, values):
+        """The pyramid of ``values`` (dated ``dates``), this pyramid's values
+        followed by new rows. Buckets of old rows only are kept as they are,
+        so only the new rows' buckets (and one per level above them) are
+        merged."""
+        pyramid = MinMaxPyramid.__new__(MinMaxPyramid)
+        pyramid.dates = np.asarray(dates, dtype='datetime64[ns]')
+        pyramid.values = np.asarray(values, dtype=float)
+        nan = np.isnan(pyramid.values)
+        pyramid._build(np.where(nan, np.inf, pyramid.values),
+                       np.where(nan, -np.inf, pyramid.values), self, len(self))
+        return pyramid
+
+    # level 0 is every row and is left out
+    def arrays(self):
+        out = {}
+        for k in range(1, len(self.lows)):
+            out[f'lows.{k}'] = self.lows[k]
+            out[f'highs.{k}'] = self.highs[k]
+        return out
+
+    def __len__(self):
+        return len(self.values)
+
+    # min and max rows of the raw slice [start, stop)
+    def _edge(self, start, stop):
+        if start >= stop:
+            return np.empty(0, dtype=int)
+        part = self.values[start:stop]
+        if np.isnan(part).all():
+            return np.array([start])
+        return start + np.array([np.nanargmin(part), np.nanargmax(part)])
+
+    def rows(self, start, stop, n_points=None):
+        """Sorted row positions to plot for rows ``[start, stop)``."""
+        n_points = n_points or TARGET_POINTS
+        count = stop - start
+        if count <= n_points:
+            return np.arange(start, stop)
+
+        # smallest bucket size that gives at most n_points (2 per bucket)
+        level = int(np.ceil(np.log2(2 * count / n_points)))
+        level = min(level, len(self.lows) - 1)
+        size = 1 << level
+
+        first = -(-start // size)
+        last = stop // size
+        picked = [np.array([start, stop - 1]),
+                  self.lows[level][first:last], self.highs[level][first:last],
+                  self._edge(start, min(first * size, stop)),
+                  self._edge(max(last * size, start), stop)]
+        return np.unique(np.concatenate(picked))
+
+    def window_extrema(self, start, stop):
+        """``(min, max)`` of rows ``[start, stop)``, ignoring NaNs (NaN if
+        there are no values)."""
+        # cover the rows with whole buckets, climbing a level at a time as in
+        # a bottom-up segment tree query
+        picked = []
+        level = 0
+        while start < stop:
+            if start & 1:
+                picked.append((level, start))
+                start += 1
+            if stop & 1:
+                stop -= 1
+                picked.append((level, stop))
+            start, stop, level = start >> 1, stop >> 1, level + 1
+        if not picked:
+            return np.nan, np.nan
+        lows = self.values[[self.lows[k][i] for k, i in picked]]
+        highs = self.values[[self.highs[k][i] for k, i in picked]]
+        if np.isnan(lows).all():
+            return np.nan, np.nan
+        return np.nanmin(lows), np.nanmax(highs)
+
+    def extrema(self, start_date, end_date):
+        """``(min, max)`` for ``start_date <= date <= end_date``."""
+        start = self.dates.searchsorted(to_datetime64(start_date), side='left')
+        stop = self.dates.searchsorted(to_datetime64(end_date), side='right')
+        return self.window_extrema(int(start), int(stop))
+
+    def decimate(self, start_date, end_date, n_points=None):
+        """Decimated ``(dates, values)`` for ``start_date <= date <= end_date``."""
+        start = self.dates.searchsorted(to_datetime64(start_date), side='left')
+        stop = self.dates.searchsorted(to_datetime64(end_date), side='right')
+        rows = self.rows(start, max(start, stop), n_points)
+        return self.dates[rows], self.values[rows]
+
+    def decimate_window(self, dates):
+        """Decimated ``(dates, values)`` over the window spanned by ``dates``,
+        which should be a contiguous date window of this series."""
+        if len(dates) == 0:
+            return self.dates[:0], self.values[:0]
+        return self.decimate(dates[0], dates[-1])
@@ -1,37 +1,147 @@
 import dash
 import dash_auth
+import flask
 import dash_core_components as dcc
 import dash_html_components as html
 from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
 import pandas as pd
+import json
+import os
+import time
 from datetime import datetime
-import plotly.express as px
-import plotly.graph_objects as go
-from plotly.graph_objs import *
-from plotly.graph_objs.scatter.marker import Line
-import numpy as np
 
-import plot_settings
+import data_cache
+import dataset
+import window_stats
+import fast_figures
+import result_cache
+import metrics
+import stats_api
+import warmup
 
 USERNAME_PASSWORD_PAIRS = [
     ['evan.mcgoff', 'meow']
 ]
 
 app = dash.Dash()
-auth = dash_auth.BasicAuth(app,USERNAME_PASSWORD_PAIRS)
 server = app.server
 
+# per-stage latency histograms and result cache counters, in the prometheus
+# text format; added before BasicAuth so it is password protected too
+@server.route('/metrics')
+def metrics_view():
+    gauges = metrics.flatten('spread_result_cache', window_results.stats())
+    gauges.update(metrics.flatten('spread_payload_cache', figure_responses.stats()))
+    return flask.Response(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
+
+# batch window statistics for notebooks and reports (see stats_api); added
+# before BasicAuth so it is password protected too
+@server.route('/api/stats', methods=['GET', 'POST'])
+@server.route('/api/stats.<fmt>', methods=['GET', 'POST'])
+def stats_view(fmt='json'):
+    data = datasets.current
+    try:
+        mimetype, chunks = stats_api.stats_chunks(data, flask.request, fmt)
+    except stats_api.ApiError as e:
+        return flask.jsonify(error=str(e)), e.status
+    # gzipped here, a chunk at a time, for clients that take it: flask-compress
+    # would read the whole stream (get_data) to compress it, and leaves
+    # responses with a Content-Encoding alone. Newer ones skip streams too
+    # with COMPRESS_STREAMS off (set below)
+    gzipped = flask.request.accept_encodings['gzip'] > 0
+    if gzipped:
+        chunks = stats_api.gzip_chunks(chunks)
+    response = flask.Response(flask.stream_with_context(chunks), mimetype=mimetype)
+    if gzipped:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    response.headers['X-Spread-Version'] = data.version
+    return response
+
+# bodies over the API's limit are refused by the server (for every route)
+server.config['MAX_CONTENT_LENGTH'] = stats_api.MAX_BYTES
+server.config['COMPRESS_STREAMS'] = False
+
+# time every request, labelled by the route it matched (not the path, which
+# any client can vary to add histograms without end)
+@server.before_request
+def start_request_timer():
+    flask.g.request_start = time.perf_counter()
+
+@server.after_request
+def stop_request_timer(response):
+    start = getattr(flask.g, 'request_start', None)
+    if start is not None:
+        rule = flask.request.url_rule
+        metrics.observe('request ' + (rule.rule if rule is not None else 'unmatched'),
+                        time.perf_counter() - start)
+    return response
+
+# figure callback responses, kept with their gzip / brotli encodings by
+# (dataset version, series, window rows, bands); a repeated request is answered
+# from here without going through dash's dispatch, so nothing is serialized
+# or compressed again. Wrapped before BasicAuth so it is password protected
+# too
+DISPATCH_VIEW = app.config.routes_pathname_prefix + '_dash-update-component'
+
+def payload_response(payload):
+    encoding, body = payload.encoded(flask.request.headers.get('Accept-Encoding', ''))
+    response = flask.Response(body, mimetype='application/json')
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+def figure_payloads(dispatch):
+    def view():
+        body = flask.request.get_json(silent=True) or {}
+        if body.get('output') != 'my_graph.figure':
+            return dispatch()
+        state = {f"{s.get('id')}.{s.get('property')}": s.get('value')
+                 for s in body.get('state', [])}
+        data = datasets.current
+        try:
+            start_row, stop_row = data.index.slice(state['my_date_range.start_date'][:10],
+                                                   state['my_date_range.end_date'][:10])
+            key = (data.version, state['my_series.value'], int(start_row), int(stop_row),
+                   state['my_bands.value'])
+        except (KeyError, TypeError, ValueError):
+            return dispatch()
+
+        payload = figure_responses.get(key)
+        if payload is None:
+            response = dispatch()
+            # only keep responses made from the same dataset version
+            if response.status_code != 200 or datasets.current is not data:
+                return response
+            payload = figure_responses.put(key, response.get_data())
+        return payload_response(payload)
+    return view
+
+server.view_functions[DISPATCH_VIEW] = figure_payloads(server.view_functions[DISPATCH_VIEW])
+
+auth = dash_auth.BasicAuth(app,USERNAME_PASSWORD_PAIRS)
+
 # function to get file from google drive
+# returns the reformatted frame and its version, served from the local
+# column cache when the workbook hasn't changed
 def pull_google_drive(url):
-    file_id = url.split('/')[-2]
-    dwn_url = "https://drive.google.com/uc?id=" + file_id
-    tmp = pd.read_excel(dwn_url)
+    return data_cache.load_frame(data_cache.drive_download_url(url), reformat_df,
+                                 columns=SOURCE_COLUMNS)
 
-    return tmp
+# the last version in the local column cache (or None), without downloading
+def cached_google_drive(url):
+    return data_cache.cached_frame(data_cache.drive_download_url(url), reformat_df,
+                                   columns=SOURCE_COLUMNS)
 
 # filter to columns needed and format names
+# besides Spread, any Spread_<name> columns (other indexes, sectors) are kept
+# as extra series; only these columns are read from the workbook
+SOURCE_COLUMNS = '^(Date|SPX_Price|Spread(_.+)?)$'
+
 def reformat_df(d):
-    tmp = d.filter(['Date', 'Spread', 'SPX_Price'])
+    tmp = d.filter(regex=SOURCE_COLUMNS)
     tmp.columns = [x.lower() for x in tmp.columns]
     tmp = tmp.assign(date=lambda t: pd.to_datetime(t.date),
                    inverse=lambda t: 1 / (t.spread / 100))
@@ -40,10 +150,20 @@ def reformat_df(d):
     return tmp
 
 # do date filter and recalculate stds
-def calc_stds(d, start_date, end_date):
-    df_period = d.query(f"date>=@start_date & date<=@end_date").reset_index(drop=True)
-    mean = df_period.spread.mean()
-    std = df_period.spread.std()
+# with a window_stats index the stats come from prefix sums and the returned
+# frame is a slice of d instead of a filtered copy; an index over several
+# series computes all of them in one call and the one asked for is picked out
+def calc_stds(d, start_date, end_date, index=None, series='spread'):
+    if index is None:
+        df_period = d.query(f"date>=@start_date & date<=@end_date").reset_index(drop=True)
+        mean = df_period[series].mean()
+        std = df_period[series].std()
+    else:
+        start, stop, mean, std = index.window(start_date, end_date)
+        if index.names is not None:
+            j = index.column(series)
+            mean, std = mean[j], std[j]
+        df_period = d.iloc[start:stop]
     std_1up = mean + std
     std_1down = mean - std
     std_2up = mean + 2*std
@@ -51,232 +171,155 @@ def calc_stds(d, start_date, end_date):
 
     return df_period, mean, std_1up, std_1down, std_2up, std_2down
 
-def create_graph(plot_df, mean, up1, down1, up2, down2):
-    fig = go.Figure()
-
-    fig.add_trace(go.Scatter(x=plot_df['date'],
-                             y=plot_df['spread']))
-
-    fig.update_traces(marker=dict(size=3))
-
-    hline_color = "black"  # "#848484"
-
-    fig.add_hline(y=mean,
-                  line_width=2,
-                  line_color=hline_color,
-                  annotation_text=f"{mean:,.2f} (mean)",
-                  annotation_position="bottom right"
-                  )
-
-    fig.add_hline(y=up1,
-                  line_dash="dash",
-                  line_width=1,
-                  line_color=hline_color,
-                  annotation_text=f"{up1:,.2f}",
-                  annotation_position="bottom right"
-                  )
-
-    fig.add_hline(y=up2,
-                  line_dash="dot",  # "dash"
-                  line_width=1,
-                  line_color=hline_color,
-                  annotation_text=f"{up2:,.2f}",
-                  annotation_position="bottom right"
-                  )
-
-    fig.add_hline(y=down1,
-                  line_dash="dash",
-                  line_width=1,
-                  line_color=hline_color,
-                  annotation_text=f"{down1:,.2f}",
-                  annotation_position="bottom right"
-                  )
-
-    fig.add_hline(y=down2,
-                  line_dash="dot",  # "dash"
-                  line_width=1,
-                  line_color=hline_color,
-                  annotation_text=f"{down2:,.2f}",
-                  annotation_position="bottom right"
-                  )
-
-    fig.update_xaxes(showgrid=False,
-                     range=[plot_df.date.min(), plot_df.date.max()])
-
-    fig.update_yaxes(showgrid=False,
-                     zeroline=False,
-                     title='Equity Risk Premium',
-                     ticksuffix="  ",
-                     range=[-.5, np.ceil(plot_df.spread.max())])
-
-    fig.update_layout(font_family="Avenir",
-                      font_color="#4c4c4c",
-                      font_size=14,
-                      showlegend=False,
-                      title=dict(font_size=22,
-                                 text="<b>Equity risk premium mainly between 15yr mean and -1 std in recent months</b>",
-                                 ),
-                      title_x=0.04,
-                      title_y=0.95,
-                      #                   title_pad_b=1000
-                      )
-
-    # annotations
-    annotations = []
-
-    points = [up2, up1, mean, down1, down2]
-    labels = ["+2\u03C3", "+1\u03C3", "mean", "-1\u03C3", "-2\u03C3"]
-
-    for p, l in zip(points, labels):
-        annotations.append(dict(xref='paper',
-                                x=1.005,
-                                y=p,
-                                xanchor='left',
-                                yanchor='middle',
-                                align='left',
-                                text=f"{p:.2f} ({l})",
-                                showarrow=False,
-                                font=dict(size=12, color=hline_color)
-                                ))
-
-    fig.update_layout(annotations=annotations, template=plot_settings.dockstreet_template)
-
-    fig.add_annotation(x=0.03,
-                       y=mean + .2,
-                       xref='paper',
-                       yref='y',
-                       xanchor='left',
-                       align='left',
-                       borderpad=5,
-                       text="Cheaper",
-                       axref='pixel',
-                       ayref='y',
-                       ax=0.25,
-                       ay=mean + 3.8,
-                       arrowhead=1,
-                       arrowsize=1.,
-                       arrowside='start',
-                       arrowwidth=1.5,
-                       arrowcolor="#767676",
-                       showarrow=True,
-                       font=dict(size=15,
-                                 color="#767676"
-                                 ))
-
-    fig.add_annotation(x=0.03,
-                       y=mean - .2,
-                       xref='paper',
-                       yref='y',
-                       xanchor='left',
-                       align='left',
-                       borderpad=5,
-                       text="More Expensive",
-                       axref='pixel',
-                       ayref='y',
-                       ax=0.25,
-                       ay=mean - 3.8,
-                       arrowhead=1,
-                       arrowsize=1.,
-                       arrowside='start',
-                       arrowwidth=1.5,
-                       arrowcolor="#767676",
-                       showarrow=True,
-                       font=dict(size=15,
-                                 color="#767676"
-                                 ))
-
-    fig.update_layout(
-        xaxis=dict(
-            rangeselector=dict(
-                buttons=list([
-                    dict(count=1,
-                         label="1m",
-                         step="month",
-                         stepmode="backward"),
-                    dict(count=6,
-                         label="6m",
-                         step="month",
-                         stepmode="backward"),
-                    dict(count=1,
-                         label="YTD",
-                         step="year",
-                         stepmode="todate"),
-                    dict(count=1,
-                         label="1y",
-                         step="year",
-                         stepmode="backward"),
-                    dict(count=2,
-                         label="2y",
-                         step="year",
-                         stepmode="backward"),
-                    dict(step="all")
-                ])
-            ),
-            rangeslider=dict(
-                visible=True,
-                range=[plot_df.date.min(), plot_df.date.max()]
-            ),
-            type="date"
-        )
-    )
-
-    for ser in fig['data']:
-        ser['hovertemplate'] = "%{x|%b %-d, %Y}, %{y:.2f}<extra></extra>"
-
-    return fig
+# window median and percentile bands, the robust alternative to calc_stds,
+# returned in the same order as its mean and bands: median, p75, p25, p95, p5
+# with a window_stats index and QuantileIndex they come from the quantile
+# index's wavelet matrix in O(log n) instead of sorting the window
+def calc_percentiles(d, start_date, end_date, index=None, quantiles=None, series='spread'):
+    if quantiles is None:
+        df_period = d.query(f"date>=@start_date & date<=@end_date").reset_index(drop=True)
+        bands = df_period[series].quantile(window_stats.BAND_QUANTILES).values
+    else:
+        start, stop = index.slice(start_date, end_date)
+        bands = quantiles.quantile(start, stop, window_stats.BAND_QUANTILES)
+        df_period = d.iloc[start:stop]
+
+    return (df_period, *bands)
+
+# figure is built as a plain dict (see fast_figures) to skip plotly's validation
+# with a downsample pyramid for the series, long windows are decimated to
+# about the chart width
+# with percentiles the bands are calc_percentiles' median and percentiles
+def create_graph(plot_df, mean, up1, down1, up2, down2, pyramid=None, series='spread',
+                 percentiles=False):
+    if pyramid is None:
+        dates, spread = plot_df['date'].values, plot_df[series].values
+    else:
+        dates, spread = pyramid.decimate_window(plot_df['date'].values)
+
+    return fast_figures.spread_figure(dates, spread,
+                                      (mean, up1, down1, up2, down2),
+                                      style='dash',
+                                      series_label=None if series == dataset.DEFAULT_SERIES
+                                      else dataset.series_label(series),
+                                      percentiles=percentiles)
+
+# the band modes offered next to the date range
+BAND_MODES = {'std': 'Mean and \u03C3', 'percentiles': 'Median and percentiles'}
+
+# the figure for a window of one series of one dataset version, reusing the
+# stats and figure if this window was drawn before; keyed on the rows the
+# window covers, so e.g. an end date past the last row is the same window
+def window_figure(data, start, end, series=dataset.DEFAULT_SERIES, bands='std'):
+    start_row, stop_row = data.index.slice(start, end)
+    key = (data.version, series, int(start_row), int(stop_row), bands)
+    result = window_results.get(key)
+    if result is None:
+        percentiles = bands == 'percentiles'
+        if percentiles:
+            with metrics.timer('calc_percentiles'):
+                df_date_filter, m, u1, d1, u2, d2 = calc_percentiles(
+                    data.frame, start, end, data.index, data.quantiles(series), series)
+        else:
+            with metrics.timer('calc_stds'):
+                df_date_filter, m, u1, d1, u2, d2 = calc_stds(data.frame, start, end, data.index,
+                                                              series)
+        with metrics.timer('figure'):
+            updated_figure = create_graph(df_date_filter, m, u1, d1, u2, d2,
+                                          data.pyramids[series], series, percentiles)
+        result = window_results.put(key, (m, u1, d1, u2, d2), updated_figure)
+
+    return json.loads(result.figure)
 
 # load the data from google drive
-url = "https://drive.google.com/file/d/16NBIP4qGtBkNbcxfUElMDjWiADryMa-G/view?usp=sharing"
-df = pull_google_drive(url)
-
-# format columns
-df = reformat_df(df)
-
-df_date_filter, m, u1, d1, u2, d2 = calc_stds(df, datetime(2007,1,1), datetime.today())
-
-updated_figure = create_graph(df_date_filter, m, u1, d1, u2, d2)
-
-# app layout
-app.layout = html.Div([
-    html.H1('Earnings Spread'),
-
-    html.Div([
-        html.H3('Enter a start and end date:', style={'paddingRight':'30px'}),
-        dcc.DatePickerRange(id='my_date_range',
-                            min_date_allowed=df.date.min(),
-                            max_date_allowed=df.date.max(),
-                            start_date=datetime(2007,1,1),
-                            end_date=datetime.today()
-                            )
-    ], style={'display':'inline-block'}),
-
-    html.Div([
-        html.Button(id='submit_button',
-                    n_clicks=0,
-                    children='Submit',
-                    style={'fontSize':24, 'marginLeft':'30px'})
-    ], style={'display':'inline-block'}),
-
-    dcc.Graph(id='my_graph',
-              figure=updated_figure)
-])
+# SPREAD_SOURCE can point at another copy of the workbook (a url or local path)
+# the last cached version is served right away and a background thread
+# re-downloads every SPREAD_REFRESH_SECONDS, swapping in new versions whole;
+# each request takes datasets.current once and uses only that snapshot
+url = os.environ.get('SPREAD_SOURCE',
+                     "https://drive.google.com/file/d/16NBIP4qGtBkNbcxfUElMDjWiADryMa-G/view?usp=sharing")
+datasets = dataset.refresher('earnings_spread', url,
+                             lambda: pull_google_drive(url),
+                             lambda: cached_google_drive(url))
+window_results = result_cache.shared_cache()
+figure_responses = result_cache.payload_cache()
+# the default series' figures for the common windows (see warmup) are
+# computed as soon as each version is published
+warmup.on_publish(datasets, window_figure)
+
+# app layout, rebuilt on each page load so the date range follows the data
+def serve_layout():
+    data = datasets.current
+    df = data.frame
+    updated_figure = window_figure(data, datetime(2007,1,1), datetime.today())
+
+    return html.Div([
+        html.H1('Earnings Spread'),
+
+        html.Div([
+            html.H3('Enter a start and end date:', style={'paddingRight':'30px'}),
+            dcc.DatePickerRange(id='my_date_range',
+                                min_date_allowed=df.date.min(),
+                                max_date_allowed=df.date.max(),
+                                start_date=datetime(2007,1,1),
+                                end_date=datetime.today()
+                                )
+        ], style={'display':'inline-block'}),
+
+        html.Div([
+            html.H3('Series:', style={'paddingRight':'30px'}),
+            dcc.Dropdown(id='my_series',
+                         options=[{'label': dataset.series_label(s), 'value': s}
+                                  for s in data.series],
+                         value=dataset.DEFAULT_SERIES,
+                         clearable=False,
+                         style={'width':'250px'}
+                         )
+        ], style={'display':'inline-block', 'verticalAlign':'top', 'marginLeft':'30px'}),
+
+        html.Div([
+            html.H3('Bands:', style={'paddingRight':'30px'}),
+            dcc.Dropdown(id='my_bands',
+                         options=[{'label': label, 'value': mode}
+                                  for mode, label in BAND_MODES.items()],
+                         value='std',
+                         clearable=False,
+                         style={'width':'250px'}
+                         )
+        ], style={'display':'inline-block', 'verticalAlign':'top', 'marginLeft':'30px'}),
+
+        html.Div([
+            html.Button(id='submit_button',
+                        n_clicks=0,
+                        children='Submit',
+                        style={'fontSize':24, 'marginLeft':'30px'})
+        ], style={'display':'inline-block'}),
+
+        dcc.Graph(id='my_graph',
+                  figure=updated_figure)
+    ])
+
+app.layout = serve_layout
 
 @app.callback(Output('my_graph','figure'),
               [Input('submit_button','n_clicks')],
               [
                   State('my_date_range','start_date'),
-                  State('my_date_range','end_date')
+                  State('my_date_range','end_date'),
+                  State('my_series','value'),
+                  State('my_bands','value')
               ])
-def callback_dates(n_clicks, start_date, end_date):
+def callback_dates(n_clicks, start_date, end_date, series, bands):
     # when it gets passed into the input, converts it to a string
     start = datetime.strptime(start_date[:10], '%Y-%m-%d')
     end = datetime.strptime(end_date[:10], '%Y-%m-%d')
 
-    df_date_filter, m, u1, d1, u2, d2 = calc_stds(df, start, end)
-
-    updated_figure = create_graph(df_date_filter, m, u1, d1, u2, d2)
-
-    return updated_figure
+    with metrics.profiled('callback_dates'), metrics.timer('callback_dates'):
+        data = datasets.current
+        # a page loaded before a refresh may offer a series that is gone
+        if series not in data.series or bands not in BAND_MODES:
+            raise PreventUpdate
+        return window_figure(data, start, end, series, bands)
 
 if __name__ == '__main__':
     app.run_server()
@@ -1,374 +1,113 @@
 import streamlit as st
+import json
+import os
 import pandas as pd
-from datetime import datetime
-import plotly.express as px
-import plotly.graph_objects as go
-from plotly.graph_objs import *
-from plotly.graph_objs.scatter.marker import Line
-from plotly.subplots import make_subplots
-import numpy as np
-import plot_settings
+import dataset
+import metrics
+import warmup
 import logins
-from multiapp import MultiApp
+from streamlit_charts import (BAND_MODES, app_datasets, pe_result, window_result,
+                              window_results)
+from multiapp import MultiApp, page_cache, session_state
 
 st.set_page_config(layout='wide')
 
-# function to get file from google drive
-@st.cache
-def pull_google_drive(url):
-    file_id = url.split('/')[-2]
-    dwn_url = "https://drive.google.com/uc?id=" + file_id
-    tmp = pd.read_excel(dwn_url)
-
-    return tmp
-
-# filter to columns needed and format names
-def reformat_df(d):
-    tmp = d.filter(['Date', 'Spread', 'SPX_Price'])
-    tmp.columns = [x.lower() for x in tmp.columns]
-    tmp = tmp.assign(date=lambda t: pd.to_datetime(t.date),
-                   inverse=lambda t: 1 / (t.spread / 100))
-    tmp = tmp.sort_values(by='date').reset_index(drop=True)
-
-    return tmp
-
-# do date filter and recalculate stds
-def calc_stds(d, start_date, end_date):
-    df_period = d.query(f"date>=@start_date & date<=@end_date").reset_index(drop=True)
-    mean = df_period.spread.mean()
-    std = df_period.spread.std()
-    std_1up = mean + std
-    std_1down = mean - std
-    std_2up = mean + 2*std
-    std_2down = mean - 2*std
-
-    return df_period, mean, std_1up, std_1down, std_2up, std_2down
-
-def create_std_graph(plot_df, mean, up1, down1, up2, down2, show_lines):
-    fig = go.Figure()
-
-    fig.add_trace(go.Scatter(x=plot_df['date'],
-                             y=plot_df['spread']))
-
-    fig.update_traces(marker=dict(size=3))
-
-    if show_lines:
-
-        hline_color = "black"  # "#848484"
-
-        fig.add_hline(y=mean,
-                      line_width=2,
-                      line_color=hline_color,
-                      annotation_text=f"{mean:,.2f} (mean)",
-                      annotation_position="bottom right"
-                      )
-
-        fig.add_hline(y=up1,
-                      line_dash="dash",
-                      line_width=1,
-                      line_color=hline_color,
-                      annotation_text=f"{up1:,.2f}",
-                      annotation_position="bottom right"
-                      )
-
-        fig.add_hline(y=up2,
-                      line_dash="dot",  # "dash"
-                      line_width=1,
-                      line_color=hline_color,
-                      annotation_text=f"{up2:,.2f}",
-                      annotation_position="bottom right"
-                      )
-
-        fig.add_hline(y=down1,
-                      line_dash="dash",
-                      line_width=1,
-                      line_color=hline_color,
-                      annotation_text=f"{down1:,.2f}",
-                      annotation_position="bottom right"
-                      )
-
-        fig.add_hline(y=down2,
-                      line_dash="dot",  # "dash"
-                      line_width=1,
-                      line_color=hline_color,
-                      annotation_text=f"{down2:,.2f}",
-                      annotation_position="bottom right"
-                      )
-
-        # annotations
-        annotations = []
-
-        points = [up2, up1, mean, down1, down2]
-        labels = ["+2\u03C3", "+1\u03C3", "mean", "-1\u03C3", "-2\u03C3"]
-
-        for p, l in zip(points, labels):
-            annotations.append(dict(xref='paper',
-                                    x=1.005,
-                                    y=p,
-                                    xanchor='left',
-                                    yanchor='middle',
-                                    align='left',
-                                    text=f"{p:.2f} ({l})",
-                                    showarrow=False,
-                                    font=dict(size=12, color=hline_color)
-                                    ))
-
-        fig.update_layout(annotations=annotations)
-
-        fig.add_annotation(x=0.03,
-                           y=mean + .2,
-                           xref='paper',
-                           yref='y',
-                           xanchor='left',
-                           align='left',
-                           borderpad=5,
-                           text="Cheaper",
-                           axref='pixel',
-                           ayref='y',
-                           ax=0.25,
-                           ay=plot_df.spread.max(),
-                           arrowhead=1,
-                           arrowsize=1.,
-                           arrowside='start',
-                           arrowwidth=1.5,
-                           arrowcolor="#767676",
-                           showarrow=True,
-                           font=dict(size=15,
-                                     color="#767676"
-                                     ))
-
-        fig.add_annotation(x=0.03,
-                           y=mean - .2,
-                           xref='paper',
-                           yref='y',
-                           xanchor='left',
-                           align='left',
-                           borderpad=5,
-                           text="More Expensive",
-                           axref='pixel',
-                           ayref='y',
-                           ax=0.25,
-                           ay=np.floor(plot_df.spread.min()) - .8,
-                           arrowhead=1,
-                           arrowsize=1.,
-                           arrowside='start',
-                           arrowwidth=1.5,
-                           arrowcolor="#767676",
-                           showarrow=True,
-                           font=dict(size=15,
-                                     color="#767676"
-                                     ))
-
-    fig.update_xaxes(showgrid=False if show_lines else True, # don't show axes if show mean/stds
-                     range=[plot_df.date.min(), plot_df.date.max()])
-
-    fig.update_yaxes(showgrid=False if show_lines else True, # don't show axes if show mean/stds
-                     zeroline=False,
-                     title='Equity Risk Premium',
-                     ticksuffix="  ",
-                     range=[np.floor(plot_df.spread.min())-1.5,
-                            np.ceil(plot_df.spread.max())])
-
-    fig.update_layout(font_family="Avenir",
-                      font_color="#4c4c4c",
-                      font_size=14,
-                      showlegend=False,
-                      title=dict(font_size=22,
-                                 text="<b>Equity risk premium mainly between 15yr mean and -1\u03C3 lately</b>",
-                                 ),
-                      title_x=0.04,
-                      title_y=0.95,
-                      plot_bgcolor='white'
-                      #                   title_pad_b=1000
-                      )
-
-    fig.update_layout(
-        template=plot_settings.dockstreet_template,
-        height=500,
-        margin=dict(b=0),
-        xaxis=dict(
-            rangeselector=dict(
-                y=1.05,
-                buttons=list([
-                    dict(count=1,
-                         label="1m",
-                         step="month",
-                         stepmode="backward"),
-                    dict(count=6,
-                         label="6m",
-                         step="month",
-                         stepmode="backward"),
-                    dict(count=1,
-                         label="YTD",
-                         step="year",
-                         stepmode="todate"),
-                    dict(count=1,
-                         label="1y",
-                         step="year",
-                         stepmode="backward"),
-                    dict(count=2,
-                         label="2y",
-                         step="year",
-                         stepmode="backward"),
-                    dict(step="all")
-                ])
-            ),
-            rangeslider=dict(
-                visible=True,
-                range=[plot_df.date.min(), plot_df.date.max()]
-            ),
-            type="date"
-        )
-    )
-
-    for ser in fig['data']:
-        ser['hovertemplate'] = "%{x|%b %-d, %Y}, %{y:.2f}<extra></extra>"
-
-    return fig
-
-def create_inverse_graph(df_all):
-    # Create figure with secondary y-axis
-    fig = make_subplots(specs=[[{"secondary_y": True}]])
-
-    # Add traces
-    fig.add_trace(
-        go.Scatter(x=df_all.date, y=df_all.inverse,
-                   name="Bond Adj. P/E Ratio"),
-        secondary_y=False,
-    )
-
-    fig.add_trace(
-        go.Scatter(x=df_all.date,
-                   y=df_all.spx_price,
-                   name="S&P 500 Price",
-                   line=dict(width=1.5)),
-        secondary_y=True,
-    )
-
-    fig.update_layout(template=plot_settings.dockstreet_template,
-                      height=500,
-                      plot_bgcolor='white',
-                      hovermode='x',
-                      font_family="Avenir",
-                      font_color="#4c4c4c",
-                      title=dict(font_size=22,
-                                 text="<b>S&P price and Interest Rate Adjusted P/E ratio</b>",
-                                 x=0.04,
-                                 y=0.93
-                                 ),
-                      legend=dict(
-                          orientation="h",
-                          yanchor="bottom",
-                          y=1,
-                          xanchor="right",
-                          x=.28,
-                          font=dict(size=14)
-                      ))
-
-    fig.update_yaxes(title_text="S&P Price",
-                     titlefont_size=18,
-                     color="#767676",
-                     tickcolor="#767676",
-                     tickfont_color="#767676",
-                     tickfont_size=13,
-                     showgrid=False,
-                     tickformat="$,",
-                     tickprefix="  ",
-                     title_standoff=20,
-                     secondary_y=True)
-
-    fig.update_yaxes(title_text="Bond Adjusted P/E",
-                     titlefont_size=18,
-                     color=plot_settings.color_list[0],
-                     tickcolor=plot_settings.color_list[0],
-                     tickfont_color=plot_settings.color_list[0],
-                     tickfont_size=13,
-                     ticksuffix="   ",
-                     range=[df_all.inverse.min() - (df_all.inverse.min() % 10) - 2,
-                            df_all.inverse.max() + (df_all.inverse.max() % 10)],
-                     secondary_y=False)
-
-    fig.update_xaxes(showgrid=False)
-
-    fig.add_annotation(x=df_all.date.max(),
-                       y=df_all.spx_price.values[-1],
-                       xref='x',
-                       yref='y2',
-                       xanchor='left',
-                       align='left',
-                       borderpad=5,
-                       text=f"${df_all.spx_price.values[-1]:,.0f}",
-                       showarrow=False,
-                       font=dict(size=12,
-                                 color="#767676")
-                       )
-
-    fig.add_annotation(x=df_all.date.max(),
-                       y=df_all.inverse.values[-1],
-                       xref='x',
-                       yref='y',
-                       xanchor='left',
-                       align='left',
-                       borderpad=5,
-                       text=f"{df_all.inverse.values[-1]:,.1f}",
-                       showarrow=False,
-                       font=dict(size=12,
-                                 color=plot_settings.color_list[0])
-                       )
-
-    for ser in fig['data']:
-        if ser['name'] == "Bond Adj. P/E Ratio":
-            ser['hovertemplate'] = "%{x|%b %-d, %Y}, %{y:,.2f}<extra></extra>"
-        else:
-            ser['hovertemplate'] = "%{x|%b %-d, %Y}, %{y:$,.2f}<extra></extra>"
-
-    return fig
-
 # ---------------------------------------------------------------------
-# load the data from google drive
-url = "https://drive.google.com/file/d/16NBIP4qGtBkNbcxfUElMDjWiADryMa-G/view?usp=sharing"
-df = pull_google_drive(url)
-
-# format columns
-df = reformat_df(df)
-print('max date', df.date.max())
+# load the data from google drive (see streamlit_charts.app_datasets)
+# the refresher lives in the dataset module, so every rerun of this script
+# gets the same one; it serves the last cached version right away and a
+# background thread re-downloads every SPREAD_REFRESH_SECONDS, swapping in new
+# versions whole. each page takes datasets.current once and uses only that
+datasets = app_datasets()
+# the default view of the common windows (see warmup) is computed as soon as
+# each version is published, for both pages
+warmup.on_publish(datasets, window_result)
+warmup.on_publish(datasets, pe_result, name='warmup_pe')
+# the frame is sorted by date; this runs on every rerun, so no full scan
+print('max date', datasets.current.frame.date.iloc[-1])
 
 # FIRST PAGE
 def earnings_recalc():
+    data = datasets.current
+    df = data.frame
     st.title('Earnings Spread Analysis')
 
     # st.sidebar.write('<br><b>Date Inputs</b>', unsafe_allow_html=True)
 
+    # the frame is sorted by date, so its ends are the first and last rows
+    first_date, last_date = df.date.iloc[0], df.date.iloc[-1]
     with st.sidebar.form(key='date_form'):
         st.write('<b>Date Inputs</b>', unsafe_allow_html=True)
         start_date = st.date_input('Choose a start date',
-                                     value=df.date.min(),
-                                     min_value=df.date.min(),
-                                     max_value=df.date.max(),
+                                     value=first_date,
+                                     min_value=first_date,
+                                     max_value=last_date,
                                      key='start')
         end_date = st.date_input('Choose an end date',
-                                   value=df.date.max(),
-                                   min_value=df.date.min(),
-                                   max_value=df.date.max(),
+                                   value=last_date,
+                                   min_value=first_date,
+                                   max_value=last_date,
                                    key='end')
+        series = st.selectbox('Series', data.series,
+                              format_func=dataset.series_label,
+                              key='series')
         submit_button = st.form_submit_button('Submit', help='Press to recalculate')
 
-    df_date_filter, m, u1, d1, u2, d2 = calc_stds(df, start_date, end_date)
-
     # chart_placeholder = st.empty()
     st.write("<br>", unsafe_allow_html=True)
     show_lines = st.checkbox('Show mean and standard deviation lines', value=True)
-
-    updated_figure = create_std_graph(df_date_filter, m, u1, d1, u2, d2, show_lines)
-    st.plotly_chart(updated_figure, use_container_width=True)
+    band_mode = st.selectbox('Bands', BAND_MODES)
+    crossings = st.checkbox('Mark band crossings', value=False)
+
+    with metrics.profiled('earnings_recalc'), metrics.timer('earnings_recalc'):
+        figure = spread_page_figure(data, start_date, end_date, series, show_lines, band_mode,
+                                    crossings)
+        st.plotly_chart(figure, use_container_width=True)
+
+# the first page's figure for its widget values; the session (``state``, by
+# default the current one) keeps the parsed figure of windows it already drew
+def spread_page_figure(data, start_date, end_date, series, show_lines, band_mode,
+                       crossings=False, state=None):
+    key = (data.version, series, str(start_date), str(end_date), show_lines, band_mode,
+           crossings)
+    def window_figure():
+        return json.loads(window_result(data, start_date, end_date, series, show_lines,
+                                        band_mode, crossings).figure)
+
+    return page_cache(key, window_figure, state)
 
 # SECOND PAGE
 def adjuted_pe():
+    data = datasets.current
+    df = data.frame
     st.title('S&P Price vs P/E Ratio')
 
-    pe_figure = create_inverse_graph(df)
+    first_date, last_date = df.date.iloc[0], df.date.iloc[-1]
+    with st.sidebar.form(key='pe_date_form'):
+        st.write('<b>Date Inputs</b>', unsafe_allow_html=True)
+        start_date = st.date_input('Choose a start date',
+                                     value=first_date,
+                                     min_value=first_date,
+                                     max_value=last_date,
+                                     key='pe_start')
+        end_date = st.date_input('Choose an end date',
+                                   value=last_date,
+                                   min_value=first_date,
+                                   max_value=last_date,
+                                   key='pe_end')
+        submit_button = st.form_submit_button('Submit', help='Press to redraw')
+
+    with metrics.profiled('adjuted_pe'), metrics.timer('adjuted_pe'):
+        st.plotly_chart(pe_page_figure(data, start_date, end_date), use_container_width=True)
 
-    st.plotly_chart(pe_figure, use_container_width=True)
+# the second page's figure for a window, kept in the session (``state``, by
+# default the current one) like the first page's
+def pe_page_figure(data, start_date, end_date, state=None):
+    key = (data.version, str(start_date), str(end_date))
+    def inverse_figure():
+        return json.loads(pe_result(data, start_date, end_date).figure)
+
+    return page_cache(key, inverse_figure, state)
 
 # NOT USED PAGE FOR LOGIN
 def login_info(key="login_info_form"):
@@ -400,14 +139,28 @@ def login_info(key="login_info_form"):
 
     return continued
 
+# stage timings and cache counters in the sidebar, when SPREAD_DEBUG_PANEL=1
+SHOW_DEBUG_PANEL = os.environ.get('SPREAD_DEBUG_PANEL') == '1'
+
+def debug_panel():
+    with st.sidebar.beta_expander('Debug: stage timings'):
+        st.table(pd.DataFrame(metrics.summary(),
+                              columns=['stage', 'count', 'mean ms', 'p50 ms', 'p95 ms']))
+        st.write(window_results.stats())
+
 def create_app_with_pages():
     # CREATE PAGES IN APP
-    valid_login = login_info()
-    if valid_login:
+    # the login form is only shown until it succeeds once in this session
+    state = session_state()
+    if not state.get('logged_in'):
+        state['logged_in'] = login_info()
+    if state['logged_in']:
         app = MultiApp()
         app.add_app("Earnings Spread Calculation", earnings_recalc)
         app.add_app("S&P Price vs P/E Ratio", adjuted_pe)
         app.run()
+        if SHOW_DEBUG_PANEL:
+            debug_panel()
 
 if __name__ == '__main__':
 
@@ -0,0 +1,274 @@
+"""Streaming, column-projected reader for the .xlsx workbook.
+
+pd.read_excel builds a Python object for every cell of the workbook before
+reformat_df throws all but a few columns away. ``read_columns`` streams the
+first sheet's XML out of the zip a chunk at a time and picks out only the
+cells of the columns whose header matches ``columns`` (a regex, as for
+DataFrame.filter), into preallocated numpy arrays:
+    raw = excel_reader.read_columns(content, '^(Date|SPX_Price|Spread(_.+)?)$')
+
+The cells of a chunk are found by one regex and converted together, so no
+Python code runs per cell; memory goes with the columns kept, not with the
+width of the workbook. ``dates`` columns hold Excel serial numbers, turned
+into datetime64 in one step at the end. Each chunk's kept cells are
+counted by their opening tags too; if the regex matched fewer (a cell form
+it doesn't know), the workbook is read with openpyxl's read-only mode
+instead, still keeping only the matching columns, rather than losing cells.
+"""
+import io
+import posixpath
+import re
+import zipfile
+from xml.etree import ElementTree
+from xml.sax.saxutils import unescape
+
+import numpy as np
+import pandas as pd
+
+# bytes of sheet XML decompressed per chunk
+CHUNK_BYTES = 2**20
+# rows to preallocate when the sheet has no <dimension>
+INITIAL_ROWS = 1024
+
+NS = {'main': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main',
+      'rel': 'http://schemas.openxmlformats.org/package/2006/relationships',
+      'r': 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'}
+EPOCHS = {False: np.datetime64('1899-12-30', 'us'), True: np.datetime64('1904-01-01', 'us')}
+
+ROW = re.compile(rb'<row\b[^>]*>(.*?)</row>', re.S)
+DIMENSION = re.compile(rb'<dimension ref="[A-Z]*\d*:?[A-Z]*(\d+)"')
+ANY_CELL = re.compile(rb'<c\b')
+# text cells; 'd' cells hold ISO 8601 dates as text
+STRING_TYPES = (b's', b'str', b'inlineStr', b'd')
+
+
+def _columns(letters):
+    return b'|'.join(letters) if letters is not None else b'[A-Z]+'
+
+
+# letter, row number, type, <v> text, inline string text of each cell in
+# columns ``letters`` (all columns if None); the other attributes (s, cm,
+# vm, ...) are skipped, as is the formula, shared (<f t="shared" ...>) or not
+def _cell_pattern(letters=None):
+    attribute = rb'\s+(?!t=)[\w:]+="[^"]*"'
+    return re.compile(rb'<c r="(' + _columns(letters) + rb')(\d+)"'
+                      rb'(?:' + attribute + rb')*(?:\s+t="(\w+)")?(?:' + attribute + rb')*\s*'
+                      rb'(?:/>|>(?:<f\b[^>]*>[^<]*</f>|<f\b[^>]*/>)?(?:<v>([^<]*)</v>)?'
+                      rb'(?:<is><t[^>]*>([^<]*)</t></is>)?</c>)', re.S)
+
+
+# the opening tag of every cell in columns ``letters``, to check that
+# _cell_pattern matched them all
+def _open_pattern(letters=None):
+    return re.compile(rb'<c r="(?:' + _columns(letters) + rb')\d+"')
+
+
+def _first_sheet(archive):
+    workbook = ElementTree.fromstring(archive.read('xl/workbook.xml'))
+    properties = workbook.find('main:workbookPr', NS)
+    date1904 = properties is not None and properties.get('date1904') in ('1', 'true')
+    sheet_id = workbook.find('main:sheets/main:sheet', NS).get(f"{{{NS['r']}}}id")
+
+    rels = ElementTree.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+    target = next(rel.get('Target') for rel in rels.findall('rel:Relationship', NS)
+                  if rel.get('Id') == sheet_id)
+    path = target.lstrip('/') if target.startswith('/') else posixpath.join('xl', target)
+    return posixpath.normpath(path), date1904
+
+
+def _shared_strings(archive):
+    if 'xl/sharedStrings.xml' not in archive.namelist():
+        return np.array([], dtype=object)
+    strings = []
+    with archive.open('xl/sharedStrings.xml') as f:
+        for _, element in ElementTree.iterparse(f):
+            if element.tag == f"{{{NS['main']}}}si":
+                strings.append(''.join(t.text or '' for t in element.iter(f"{{{NS['main']}}}t")))
+                element.clear()
+    return np.array(strings, dtype=object)
+
+
+# the sheet XML in pieces that end on a row boundary
+def _row_chunks(f, chunk_bytes):
+    rest = b''
+    while True:
+        block = f.read(chunk_bytes)
+        text = rest + block
+        end = text.rfind(b'</row>') + len(b'</row>') if block else len(text)
+        if end < len(b'</row>'):
+            rest = text
+            continue
+        if end:
+            yield text[:end]
+        rest = text[end:]
+        if not block:
+            return
+
+
+# the text of string cells, from the shared strings table or inline
+def _cell_strings(types, values, inline, shared):
+    text = np.where(types == b'inlineStr', inline, values).astype(object)
+    is_shared = types == b's'
+    if is_shared.any():
+        text[is_shared] = shared[values[is_shared].astype(np.int64)]
+    return [unescape(t.decode('utf-8')) if isinstance(t, bytes) else t for t in text]
+
+
+# datetime64 of Excel serial numbers (NaN is NaT): whole days plus the time
+# of day to the millisecond, as openpyxl
+def _serial_dates(values, epoch):
+    column = np.full(len(values), np.datetime64('NaT'), dtype='datetime64[ns]')
+    serial = ~np.isnan(values)
+    days, fraction = np.divmod(values[serial], 1)
+    millis = (days.astype(np.int64) * 86400000
+              + np.round(fraction * 86400000).astype(np.int64))
+    column[serial] = epoch + millis.astype('timedelta64[ms]')
+    return column
+
+
+class _Columns:
+    """Typed arrays of the kept columns, grown by doubling as rows arrive."""
+    def __init__(self, names, n_rows):
+        self.names = names
+        self.values = {name: np.full(max(n_rows, 1), np.nan) for name in names}
+        self.strings = {name: {} for name in names}
+        self.n_rows = 0
+
+    def reserve(self, n_rows):
+        capacity = len(next(iter(self.values.values())))
+        if n_rows <= capacity:
+            return
+        capacity = max(n_rows, 2 * capacity)
+        for name, values in self.values.items():
+            grown = np.full(capacity, np.nan)
+            grown[:len(values)] = values
+            self.values[name] = grown
+
+    def add(self, name, rows, types, values, inline, shared):
+        numeric = ((types == b'') | (types == b'n')) & (values != b'')
+        self.values[name][rows[numeric]] = values[numeric].astype(np.float64)
+        text = np.isin(types, STRING_TYPES)
+        if text.any():
+            self.strings[name].update(zip(rows[text].tolist(),
+                                          _cell_strings(types[text], values[text],
+                                                        inline[text], shared)))
+
+    def frame(self, dates, epoch):
+        columns = {}
+        for name in self.names:
+            values = self.values[name][:self.n_rows]
+            strings = self.strings[name]
+            if name in dates:
+                column = _serial_dates(values, epoch)
+                if strings:
+                    column[list(strings)] = pd.to_datetime(list(strings.values()),
+                                                           errors='coerce').values
+            else:
+                column = values
+                if strings:
+                    column[list(strings)] = pd.to_numeric(list(strings.values()),
+                                                          errors='coerce')
+            columns[name] = column
+        return pd.DataFrame(columns, copy=False)
+
+
+def _header(row, shared):
+    cells = _cell_pattern().findall(row)
+    if not cells or len(cells) != len(ANY_CELL.findall(row)):
+        return None
+    letters, _, types, values, inline = (np.array(c) for c in zip(*cells))
+    names = _cell_strings(types, values, inline, shared)
+    return int(cells[0][1]), [(bytes(letter), name) for letter, name in zip(letters, names)]
+
+
+def read_columns(content, columns, dates=('Date',), chunk_bytes=CHUNK_BYTES):
+    """The columns of the first sheet of the .xlsx ``content`` (bytes) whose
+    header matches the regex ``columns``, as a DataFrame of float64 and, for
+    the names in ``dates``, datetime64 columns.
+
+    Empty and error cells are NaN / NaT; text cells are parsed as numbers or
+    dates where they can be.
+    """
+    with zipfile.ZipFile(io.BytesIO(content)) as archive:
+        path, date1904 = _first_sheet(archive)
+        shared = _shared_strings(archive)
+
+        with archive.open(path) as f:
+            chunks = _row_chunks(f, chunk_bytes)
+            first = next(chunks, b'')
+            row = ROW.search(first)
+            header = _header(row.group(1), shared) if row is not None else None
+            if header is None:
+                return _read_openpyxl(content, columns, dates)
+
+            header_row, header_cells = header
+            kept = [(letter, name) for letter, name in header_cells if re.search(columns, name)]
+            dimension = DIMENSION.search(first[:row.start()])
+            result = _Columns([name for _, name in kept],
+                              int(dimension.group(1)) - header_row if dimension else INITIAL_ROWS)
+            if not kept:
+                return result.frame(dates, EPOCHS[date1904])
+
+            cell = _cell_pattern([letter for letter, _ in kept])
+            opening = _open_pattern([letter for letter, _ in kept])
+            for chunk in _chain(first[row.end():], chunks):
+                found = cell.findall(chunk)
+                if len(found) != len(opening.findall(chunk)):
+                    return _read_openpyxl(content, columns, dates)
+                if not found:
+                    continue
+                letters, rows, types, values, inline = (np.array(c) for c in zip(*found))
+                rows = rows.astype(np.int64) - header_row - 1
+                result.reserve(int(rows.max()) + 1)
+                # styled empty cells past the data don't add rows
+                filled = (values != b'') | (inline != b'')
+                if filled.any():
+                    result.n_rows = max(result.n_rows, int(rows[filled].max()) + 1)
+                for letter, name in kept:
+                    mine = letters == letter
+                    result.add(name, rows[mine], types[mine], values[mine], inline[mine], shared)
+
+    return result.frame(dates, EPOCHS[date1904])
+
+
+def _chain(first, rest):
+    yield first
+    yield from rest
+
+
+# openpyxl gives dates for date formatted cells; numbers in a date column
+# are serials without the format, as the regex path reads them
+def _openpyxl_dates(values, epoch):
+    numbers = np.array([v if isinstance(v, (int, float)) and not isinstance(v, bool)
+                        else np.nan for v in values], dtype=float)
+    column = _serial_dates(numbers, epoch)
+    other = [i for i, v in enumerate(values) if v is not None and np.isnan(numbers[i])]
+    if other:
+        column[other] = pd.to_datetime([values[i] for i in other], errors='coerce').values
+    return column
+
+
+# openpyxl's read-only mode, for sheets the cell regex can't read
+def _read_openpyxl(content, columns, dates):
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(io.BytesIO(content), read_only=True, data_only=True)
+    epoch = EPOCHS[workbook.epoch.year == 1904]
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, ())
+        kept = [(i, str(name)) for i, name in enumerate(header)
+                if name is not None and re.search(columns, str(name))]
+        values = {name: [] for _, name in kept}
+        for row in rows:
+            for i, name in kept:
+                values[name].append(row[i] if i < len(row) else None)
+    finally:
+        workbook.close()
+
+    frame = pd.DataFrame({name: _openpyxl_dates(v, epoch) if name in dates
+                          else pd.to_numeric(v, errors='coerce').astype(float)
+                          for name, v in values.items()})
+    # openpyxl also yields the empty rows below the data
+    filled = np.flatnonzero(frame.notna().any(axis=1).values)
+    return frame.iloc[:filled[-1] + 1 if len(filled) else 0]
@@ -0,0 +1,325 @@
+"""Plain-dict builders for the spread charts and the S&P vs P/E chart.
+
+Building the charts with ``go.Figure`` runs plotly's property validation on
+every ``add_hline`` / ``add_annotation`` / ``update_layout`` call. These
+builders return the same figure as a plain ``{'data': ..., 'layout': ...}``
+dict instead: everything that doesn't depend on the data (template, range
+buttons, fonts, titles) is built once at import and shared, and only the trace
+arrays and the five band values are filled in per request.
+
+The returned dicts share their static parts, so treat them as read-only.
+
+``pe_figure`` takes the P/E axis range and the last values from the caller
+(e.g. from the MinMaxPyramid extrema of the window) rather than scanning
+the traces.
+
+With ``crossings`` (a window_stats.CrossingIndex events frame) the spread
+charts also mark where the series crossed the mean and band lines, with the
+regime it entered and how long the one it left had lasted in the hover.
+
+Traces longer than SPREAD_WEBGL_POINTS points (default 20000) are drawn with
+``scattergl``: SVG gets very slow in the browser past a few tens of thousands
+of points, WebGL doesn't. Hover templates and colors are the same either way.
+"""
+import os
+
+import numpy as np
+
+import plot_settings
+from window_stats import ASCENDING_LEVELS
+
+TEMPLATE = plot_settings.dockstreet_template
+
+HLINE_COLOR = "black"  # "#848484"
+ARROW_COLOR = "#767676"
+HOVERTEMPLATE = "%{x|%b %-d, %Y}, %{y:.2f}<extra></extra>"
+WEBGL_POINTS = int(os.environ.get('SPREAD_WEBGL_POINTS', 20000))
+
+# labels in the order calc_stds returns the bands: mean, +1, -1, +2, -2
+BAND_LABELS = ["mean", "+1\u03C3", "-1\u03C3", "+2\u03C3", "-2\u03C3"]
+# same for the percentile bands of calc_percentiles
+PERCENTILE_LABELS = ["median", "p75", "p25", "p95", "p5"]
+# line dash and width of each band, same order
+BAND_LINES = [(None, 2), ("dash", 1), ("dash", 1), ("dot", 1), ("dot", 1)]
+# order the apps draw the band lines and the right hand labels in
+HLINE_ORDER = [0, 1, 3, 2, 4]
+LABEL_ORDER = [3, 1, 0, 2, 4]
+
+# crossing markers, up through a level and down
+CROSSING_MARKERS = {1: ("triangle-up", plot_settings.color_list[0]),
+                    -1: ("triangle-down", "#c0392b")}
+CROSSING_HOVERTEMPLATE = "%{x|%b %-d, %Y}, %{y:.2f}<br>%{text}<extra></extra>"
+
+RANGE_BUTTONS = [
+    dict(count=1, label="1m", step="month", stepmode="backward"),
+    dict(count=6, label="6m", step="month", stepmode="backward"),
+    dict(count=1, label="YTD", step="year", stepmode="todate"),
+    dict(count=1, label="1y", step="year", stepmode="backward"),
+    dict(count=2, label="2y", step="year", stepmode="backward"),
+    dict(step="all"),
+]
+
+FONT = dict(family="Avenir", color="#4c4c4c", size=14)
+LABEL_FONT = dict(size=12, color=HLINE_COLOR)
+ARROW_FONT = dict(size=15, color=ARROW_COLOR)
+
+# layout that differs between the dash chart (create_graph) and the
+# streamlit chart (create_std_graph)
+STYLES = {
+    'dash': dict(
+        title=dict(font=dict(size=22), x=0.04, y=0.95,
+                   text="<b>Equity risk premium mainly between 15yr mean and -1 std in recent months</b>"),
+        rangeselector=dict(buttons=RANGE_BUTTONS),
+        extra_layout={},
+    ),
+    'streamlit': dict(
+        title=dict(font=dict(size=22), x=0.04, y=0.95,
+                   text="<b>Equity risk premium mainly between 15yr mean and -1\u03C3 lately</b>"),
+        rangeselector=dict(y=1.05, buttons=RANGE_BUTTONS),
+        extra_layout=dict(plot_bgcolor='white', height=500, margin=dict(b=0)),
+    ),
+}
+
+
+PE_COLOR = plot_settings.color_list[0]
+SPX_COLOR = "#767676"
+PE_HOVERTEMPLATE = "%{x|%b %-d, %Y}, %{y:,.2f}<extra></extra>"
+SPX_HOVERTEMPLATE = "%{x|%b %-d, %Y}, %{y:$,.2f}<extra></extra>"
+
+# the layout of the P/E chart (create_inverse_graph) that doesn't depend on
+# the window: the P/E on the left axis, the S&P price on the right
+PE_LAYOUT = dict(
+    template=TEMPLATE, height=500, plot_bgcolor='white', hovermode='x',
+    font=dict(family="Avenir", color="#4c4c4c"),
+    title=dict(font=dict(size=22), x=0.04, y=0.93,
+               text="<b>S&P price and Interest Rate Adjusted P/E ratio</b>"),
+    legend=dict(font=dict(size=14), orientation="h", yanchor="bottom", y=1,
+                xanchor="right", x=.28),
+    xaxis=dict(anchor='y', domain=[0.0, 0.94], showgrid=False),
+    yaxis2=dict(anchor='x', overlaying='y', side='right',
+                title=dict(font=dict(size=18), text="S&P Price", standoff=20),
+                tickfont=dict(color=SPX_COLOR, size=13), color=SPX_COLOR,
+                tickcolor=SPX_COLOR, showgrid=False, tickformat="$,", tickprefix="  "),
+)
+PE_YAXIS = dict(anchor='x', domain=[0.0, 1.0],
+                title=dict(font=dict(size=18), text="Bond Adjusted P/E"),
+                tickfont=dict(color=PE_COLOR, size=13), color=PE_COLOR, tickcolor=PE_COLOR,
+                ticksuffix="   ")
+
+
+# datetime64 values as the iso strings plotly's encoder would write
+def iso_dates(values):
+    return np.datetime_as_string(np.asarray(values, dtype='datetime64[ns]'), unit='s')
+
+
+def _date_range(dates):
+    if len(dates) == 0:
+        return [None, None]
+    return list(iso_dates([dates.min(), dates.max()]))
+
+
+def _hline(y, band):
+    dash, width = BAND_LINES[band]
+    line = dict(color=HLINE_COLOR, width=width)
+    if dash is not None:
+        line['dash'] = dash
+    return dict(type='line', line=line, xref='x domain', x0=0, x1=1, yref='y', y0=y, y1=y)
+
+
+def _band_label(y, band, labels=BAND_LABELS):
+    return dict(xref='paper', x=1.005, yref='y', y=y, xanchor='left', yanchor='middle',
+                align='left', text=f"{y:.2f} ({labels[band]})", showarrow=False,
+                font=LABEL_FONT)
+
+
+def _arrow(text, y, ay):
+    return dict(x=0.03, y=y, xref='paper', yref='y', xanchor='left', align='left',
+                borderpad=5, text=text, axref='pixel', ayref='y', ax=0.25, ay=ay,
+                arrowhead=1, arrowsize=1., arrowside='start', arrowwidth=1.5,
+                arrowcolor=ARROW_COLOR, showarrow=True, font=ARROW_FONT)
+
+
+def _nan_extrema(values):
+    if len(values) == 0:
+        return np.nan, np.nan
+    return np.nanmin(values), np.nanmax(values)
+
+
+# trace type for a trace of n_points points
+def scatter_type(n_points):
+    return 'scattergl' if n_points > WEBGL_POINTS else 'scatter'
+
+
+def spread_trace(dates, spread):
+    spread = np.asarray(spread)
+    return dict(type=scatter_type(len(spread)), x=iso_dates(dates), y=spread,
+                marker=dict(size=3), hovertemplate=HOVERTEMPLATE)
+
+
+def regime_labels(labels=BAND_LABELS):
+    """Names of the CrossingIndex regimes, lowest first, from the band labels."""
+    ascending = [labels[i] for i in ASCENDING_LEVELS]
+    return ([f"below {ascending[0]}"]
+            + [f"{low} to {high}" for low, high in zip(ascending, ascending[1:])]
+            + [f"above {ascending[-1]}"])
+
+
+def crossing_trace(events, labels=BAND_LABELS):
+    """Markers at the crossings of a CrossingIndex events frame."""
+    names = regime_labels(labels)
+    direction = events['direction'].to_numpy()
+    text = [f"{'up' if d > 0 else 'down'} into {names[after]}<br>"
+            f"after {days:.0f} days {names[before]}"
+            for d, before, after, days in zip(direction, events['before'], events['after'],
+                                              events['days_before'])]
+    return dict(type=scatter_type(len(events)), mode='markers',
+                x=iso_dates(events['date'].to_numpy()), y=events['value'].to_numpy(),
+                text=text, hovertemplate=CROSSING_HOVERTEMPLATE,
+                marker=dict(size=9, symbol=[CROSSING_MARKERS[d][0] for d in direction],
+                            color=[CROSSING_MARKERS[d][1] for d in direction]))
+
+
+def _layout(style, show_lines, date_range, y_range, title=None):
+    s = STYLES[style]
+    return dict(
+        template=TEMPLATE,
+        font=FONT,
+        showlegend=False,
+        title=title or s['title'],
+        xaxis=dict(showgrid=not show_lines, range=date_range, type='date',
+                   rangeselector=s['rangeselector'],
+                   rangeslider=dict(visible=True, range=date_range)),
+        yaxis=dict(showgrid=not show_lines, zeroline=False, ticksuffix="  ",
+                   title=dict(text='Equity Risk Premium'), range=y_range),
+        **s['extra_layout'])
+
+
+def spread_figure(dates, spread, bands, show_lines=True, style='streamlit', series_label=None,
+                  percentiles=False, crossings=None):
+    """The equity risk premium chart as a plain dict.
+
+    ``bands`` is ``(mean, up1, down1, up2, down2)`` as returned by calc_stds,
+    or with ``percentiles`` ``(median, p75, p25, p95, p5)`` as returned by
+    calc_percentiles. ``style`` picks the dash (``create_graph``) or
+    streamlit (``create_std_graph``) look; the dash chart always shows the
+    bands. ``series_label`` replaces the title for series other than the
+    default. ``crossings`` are the crossing events to mark.
+    """
+    dates = np.asarray(dates)
+    spread = np.asarray(spread, dtype=float)
+    spread_min, spread_max = _nan_extrema(spread)
+    mean = bands[0]
+
+    if style == 'dash':
+        y_range = [-.5, np.ceil(spread_max)]
+        arrow_ays = (mean + 3.8, mean - 3.8)
+    else:
+        y_range = [np.floor(spread_min) - 1.5, np.ceil(spread_max)]
+        arrow_ays = (spread_max, np.floor(spread_min) - .8)
+
+    title = None
+    if percentiles:
+        subject = f"{series_label} equity" if series_label is not None else "Equity"
+        title = dict(STYLES[style]['title'],
+                     text=f"<b>{subject} risk premium vs window median and percentile bands</b>")
+    elif series_label is not None:
+        title = dict(STYLES[style]['title'],
+                     text=f"<b>{series_label} equity risk premium vs window mean and \u03C3 bands</b>")
+    layout = _layout(style, show_lines, _date_range(dates), y_range, title)
+
+    labels = PERCENTILE_LABELS if percentiles else BAND_LABELS
+    if show_lines:
+        layout['shapes'] = [_hline(bands[i], i) for i in HLINE_ORDER]
+        layout['annotations'] = [_band_label(bands[i], i, labels) for i in LABEL_ORDER] + [
+            _arrow("Cheaper", mean + .2, arrow_ays[0]),
+            _arrow("More Expensive", mean - .2, arrow_ays[1]),
+        ]
+
+    data = [spread_trace(dates, spread)]
+    if crossings is not None and len(crossings):
+        data.append(crossing_trace(crossings, labels))
+    return dict(data=data, layout=layout)
+
+
+# fills of the rolling +-2 and +-1 std bands, shades of color_list[0]
+ROLLING_FILLS = {2: "rgba(92, 148, 61, 0.12)", 1: "rgba(92, 148, 61, 0.22)"}
+ROLLING_HOVERTEMPLATE = "%{x|%b %-d, %Y}, %{y:.2f} (z %{customdata:.2f})<extra></extra>"
+
+
+def _edge_trace(x, y, fill=None):
+    trace = dict(type=scatter_type(len(y)), x=x, y=y, mode='lines', line=dict(width=0),
+                 hoverinfo='skip')
+    if fill is not None:
+        trace.update(fill='tonexty', fillcolor=fill)
+    return trace
+
+
+def rolling_spread_figure(dates, spread, mean, std, zscore, label, show_lines=True,
+                          series_label=None, crossings=None):
+    """The equity risk premium chart with trailing mean / std bands drawn as
+    filled areas, and the rolling z-score in the hover. ``label`` names the
+    trailing window (e.g. '3y'), ``series_label`` the series if it isn't the
+    default one; ``crossings`` are the crossing events to mark."""
+    x = iso_dates(dates)
+    spread = np.asarray(spread, dtype=float)
+    mean = np.asarray(mean, dtype=float)
+    std = np.asarray(std, dtype=float)
+
+    data = []
+    if show_lines:
+        for k in (2, 1):
+            data.append(_edge_trace(x, mean - k * std))
+            data.append(_edge_trace(x, mean + k * std, ROLLING_FILLS[k]))
+        data.append(dict(type=scatter_type(len(mean)), x=x, y=mean, mode='lines',
+                         line=dict(color=HLINE_COLOR, width=1.5),
+                         hovertemplate="%{x|%b %-d, %Y}, %{y:.2f} (" + label + " mean)<extra></extra>"))
+        low, high = _nan_extrema(np.concatenate([spread, mean - 2 * std, mean + 2 * std]))
+    else:
+        low, high = _nan_extrema(spread)
+
+    data.append(dict(type=scatter_type(len(spread)), x=x, y=spread, marker=dict(size=3),
+                     line=dict(color=plot_settings.color_list[0]),
+                     customdata=np.asarray(zscore, dtype=float),
+                     hovertemplate=ROLLING_HOVERTEMPLATE))
+    if crossings is not None and len(crossings):
+        data.append(crossing_trace(crossings))
+
+    subject = f"{series_label} equity" if series_label is not None else "Equity"
+    title = dict(STYLES['streamlit']['title'],
+                 text=f"<b>{subject} risk premium vs trailing {label} mean and \u03C3 bands</b>")
+    layout = _layout('streamlit', show_lines, _date_range(np.asarray(dates)),
+                     [np.floor(low) - .5, np.ceil(high)], title)
+
+    return dict(data=data, layout=layout)
+
+
+def _last_label(x, y, yref, text, color):
+    return dict(x=x, y=y, xref='x', yref=yref, xanchor='left', align='left', borderpad=5,
+                text=text, showarrow=False, font=dict(size=12, color=color))
+
+
+def pe_figure(inverse_dates, inverse, spx_dates, spx_price, inverse_extrema, last_date,
+              inverse_last, spx_last):
+    """The S&P price vs bond adjusted P/E chart of a window.
+
+    ``inverse_extrema`` is the window's P/E ``(min, max)``, which sets the
+    left axis range; ``last_date``, ``inverse_last`` and ``spx_last`` place
+    the last value labels.
+    """
+    data = [dict(type=scatter_type(len(inverse)), name="Bond Adj. P/E Ratio",
+                 x=iso_dates(inverse_dates), y=np.asarray(inverse), xaxis='x', yaxis='y',
+                 hovertemplate=PE_HOVERTEMPLATE),
+            dict(type=scatter_type(len(spx_price)), name="S&P 500 Price",
+                 x=iso_dates(spx_dates), y=np.asarray(spx_price), line=dict(width=1.5),
+                 xaxis='x', yaxis='y2', hovertemplate=SPX_HOVERTEMPLATE)]
+
+    low, high = inverse_extrema
+    layout = dict(PE_LAYOUT, yaxis=dict(PE_YAXIS, range=[low - (low % 10) - 2,
+                                                          high + (high % 10)]))
+    if last_date is not None:
+        last_date = str(iso_dates([last_date])[0])
+        layout['annotations'] = [
+            _last_label(last_date, spx_last, 'y2', f"${spx_last:,.0f}", SPX_COLOR),
+            _last_label(last_date, inverse_last, 'y', f"{inverse_last:,.1f}", PE_COLOR),
+        ]
+    return dict(data=data, layout=layout)
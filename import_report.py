@@ -0,0 +1,130 @@
+"""Import-time report for the two entry points.
+
+Imports each app in a fresh interpreter under ``python -X importtime`` and
+reports the total, the time per top-level package and the slowest modules.
+It exits non-zero if an app imports one of its DEFERRED modules at startup
+(they should only be imported on first use) or goes over ``--budget-ms``,
+so CI can run it next to the benchmarks.
+    python import_report.py --budget-ms 2500 --out imports.json
+
+The DEFERRED check also runs with the tests (tests/test_import_report.py).
+
+Like benchmarks.py it runs offline: the apps load a small synthetic
+workbook, and are timed from a warm column cache, as they start on a dyno.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from collections import defaultdict
+
+import synthetic_data
+
+ENTRY_POINTS = ['earnings_spread', 'earnings_spread_streamlit']
+# modules the apps only need on some paths; importing them at startup is a
+# regression
+DEFERRED = ['plotly.express', 'plotly.graph_objects', 'plotly.graph_objs', 'plotly.subplots',
+            'openpyxl']
+TOP_MODULES = 15
+
+
+def parse_importtime(stderr):
+    """``(module, self us, cumulative us, depth)`` for each ``-X importtime``
+    line, in the order they were printed."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+
+def import_once(module, env):
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                          cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+    return parse_importtime(proc.stderr)
+
+
+def offline_env(tmp_dir):
+    """The environment to import the apps with: a small synthetic workbook
+    and a column cache in ``tmp_dir``."""
+    return dict(os.environ,
+                SPREAD_SOURCE=synthetic_data.write_workbook(
+                    os.path.join(tmp_dir, 'spread.xlsx'), 1000),
+                SPREAD_CACHE_DIR=os.path.join(tmp_dir, 'cache'),
+                SPREAD_REFRESH_SECONDS='0')
+
+
+def module_report(module, env, repeat):
+    # the first run fills the column cache
+    import_once(module, env)
+    rows = min((import_once(module, env) for _ in range(repeat)),
+               key=lambda rows: rows[-1][2])
+
+    packages = defaultdict(int)
+    for name, self_us, _, _ in rows:
+        packages[name.split('.')[0]] += self_us
+    imported = {name for name, _, _, _ in rows}
+    slowest = sorted(rows, key=lambda row: row[1], reverse=True)[:TOP_MODULES]
+
+    return dict(module=module,
+                total_ms=rows[-1][2] / 1000,
+                packages_ms={p: us / 1000 for p, us in
+                             sorted(packages.items(), key=lambda item: item[1], reverse=True)},
+                slowest_ms={name: self_us / 1000 for name, self_us, _, _ in slowest},
+                deferred_imported=[m for m in DEFERRED if m in imported])
+
+
+def print_report(report):
+    print(f"{report['module']}: {report['total_ms']:.1f} ms", file=sys.stderr)
+    for package, ms in list(report['packages_ms'].items())[:10]:
+        print(f"    {package:<32} {ms:>9.1f} ms", file=sys.stderr)
+    for module in report['deferred_imported']:
+        print(f"    imported at startup: {module}", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--modules', nargs='+', default=ENTRY_POINTS, help='modules to import')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per module, the fastest is kept')
+    parser.add_argument('--budget-ms', type=float, help='fail if a module takes longer to import')
+    parser.add_argument('--out', default='-', help="JSON output file ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    failed = False
+    reports = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        env = offline_env(tmp_dir)
+        for module in args.modules:
+            try:
+                report = module_report(module, env, args.repeat)
+            except RuntimeError as e:
+                print(f'{module}: import failed: {e}', file=sys.stderr)
+                reports.append(dict(module=module, error=str(e)))
+                failed = True
+                continue
+            print_report(report)
+            reports.append(report)
+            if report['deferred_imported']:
+                failed = True
+            if args.budget_ms is not None and report['total_ms'] > args.budget_ms:
+                print(f"    over the {args.budget_ms:.0f} ms budget", file=sys.stderr)
+                failed = True
+
+    if args.out == '-':
+        json.dump(reports, sys.stdout, indent=1)
+    else:
+        with open(args.out, 'w') as f:
+            json.dump(reports, f, indent=1)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,332 @@
+"""Load test for the dash callback and the streamlit page functions.
+
+Runs offline against a synthetic dataset (see synthetic_data). Each run is a
+closed loop: ``--concurrency`` simulated users each send their next request as
+soon as the last one is answered, for ``--duration`` seconds. Every
+concurrency level reports the throughput, the p50 / p95 / p99 / max latency,
+the errors, and the server's resident memory before and after the run:
+    python loadtest.py --rows 100000 --concurrency 1 4 16 64 --out load.json
+
+Targets:
+    dash        POSTs the submit button's callback (callback_dates) to
+                /_dash-update-component of ``earnings_spread:server``. The
+                server runs locally under gunicorn (``--workers`` x
+                ``--threads``, the dev server if gunicorn isn't installed),
+                attaching the synthetic dataset from a shared store; or pass
+                ``--url`` of a running instance (memory isn't measured then)
+    streamlit   calls the streamlit app's page functions in this process, on
+                threads as ``streamlit run`` does, each user with its own
+                session state; the websocket and widget protocol are not
+                included
+
+Users ask for the windows in WINDOW_MIX: mostly the rangeselector / warm-up
+windows, some random ones that miss every cache, with the bands of BANDS_MIX;
+streamlit users also switch pages as in PAGE_MIX.
+"""
+import argparse
+import base64
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+import numpy as np
+import pandas as pd
+
+# benchmarks points the cache and the shared store of the client process
+# away from the real ones, as the apps read them at import
+import benchmarks
+import dataset
+import synthetic_data
+import warmup
+
+DEFAULT_CONCURRENCY = [1, 4, 16, 64]
+TARGETS = ['dash', 'streamlit']
+
+# relative weights of the windows users ask for; 'random' is a window with
+# random ends
+WINDOW_MIX = {'2y': 20, '1y': 15, 'all': 15, 'since 2007-01-01': 15, '6m': 10,
+              'ytd': 5, '1m': 5, 'random': 15}
+BANDS_MIX = {'std': 90, 'percentiles': 10}
+# the streamlit band modes for each dash bands value
+STREAMLIT_BANDS = {'std': 'Window', 'percentiles': 'Percentiles'}
+PAGE_MIX = {'spread': 85, 'pe': 15}
+
+SERVER_START_TIMEOUT = 120
+
+
+def pick(rng, mix):
+    return rng.choices(list(mix), weights=list(mix.values()))[0]
+
+
+def pick_window(rng, first, last):
+    spec = pick(rng, WINDOW_MIX)
+    if spec != 'random':
+        return warmup.window_dates(spec, first, last)
+    start, end = sorted(rng.uniform(first.value, last.value) for _ in range(2))
+    return pd.Timestamp(int(start)).normalize(), pd.Timestamp(int(end)).normalize()
+
+
+def _rss_pages(pid):
+    with open(f'/proc/{pid}/statm') as f:
+        return int(f.read().split()[1])
+
+
+def _children(pid):
+    children = []
+    for name in os.listdir('/proc'):
+        if name.isdigit():
+            try:
+                with open(f'/proc/{name}/stat') as f:
+                    if int(f.read().rsplit(')', 1)[1].split()[1]) == pid:
+                        children.append(int(name))
+            except (OSError, IndexError, ValueError):
+                pass
+    return children
+
+
+def rss_bytes(pid):
+    """Resident memory of ``pid`` and its children (gunicorn workers), or
+    None where there is no /proc."""
+    if pid is None or not os.path.isdir('/proc'):
+        return None
+    try:
+        return sum(_rss_pages(p) for p in [pid] + _children(pid)) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return None
+
+
+def run_level(user, concurrency, duration, seed, pid):
+    """Run ``concurrency`` users for ``duration`` seconds. ``user(rng)``
+    makes one user's request function, called until time is up."""
+    latencies = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+    start = threading.Barrier(concurrency + 1)
+    stop = threading.Event()
+
+    def loop(i):
+        request = user(random.Random(seed * 1000 + i))
+        start.wait()
+        while not stop.is_set():
+            t = time.perf_counter()
+            try:
+                request()
+            except Exception:
+                errors[i] += 1
+                continue
+            latencies[i].append(time.perf_counter() - t)
+
+    threads = [threading.Thread(target=loop, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    rss_start = rss_bytes(pid)
+    start.wait()
+    t = time.perf_counter()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - t
+    rss_end = rss_bytes(pid)
+
+    ms = np.concatenate([np.asarray(l) for l in latencies]) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99]) if len(ms) else (np.nan,) * 3
+    return dict(concurrency=concurrency, seconds=seconds, requests=len(ms),
+                errors=sum(errors), throughput=len(ms) / seconds,
+                p50_ms=p50, p95_ms=p95, p99_ms=p99, max_ms=ms.max() if len(ms) else np.nan,
+                rss_start=rss_start, rss_end=rss_end,
+                rss_growth=rss_end - rss_start if rss_start and rss_end else None)
+
+
+def dash_user(url, auth, first, last):
+    """A dash user: the submit button's callback for a window of the mix."""
+    parsed = urllib.parse.urlsplit(url)
+    path = parsed.path.rstrip('/') + '/_dash-update-component'
+    headers = {'Content-Type': 'application/json', 'Accept-Encoding': 'gzip',
+               'Authorization': 'Basic ' + base64.b64encode(auth.encode()).decode()}
+
+    def user(rng):
+        connection = http.client.HTTPConnection(parsed.hostname, parsed.port, timeout=60)
+        clicks = iter(range(1, 1 << 30))
+
+        def request():
+            start, end = pick_window(rng, first, last)
+            body = benchmarks.dash_callback_payload(start.date(), end.date(), next(clicks),
+                                                    bands=pick(rng, BANDS_MIX))
+            try:
+                connection.request('POST', path, json.dumps(body), headers)
+                response = connection.getresponse()
+                response.read()
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                raise
+            if response.status != 200:
+                raise RuntimeError(f'HTTP {response.status}')
+        return request
+    return user
+
+
+def streamlit_user(ess):
+    """A streamlit user: a session drawing the pages of the mix, as a rerun
+    after a widget change does."""
+    def user(rng):
+        state = {}
+
+        def request():
+            data = ess.datasets.current
+            first, last = data.frame.date.iloc[0], data.frame.date.iloc[-1]
+            page = pick(rng, PAGE_MIX)
+            # page_cache keys its results on the page, as MultiApp.run sets it
+            state['_page'] = page
+            start, end = pick_window(rng, first, last)
+            if page == 'pe':
+                ess.pe_page_figure(data, start.date(), end.date(), state=state)
+            else:
+                ess.spread_page_figure(data, start.date(), end.date(), dataset.DEFAULT_SERIES,
+                                       True, STREAMLIT_BANDS[pick(rng, BANDS_MIX)],
+                                       state=state)
+        return request
+    return user
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def server_command(port, workers, threads):
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        return [sys.executable, '-c',
+                'import logging, earnings_spread, werkzeug.serving; '
+                'logging.getLogger("werkzeug").setLevel(logging.WARNING); '
+                'werkzeug.serving.run_simple('
+                f'"127.0.0.1", {port}, earnings_spread.server, threaded=True)']
+    return [sys.executable, '-m', 'gunicorn', 'earnings_spread:server',
+            '--bind', f'127.0.0.1:{port}', '--workers', str(workers),
+            '--threads', str(threads), '--log-level', 'warning']
+
+
+def start_server(data, tmp_dir, workers, threads, auth):
+    """Run earnings_spread:server on a free port, serving ``data``; returns
+    ``(process, url)``."""
+    shared_dir = os.path.join(tmp_dir, 'shared')
+    store = dataset.SharedStore(dataset.store_dir('earnings_spread', os.environ['SPREAD_SOURCE'],
+                                                  shared_dir))
+    with store.lock():
+        store.save(data)
+    # the server attaches the shared version and doesn't refresh during the
+    # run; the common windows are warmed as in production
+    env = dict(os.environ, SPREAD_SHARED_DIR=shared_dir, SPREAD_REFRESH_SECONDS='86400',
+               SPREAD_WARMUP='1')
+    port = free_port()
+    process = subprocess.Popen(server_command(port, workers, threads), env=env,
+                               cwd=os.path.dirname(os.path.abspath(__file__)))
+    url = f'http://127.0.0.1:{port}/'
+
+    headers = {'Authorization': 'Basic ' + base64.b64encode(auth.encode()).decode()}
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'server exited with {process.returncode}')
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', '/', headers=headers)
+            if connection.getresponse().status == 200:
+                return process, url
+        except OSError:
+            pass
+        time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError(f'server not up after {SERVER_START_TIMEOUT} s')
+
+
+def print_result(target, result):
+    line = (f"{target:<10} {result['concurrency']:>5} users {result['throughput']:>9.1f} req/s"
+            f"  p50 {result['p50_ms']:>8.1f}  p95 {result['p95_ms']:>8.1f}"
+            f"  p99 {result['p99_ms']:>8.1f} ms  errors {result['errors']}")
+    if result['rss_growth'] is not None:
+        line += (f"  rss {result['rss_end'] / 2**20:.0f} MB"
+                 f" ({result['rss_growth'] / 2**20:+.1f})")
+    print(line, file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--targets', nargs='+', choices=TARGETS, default=TARGETS)
+    parser.add_argument('--rows', type=int, default=10000, help='rows of the synthetic dataset')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=DEFAULT_CONCURRENCY,
+                        help='simulated users, one run per value')
+    parser.add_argument('--duration', type=float, default=20, help='seconds per run')
+    parser.add_argument('--url', help='a running dash app to test instead of a local one')
+    parser.add_argument('--auth', help='user:password for the dash app '
+                                       '(default: its first configured pair)')
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('WEB_CONCURRENCY', 2)),
+                        help='gunicorn workers of the local dash server')
+    parser.add_argument('--threads', type=int, default=4,
+                        help='gunicorn threads per worker of the local dash server')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default='-', help="JSON output file ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        es, ess = benchmarks.load_apps(tmp_dir)
+        if ess is None and 'streamlit' in args.targets:
+            print('streamlit not importable, skipping the streamlit target', file=sys.stderr)
+        auth = args.auth or ':'.join(es.USERNAME_PASSWORD_PAIRS[0])
+
+        frame = es.reformat_df(synthetic_data.raw_frame(args.rows))
+        data = dataset.Dataset(frame, f'loadtest-{args.rows}')
+        first, last = frame.date.iloc[0], frame.date.iloc[-1]
+
+        if 'dash' in args.targets:
+            process = None
+            if args.url:
+                url = args.url
+            else:
+                process, url = start_server(data, tmp_dir, args.workers, args.threads, auth)
+            try:
+                user = dash_user(url, auth, first, last)
+                for concurrency in args.concurrency:
+                    result = dict(target='dash', rows=args.rows,
+                                  **run_level(user, concurrency, args.duration, args.seed,
+                                              process.pid if process else None))
+                    print_result('dash', result)
+                    results.append(result)
+            finally:
+                if process is not None:
+                    process.terminate()
+                    process.wait()
+
+        if 'streamlit' in args.targets and ess is not None:
+            benchmarks.use_frame(ess, frame, data.version)
+            user = streamlit_user(ess)
+            for concurrency in args.concurrency:
+                result = dict(target='streamlit', rows=args.rows,
+                              **run_level(user, concurrency, args.duration, args.seed,
+                                          os.getpid()))
+                print_result('streamlit', result)
+                results.append(result)
+
+    report = dict(environment=benchmarks.environment(), results=results,
+                  settings=dict(vars(args), auth=None))
+    if args.out == '-':
+        json.dump(report, sys.stdout, indent=1, default=float)
+    else:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=1, default=float)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
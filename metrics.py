@@ -0,0 +1,160 @@
+"""Per-stage latency histograms for both apps.
+
+Wrap a stage in ``metrics.timer``; its duration lands in a histogram named
+after the stage. ``render`` writes all histograms in the Prometheus text
+format (served at /metrics by the dash app) and ``summary`` gives a short
+table for the streamlit debug panel.
+    with metrics.timer('calc_stds'):
+        ...
+
+Set SPREAD_METRICS=0 to turn timing off; ``timer`` then returns a shared
+no-op context. Set SPREAD_PROFILE_DIR to also write a cProfile dump of each
+request wrapped in ``profiled`` into that directory.
+"""
+import bisect
+import contextlib
+import cProfile
+import os
+import threading
+import time
+
+ENABLED = os.environ.get('SPREAD_METRICS', '1') != '0'
+PROFILE_DIR = os.environ.get('SPREAD_PROFILE_DIR')
+
+# upper bounds of the histogram buckets, in seconds
+BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10., float('inf'))
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        i = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += seconds
+
+    # upper bound of the bucket holding quantile q
+    def quantile(self, q):
+        if self.count == 0:
+            return float('nan')
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return self.buckets[-1]
+
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+
+def histogram(stage):
+    h = _histograms.get(stage)
+    if h is None:
+        with _histograms_lock:
+            h = _histograms.setdefault(stage, Histogram())
+    return h
+
+
+class _Timer:
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, stage):
+        self.histogram = histogram(stage)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+_NULL = contextlib.nullcontext()
+
+
+def timer(stage):
+    return _Timer(stage) if ENABLED else _NULL
+
+
+def observe(stage, seconds):
+    if ENABLED:
+        histogram(stage).observe(seconds)
+
+
+@contextlib.contextmanager
+def _profile(name):
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        profile.dump_stats(os.path.join(
+            PROFILE_DIR, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{id(profile):x}.prof"))
+
+
+def profiled(name):
+    """cProfile the block into SPREAD_PROFILE_DIR, if set."""
+    return _profile(name) if PROFILE_DIR else _NULL
+
+
+# a label value with backslashes, quotes and newlines escaped, as the text
+# format requires
+def _label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+
+def render(gauges=None):
+    """All histograms (and any ``{name: value}`` gauges) as Prometheus text."""
+    lines = ['# TYPE spread_stage_seconds histogram']
+    for stage, h in sorted(_histograms.items()):
+        stage = _label(stage)
+        cumulative = 0
+        for bound, n in zip(h.buckets, h.counts):
+            cumulative += n
+            lines.append(f'spread_stage_seconds_bucket{{stage="{stage}",le="{_format_bound(bound)}"}} {cumulative}')
+        lines.append(f'spread_stage_seconds_sum{{stage="{stage}"}} {h.sum}')
+        lines.append(f'spread_stage_seconds_count{{stage="{stage}"}} {h.count}')
+    for name, value in sorted((gauges or {}).items()):
+        lines.append(f'# TYPE {name} gauge')
+        lines.append(f'{name} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def summary():
+    """Rows of (stage, count, mean ms, p50 ms, p95 ms); quantiles are
+    bucket upper bounds."""
+    rows = []
+    for stage, h in sorted(_histograms.items()):
+        if h.count:
+            rows.append((stage, h.count, 1000 * h.sum / h.count,
+                         1000 * h.quantile(.5), 1000 * h.quantile(.95)))
+    return rows
+
+
+# nested stats dicts (e.g. ResultCache.stats()) as flat gauge names
+def flatten(prefix, stats):
+    out = {}
+    for key, value in stats.items():
+        name = f'{prefix}_{key}'
+        if isinstance(value, dict):
+            out.update(flatten(name, value))
+        else:
+            out[name] = value
+    return out
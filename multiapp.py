@@ -1,7 +1,60 @@
 """Frameworks for running multiple Streamlit applications as a single app.
 """
+from collections import OrderedDict
+
 import streamlit as st
 
+# results kept per page and session by page_cache
+PAGE_CACHE_SIZE = 8
+# sessions kept by the fallback session_state (see below)
+MAX_SESSIONS = 256
+
+_sessions = OrderedDict()
+
+
+def session_state():
+    """Dict-like state of the current browser session, kept across reruns.
+
+    st.session_state only exists from streamlit 0.84; on older versions a
+    dict per session id (the last MAX_SESSIONS) stands in for it.
+    """
+    state = getattr(st, 'session_state', None)
+    if state is not None:
+        return state
+    from streamlit.report_thread import get_report_ctx
+    ctx = get_report_ctx()
+    session_id = ctx.session_id if ctx is not None else None
+    if session_id not in _sessions:
+        _sessions[session_id] = {}
+        while len(_sessions) > MAX_SESSIONS:
+            _sessions.popitem(last=False)
+    return _sessions[session_id]
+
+
+def page_cache(inputs, compute, state=None):
+    """``compute()``, reused for the current page while ``inputs`` (anything
+    hashable, e.g. the dataset version and widget values) are unchanged.
+
+    Results are kept per page in the session state, the last PAGE_CACHE_SIZE
+    input combinations each, so switching back to a page or to earlier inputs
+    doesn't redo the work. ``state`` is the session state to use, by default
+    the current session's.
+    """
+    if state is None:
+        state = session_state()
+    caches = state.get('_page_cache')
+    if caches is None:
+        caches = state['_page_cache'] = {}
+    cache = caches.setdefault(state.get('_page'), OrderedDict())
+    if inputs in cache:
+        cache.move_to_end(inputs)
+        return cache[inputs]
+    value = cache[inputs] = compute()
+    while len(cache) > PAGE_CACHE_SIZE:
+        cache.popitem(last=False)
+    return value
+
+
 class MultiApp:
     """Framework for combining multiple streamlit applications.
     Usage:
@@ -20,6 +73,7 @@ class MultiApp:
         app.add_app("Foo", foo.app)
         app.add_app("Bar", bar.app)
         app.run()
+    Inside a page, page_cache keeps computed results per page and session.
     """
     def __init__(self):
         self.apps = []
@@ -44,4 +98,6 @@ class MultiApp:
             self.apps,
             format_func=lambda app: app['title'])
 
-        app['function']()
\ No newline at end of file
+        # page_cache keys its results on the page being rendered
+        session_state()['_page'] = app['title']
+        app['function']()
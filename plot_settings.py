@@ -1,11 +1,13 @@
-import plotly.graph_objs as go
+# the template is a plain dict (what go.layout.Template(...).to_plotly_json()
+# gives) so importing this doesn't load plotly.graph_objs; plotly accepts it
+# anywhere a template is expected
 
 background_color = "#ffffff"
 grid_color = "#f2f0f0"
 color_list = ['#5C943D', "#bababa"]
 
-dockstreet_template = go.layout.Template(
-    layout=go.Layout(
+dockstreet_template = dict(
+    layout=dict(
         colorway=color_list,
         font={"color": "black", "family": "sans-serif"},
         mapbox={"style": "light"},
@@ -27,7 +29,7 @@ dockstreet_template = go.layout.Template(
             "ticks": "",
             "zerolinecolor": grid_color,
             "zerolinewidth": 2,
-            "title_standoff": 10,
+            "title": {"standoff": 10},
         },
     )
-)
\ No newline at end of file
+)
@@ -0,0 +1,338 @@
+"""Cache of computed window results (bands and serialized figure).
+
+Results are keyed on ``(dataset version, start, end, options...)``. The first
+tier is an in-process LRU bounded by item count and bytes; the optional second
+tier is a SQLite file that every worker on a host can share. A hit in the
+second tier is copied into the first.
+    results = result_cache.shared_cache()
+    hit = results.get(key)
+    if hit is None:
+        hit = results.put(key, bands, figure)
+    figure = json.loads(hit.figure)
+
+Whole HTTP response bodies can be kept too, as a Payload holding the body
+precompressed with gzip (and brotli, if installed), so a repeated request
+is answered without serializing or compressing anything:
+    payload = payloads.get(key) or payloads.put(key, body)
+    encoding, data = payload.encoded(accept_encoding)
+
+Configured through the environment:
+    RESULT_CACHE_ITEMS / RESULT_CACHE_BYTES   limits of the in-process tier
+    RESULT_CACHE_SQLITE                       path of the shared tier (off if unset)
+    RESULT_CACHE_SQLITE_ROWS                  row limit of the shared tier
+    PAYLOAD_CACHE_ITEMS / PAYLOAD_CACHE_BYTES limits of the payload cache
+"""
+import gzip
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+import metrics
+
+try:
+    import orjson
+except ImportError:  # the standard library encoder is used instead
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # payloads are only gzipped
+    brotli = None
+
+# bands is (mean, up1, down1, up2, down2) (the P/E (min, max) for the P/E
+# chart), figure the figure as JSON text
+WindowResult = namedtuple('WindowResult', ['bands', 'figure'])
+
+# same level as flask-compress; brotli past 4 costs more time than it saves bytes
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+
+
+# numpy arrays and scalars as lists and floats, non-finite floats as None
+# (null), as plotly's encoder writes them
+def _plain(obj):
+    if isinstance(obj, dict):
+        return {key: _plain(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_plain(value) for value in obj]
+    if isinstance(obj, np.ndarray):
+        if obj.dtype.kind == 'f':
+            finite = np.isfinite(obj)
+            if not finite.all():
+                obj = np.where(finite, obj, None)
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        obj = obj.item()
+    if isinstance(obj, float) and not math.isfinite(obj):
+        return None
+    return obj
+
+
+def _orjson_default(obj):
+    # arrays orjson can't write natively (strings, objects)
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError
+
+
+def figure_json(figure):
+    """The figure as JSON text.
+
+    Plain dict figures (see fast_figures) skip plotly's encoder, which
+    writes every array through a second decode / encode pass to replace
+    NaNs: orjson writes the numeric arrays directly when it's installed,
+    otherwise they are converted to lists first. The result parses to the
+    same JSON either way.
+    """
+    if not isinstance(figure, dict):
+        # imported on first use, it isn't needed to start the apps
+        import plotly.utils
+        return json.dumps(figure, cls=plotly.utils.PlotlyJSONEncoder)
+    if orjson is not None:
+        return orjson.dumps(figure, default=_orjson_default,
+                            option=orjson.OPT_SERIALIZE_NUMPY).decode()
+    return json.dumps(_plain(figure))
+
+
+def _sizeof(result):
+    return len(result.figure) + 8 * len(result.bands)
+
+
+class LRUCache:
+    """In-process LRU bounded by item count and total figure bytes
+    (``sizeof`` of each item)."""
+    def __init__(self, max_items=256, max_bytes=64 * 2**20, sizeof=_sizeof):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        with self._lock:
+            result = self._items.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, key, result):
+        size = self.sizeof(result)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.bytes -= self.sizeof(old)
+            self._items[key] = result
+            self.bytes += size
+            while len(self._items) > self.max_items or self.bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.bytes -= self.sizeof(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.bytes = 0
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions,
+                    items=len(self._items), bytes=self.bytes)
+
+
+class SQLiteCache:
+    """Results in a SQLite file shared by the processes on a host.
+
+    Each process opens its own connection (reopened after a fork) and rows
+    past ``max_rows`` are dropped least recently used first.
+    """
+    def __init__(self, path, max_rows=2048):
+        self.path = path
+        self.max_rows = max_rows
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS results ('
+                         'key TEXT PRIMARY KEY, bands TEXT, figure TEXT, used REAL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS results_used ON results (used)')
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def get(self, key):
+        key = json.dumps(key)
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute('SELECT bands, figure FROM results WHERE key = ?',
+                               (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            with conn:
+                conn.execute('UPDATE results SET used = ? WHERE key = ?', (time.time(), key))
+            self.hits += 1
+        return WindowResult(tuple(json.loads(row[0])), row[1])
+
+    def put(self, key, result):
+        key = json.dumps(key)
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)',
+                             (key, json.dumps(result.bands), result.figure, time.time()))
+                evicted = conn.execute(
+                    'DELETE FROM results WHERE key IN (SELECT key FROM results '
+                    'ORDER BY used DESC LIMIT -1 OFFSET ?)', (self.max_rows,)).rowcount
+            self.evictions += max(evicted, 0)
+
+    def clear(self):
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute('DELETE FROM results')
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions)
+
+
+class ResultCache:
+    """An LRU in front of an optional shared SQLiteCache."""
+    def __init__(self, memory, shared=None):
+        self.memory = memory
+        self.shared = shared
+
+    def get(self, key):
+        result = self.memory.get(key)
+        if result is None and self.shared is not None:
+            result = self.shared.get(key)
+            if result is not None:
+                self.memory.put(key, result)
+        return result
+
+    def put(self, key, bands, figure):
+        """Store ``bands`` and ``figure`` (a figure dict, serialized here) and
+        return the stored WindowResult."""
+        with metrics.timer('serialize'):
+            result = WindowResult(tuple(float(b) for b in bands), figure_json(figure))
+        self.memory.put(key, result)
+        if self.shared is not None:
+            self.shared.put(key, result)
+        return result
+
+    def stats(self):
+        stats = {'memory': self.memory.stats()}
+        if self.shared is not None:
+            stats['shared'] = self.shared.stats()
+        return stats
+
+
+# one cache per process; module level so streamlit reruns reuse it
+_shared_cache = None
+
+
+def shared_cache():
+    global _shared_cache
+    if _shared_cache is None:
+        memory = LRUCache(int(os.environ.get('RESULT_CACHE_ITEMS', 256)),
+                          int(os.environ.get('RESULT_CACHE_BYTES', 64 * 2**20)))
+        shared = None
+        if os.environ.get('RESULT_CACHE_SQLITE'):
+            shared = SQLiteCache(os.environ['RESULT_CACHE_SQLITE'],
+                                 int(os.environ.get('RESULT_CACHE_SQLITE_ROWS', 2048)))
+        _shared_cache = ResultCache(memory, shared)
+    return _shared_cache
+
+
+class Payload(namedtuple('Payload', ['encodings'])):
+    """A response body, with ``encodings`` mapping 'identity', 'gzip' and
+    (with brotli installed) 'br' to its bytes."""
+    __slots__ = ()
+
+    def encoded(self, accept_encoding=''):
+        """``(encoding, bytes)`` of the smallest variant the client accepts."""
+        accepted = set()
+        for item in accept_encoding.split(','):
+            name, _, params = item.partition(';')
+            params = params.replace(' ', '')
+            if params.startswith('q='):
+                try:
+                    if float(params[2:]) == 0:
+                        continue
+                except ValueError:
+                    continue
+            accepted.add(name.strip().lower())
+        for encoding in ('br', 'gzip'):
+            if encoding in self.encodings and (encoding in accepted or '*' in accepted):
+                return encoding, self.encodings[encoding]
+        return 'identity', self.encodings['identity']
+
+
+def encode_payload(body):
+    """``body`` (text or bytes) with its compressed variants as a Payload."""
+    if isinstance(body, str):
+        body = body.encode()
+    with metrics.timer('compress'):
+        encodings = {'identity': body, 'gzip': gzip.compress(body, GZIP_LEVEL)}
+        if brotli is not None:
+            encodings['br'] = brotli.compress(body, quality=BROTLI_QUALITY)
+    return Payload(encodings)
+
+
+def _payload_sizeof(payload):
+    return sum(len(data) for data in payload.encodings.values())
+
+
+class PayloadCache:
+    """LRU of Payloads by result key."""
+    def __init__(self, memory):
+        self.memory = memory
+
+    def get(self, key):
+        return self.memory.get(key)
+
+    def put(self, key, body):
+        """Compress ``body`` and return the stored Payload."""
+        payload = encode_payload(body)
+        self.memory.put(key, payload)
+        return payload
+
+    def clear(self):
+        self.memory.clear()
+
+    def stats(self):
+        return self.memory.stats()
+
+
+_payload_cache = None
+
+
+def payload_cache():
+    global _payload_cache
+    if _payload_cache is None:
+        _payload_cache = PayloadCache(LRUCache(int(os.environ.get('PAYLOAD_CACHE_ITEMS', 256)),
+                                               int(os.environ.get('PAYLOAD_CACHE_BYTES', 32 * 2**20)),
+                                               _payload_sizeof))
+    return _payload_cache
@@ -0,0 +1,110 @@
+"""Append-aware store for the reformatted spread data.
+
+The workbook only grows by appending daily rows, so ``SpreadStore.ingest``
+reformats just the rows past the ones it has already seen and appends them to
+growable column arrays. Every raw row is hashed (one vectorized pass, cheap
+next to parsing the workbook) so an edit to any row already ingested is
+caught and the workbook is reloaded whole.
+    store = SpreadStore(reformat_df)
+    store.ingest(raw)        # first load: everything
+    store.ingest(raw_later)  # later: only the appended rows
+    df = store.frame()
+"""
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+
+# hash of each raw row
+def row_hashes(raw):
+    return pd.util.hash_pandas_object(raw, index=False).to_numpy()
+
+
+# digest of the first n rows' hashes, used to check that the rows we
+# ingested are unchanged
+def rows_digest(hashes, n):
+    return hashlib.sha256(np.ascontiguousarray(hashes[:n]).tobytes()).hexdigest()
+
+
+class SpreadStore:
+    """Sorted reformatted columns plus what is needed to spot appended rows.
+
+    ``reformat`` is the app's ``reformat_df``. ``raw_rows`` / ``raw_digest``
+    are the row count of the last workbook ingested and the rows_digest of
+    all its rows.
+    """
+    def __init__(self, reformat):
+        self.reformat = reformat
+        self.size = 0
+        self.raw_rows = 0
+        self.raw_digest = None
+        self._columns = {}
+
+    @classmethod
+    def from_frame(cls, reformat, frame, raw_rows, raw_digest):
+        """Rebuild a store from an already reformatted frame (e.g. the on-disk
+        cache) and the raw row count / digest it was built from."""
+        store = cls(reformat)
+        store._append(frame)
+        store.raw_rows = raw_rows
+        store.raw_digest = raw_digest
+        return store
+
+    @property
+    def last_date(self):
+        return self._columns['date'][self.size - 1] if self.size else None
+
+    def frame(self):
+        return pd.DataFrame({c: a[:self.size] for c, a in self._columns.items()})
+
+    # copy new rows in, doubling the column arrays when they run out of room
+    def _append(self, new):
+        n = len(new)
+        if not self._columns:
+            self._columns = {c: np.empty(max(n, 1), dtype=new[c].dtype) for c in new.columns}
+        capacity = len(self._columns['date'])
+        if self.size + n > capacity:
+            capacity = max(self.size + n, 2 * capacity)
+            for c, a in self._columns.items():
+                grown = np.empty(capacity, dtype=a.dtype)
+                grown[:self.size] = a[:self.size]
+                self._columns[c] = grown
+        for c, a in self._columns.items():
+            a[self.size:self.size + n] = new[c].values
+        self.size += n
+
+    def load(self, raw, hashes=None):
+        """Replace the contents with the whole of ``raw``."""
+        if hashes is None:
+            hashes = row_hashes(raw)
+        new = self.reformat(raw)
+        self.size = 0
+        self._columns = {}
+        self._append(new)
+        self.raw_rows = len(raw)
+        self.raw_digest = rows_digest(hashes, len(raw))
+        return len(new)
+
+    def ingest(self, raw):
+        """Add the rows of ``raw`` newer than the last ingested date and
+        return how many were added.
+
+        Only rows past ``raw_rows`` are reformatted. If the workbook doesn't
+        look like an append of the last one (fewer rows, a changed row among
+        the ones ingested, or new rows dated before the last ingested date)
+        it is reloaded whole.
+        """
+        hashes = row_hashes(raw)
+        if self.size == 0 or len(raw) < self.raw_rows \
+                or rows_digest(hashes, self.raw_rows) != self.raw_digest:
+            return self.load(raw, hashes)
+
+        new = self.reformat(raw.iloc[self.raw_rows:])
+        if len(new) and new.date.values[0] <= self.last_date:
+            return self.load(raw, hashes)
+
+        self._append(new)
+        self.raw_rows = len(raw)
+        self.raw_digest = rows_digest(hashes, len(raw))
+        return len(new)
@@ -0,0 +1,226 @@
+"""Batch window statistics over HTTP, for notebooks and reports.
+
+Mounted on the dash app's flask server (see earnings_spread) at
+``/api/stats.<format>``, behind the same BasicAuth as the app. For each
+``(start, end)`` window and each series asked for it returns the mean,
+sample std and +-1/2 std bands, the numbers calc_stds gives the chart;
+every window comes from one vectorized ``WindowIndex.windows`` call.
+    POST /api/stats.csv
+    {"windows": [["2007-01-01", "2021-12-31"], ["2020-01-01", "2020-12-31"]],
+     "series": ["spread"]}
+or as a GET, one ``window`` argument per window:
+    GET /api/stats.json?window=2007-01-01/2021-12-31&window=2020-01-01/2020-12-31
+
+Formats are json, csv and arrow (an Arrow IPC stream; needs pyarrow). Rows
+are serialized CHUNK_ROWS at a time as the response is sent, so large
+batches stream; gzip_chunks compresses them as they go. ``series`` defaults
+to the default series; ``"all"`` asks for every series of the dataset.
+
+Limits per request, from the environment:
+    SPREAD_API_MAX_WINDOWS   windows (default 10000)
+    SPREAD_API_MAX_BYTES     request body size (default 1 MB); the app sets
+                             it as the server's MAX_CONTENT_LENGTH
+"""
+import csv
+import io
+import json
+import math
+import os
+import zlib
+
+import numpy as np
+import pandas as pd
+from werkzeug.exceptions import RequestEntityTooLarge
+
+import dataset
+import metrics
+import result_cache
+
+MAX_WINDOWS = int(os.environ.get('SPREAD_API_MAX_WINDOWS', 10000))
+MAX_BYTES = int(os.environ.get('SPREAD_API_MAX_BYTES', 2**20))
+CHUNK_ROWS = 1000
+
+COLUMNS = ['window', 'start', 'end', 'series', 'rows',
+           'mean', 'std', 'up1', 'down1', 'up2', 'down2']
+MIMETYPES = {
+    'json': 'application/json',
+    'csv': 'text/csv',
+    'arrow': 'application/vnd.apache.arrow.stream',
+}
+
+
+class ApiError(ValueError):
+    """A request the API can't answer, with the HTTP status to answer with."""
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+# the body of a request, up to its max_content_length (the server's
+# MAX_CONTENT_LENGTH): werkzeug only checks that against a Content-Length or
+# a form, not a chunked body read as JSON, so the read is bounded here too
+def _read_body(request):
+    limit = request.max_content_length
+    if limit is None:
+        return request.stream.read()
+    if request.content_length is not None and request.content_length > limit:
+        raise ApiError(f'request body over {limit} bytes', 413)
+    try:
+        body = request.stream.read(limit + 1)
+    except RequestEntityTooLarge:
+        body = None
+    if body is None or len(body) > limit:
+        raise ApiError(f'request body over {limit} bytes', 413)
+    return body
+
+
+def parse_request(request, data):
+    """``(start dates, end dates, series)`` asked for by a flask request."""
+    if request.method == 'POST':
+        body = _read_body(request)
+        try:
+            body = json.loads(body)
+        except ValueError:
+            body = None
+        if not isinstance(body, dict):
+            raise ApiError('expected a JSON object with a "windows" list')
+        windows = body.get('windows')
+        series = body.get('series', [dataset.DEFAULT_SERIES])
+    else:
+        windows = [w.split('/') for w in request.args.getlist('window')]
+        series = request.args.getlist('series') or [dataset.DEFAULT_SERIES]
+
+    if not isinstance(windows, list) or not windows:
+        raise ApiError('no windows given')
+    if len(windows) > MAX_WINDOWS:
+        raise ApiError(f'{len(windows)} windows, at most {MAX_WINDOWS} per request', 413)
+    if not all(isinstance(w, (list, tuple)) and len(w) == 2 for w in windows):
+        raise ApiError('each window should be a [start, end] pair')
+    try:
+        starts = pd.to_datetime([w[0] for w in windows]).values
+        ends = pd.to_datetime([w[1] for w in windows]).values
+    except (ValueError, TypeError) as e:
+        raise ApiError(f'bad window date: {e}')
+
+    if series == 'all' or series == ['all']:
+        series = list(data.series)
+    elif isinstance(series, str):
+        series = [series]
+    if not isinstance(series, list) or not all(isinstance(s, str) for s in series):
+        raise ApiError('series should be a series name or a list of them')
+    unknown = [s for s in series if s not in data.series]
+    if unknown:
+        raise ApiError(f'unknown series {unknown}; this dataset has {list(data.series)}')
+    return starts, ends, series
+
+
+def window_table(data, starts, ends, series):
+    """Stats of every window for every series, as columns (numpy arrays)
+    named by COLUMNS with a row per window and series, window major."""
+    with metrics.timer('api_windows'):
+        start_rows, stop_rows, mean, std = data.index.windows(starts, ends)
+    columns = [data.index.column(s) for s in series]
+    mean, std = mean[:, columns].ravel(), std[:, columns].ravel()
+
+    k = len(series)
+    return {
+        'window': np.repeat(np.arange(len(starts)), k),
+        'start': np.repeat(np.datetime_as_string(starts, unit='D'), k),
+        'end': np.repeat(np.datetime_as_string(ends, unit='D'), k),
+        'series': np.tile(np.asarray(series), len(starts)),
+        'rows': np.repeat(stop_rows - start_rows, k),
+        'mean': mean,
+        'std': std,
+        'up1': mean + std,
+        'down1': mean - std,
+        'up2': mean + 2 * std,
+        'down2': mean - 2 * std,
+    }
+
+
+def _chunks(table):
+    n = len(table['window'])
+    for start in range(0, n, CHUNK_ROWS):
+        yield {name: values[start:start + CHUNK_ROWS] for name, values in table.items()}
+
+
+# NaN stats (empty or one row windows) as null / empty cells
+def _rows(chunk):
+    for row in zip(*(chunk[name].tolist() for name in COLUMNS)):
+        yield [None if isinstance(v, float) and not math.isfinite(v) else v for v in row]
+
+
+def json_chunks(table, version):
+    yield '{"version": %s, "columns": %s, "rows": [' % (json.dumps(version), json.dumps(COLUMNS))
+    first = True
+    for chunk in _chunks(table):
+        text = ',\n'.join(json.dumps(row) for row in _rows(chunk))
+        if text:
+            yield text if first else ',\n' + text
+            first = False
+    yield ']}\n'
+
+
+def csv_chunks(table, version):
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator='\n')
+    writer.writerow(COLUMNS)
+    for chunk in _chunks(table):
+        writer.writerows(_rows(chunk))
+        yield out.getvalue()
+        out.seek(0)
+        out.truncate()
+    if out.tell():
+        yield out.getvalue()
+
+
+def arrow_chunks(table, version):
+    import pyarrow as pa
+
+    schema = pa.schema([('window', pa.int64()), ('start', pa.string()), ('end', pa.string()),
+                        ('series', pa.string()), ('rows', pa.int64())] +
+                       [(name, pa.float64()) for name in COLUMNS[5:]],
+                       metadata={'version': version})
+    sink = io.BytesIO()
+
+    def drain():
+        data = sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+        return data
+
+    with pa.ipc.new_stream(sink, schema) as writer:
+        for chunk in _chunks(table):
+            writer.write_batch(pa.record_batch([chunk[name] for name in COLUMNS], schema=schema))
+            yield drain()
+    yield drain()
+
+
+FORMATS = {'json': json_chunks, 'csv': csv_chunks, 'arrow': arrow_chunks}
+
+
+def gzip_chunks(chunks):
+    """``chunks`` (text or bytes) as one gzip stream, flushed after every
+    chunk so each is sent as soon as it is serialized."""
+    compressor = zlib.compressobj(result_cache.GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def stats_chunks(data, request, fmt):
+    """``(mimetype, chunk iterator)`` answering a request against ``data``
+    (a dataset.Dataset); raises ApiError."""
+    if fmt not in FORMATS:
+        raise ApiError(f'unknown format {fmt!r}; use one of {sorted(FORMATS)}', 404)
+    if fmt == 'arrow':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ApiError('arrow output needs pyarrow installed', 406)
+
+    starts, ends, series = parse_request(request, data)
+    table = window_table(data, starts, ends, series)
+    return MIMETYPES[fmt], FORMATS[fmt](table, data.version)
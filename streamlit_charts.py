@@ -0,0 +1,233 @@
+"""The streamlit app's window charts, without the app.
+
+The stats, bands and figures the app draws for a window of a Dataset, and
+the result cache they are shared through. Importing this module loads no data
+and doesn't import streamlit, so processes that already have a Dataset (an
+attached copy, see batch_report) can draw the app's charts:
+    import dataset, streamlit_charts
+    data = dataset.Dataset.attach(path)
+    result = streamlit_charts.window_result(data, start, end, 'spread')
+    figure_json = result.figure
+earnings_spread_streamlit serves its pages from these functions. The app's
+own datasets (its refresher, loading SPREAD_SOURCE on first call) are
+``app_datasets()``, for processes that need the data without the app.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+import data_cache
+import dataset
+import fast_figures
+import metrics
+import result_cache
+import window_stats
+
+# do date filter and recalculate stds
+# with a window_stats index the stats come from prefix sums and the returned
+# frame is a slice of d instead of a filtered copy; an index over several
+# series computes all of them in one call and the one asked for is picked out
+def calc_stds(d, start_date, end_date, index=None, series='spread'):
+    if index is None:
+        df_period = d.query(f"date>=@start_date & date<=@end_date").reset_index(drop=True)
+        mean = df_period[series].mean()
+        std = df_period[series].std()
+    else:
+        start, stop, mean, std = index.window(start_date, end_date)
+        if index.names is not None:
+            j = index.column(series)
+            mean, std = mean[j], std[j]
+        df_period = d.iloc[start:stop]
+    std_1up = mean + std
+    std_1down = mean - std
+    std_2up = mean + 2*std
+    std_2down = mean - 2*std
+
+    return df_period, mean, std_1up, std_1down, std_2up, std_2down
+
+# window median and percentile bands, the robust alternative to calc_stds,
+# returned in the same order as its mean and bands: median, p75, p25, p95, p5
+# with a window_stats index and QuantileIndex they come from the quantile
+# index's wavelet matrix in O(log n) instead of sorting the window
+def calc_percentiles(d, start_date, end_date, index=None, quantiles=None, series='spread'):
+    if quantiles is None:
+        df_period = d.query(f"date>=@start_date & date<=@end_date").reset_index(drop=True)
+        bands = df_period[series].quantile(window_stats.BAND_QUANTILES).values
+    else:
+        start, stop = index.slice(start_date, end_date)
+        bands = quantiles.quantile(start, stop, window_stats.BAND_QUANTILES)
+        df_period = d.iloc[start:stop]
+
+    return (df_period, *bands)
+
+# figure is built as a plain dict (see fast_figures) to skip plotly's validation
+# with a downsample pyramid for the series, long windows are decimated to
+# about the chart width
+# with rolling (window_stats.RollingBands) the bands are the trailing mean and
+# stds at each date, drawn as filled areas, instead of the flat window lines
+# series_label names the series in the title when it isn't the default one
+# with percentiles the bands are calc_percentiles' median and percentiles
+# crossings (a window_stats.CrossingIndex events frame) are marked on the chart
+def create_std_graph(plot_df, mean, up1, down1, up2, down2, show_lines, pyramid=None,
+                     rolling=None, rolling_label='', series='spread', series_label=None,
+                     percentiles=False, crossings=None):
+    if rolling is not None:
+        start, stop = window_stats.date_slice(rolling.dates, plot_df['date'].values)
+        rows = np.arange(start, stop) if pyramid is None else pyramid.rows(start, stop)
+        return fast_figures.rolling_spread_figure(rolling.dates[rows],
+                                                  rolling.values[rows],
+                                                  rolling.mean[rows],
+                                                  rolling.std[rows],
+                                                  rolling.zscore[rows],
+                                                  rolling_label,
+                                                  show_lines,
+                                                  series_label,
+                                                  crossings)
+
+    if pyramid is None:
+        dates, spread = plot_df['date'].values, plot_df[series].values
+    else:
+        dates, spread = pyramid.decimate_window(plot_df['date'].values)
+
+    return fast_figures.spread_figure(dates, spread,
+                                      (mean, up1, down1, up2, down2),
+                                      show_lines,
+                                      series_label=series_label,
+                                      percentiles=percentiles,
+                                      crossings=crossings)
+
+# df_all is a date window of the frame; pyramids are its (inverse, spx_price)
+# downsample pyramids. the decimation keeps each series' min, max and last
+# value, and the P/E axis range comes from the pyramid's extrema of the window
+# (or inverse_extrema, if the caller has them) rather than a scan of its rows
+# the figure is a plain dict (see fast_figures.pe_figure), like the spread charts
+def create_inverse_graph(df_all, pyramids=None, inverse_extrema=None):
+    dates = df_all.date.values
+    if pyramids is None:
+        inverse_dates, inverse = dates, df_all.inverse.values
+        spx_dates, spx_price = dates, df_all.spx_price.values
+        if inverse_extrema is None:
+            inverse_extrema = (df_all.inverse.min(), df_all.inverse.max())
+    else:
+        inverse_dates, inverse = pyramids[0].decimate_window(dates)
+        spx_dates, spx_price = pyramids[1].decimate_window(dates)
+        if inverse_extrema is None:
+            inverse_extrema = ((np.nan, np.nan) if len(dates) == 0
+                               else pyramids[0].extrema(dates[0], dates[-1]))
+
+    if len(dates) == 0:
+        return fast_figures.pe_figure(inverse_dates, inverse, spx_dates, spx_price,
+                                      inverse_extrema, None, None, None)
+    return fast_figures.pe_figure(inverse_dates, inverse, spx_dates, spx_price,
+                                  inverse_extrema, dates[-1], df_all.inverse.values[-1],
+                                  df_all.spx_price.values[-1])
+
+window_results = result_cache.shared_cache()
+
+# flat bands over the chosen window (mean and stds, or median and
+# percentiles), or trailing bands of a fixed length
+BAND_MODES = ['Window', 'Percentiles'] + list(window_stats.ROLLING_WINDOWS)
+
+# the crossing events (see window_stats.CrossingIndex) of series through the
+# bands of a window: flat bands get a CrossingIndex of the window, trailing
+# ones a binary search into the dataset's index over the whole series
+def window_crossings(data, start_date, end_date, series, band_mode, bands):
+    if band_mode in window_stats.ROLLING_WINDOWS:
+        crossings = data.crossings(window_stats.ROLLING_WINDOWS[band_mode], series)
+        return crossings.events(start_date, end_date)
+    start_row, stop_row = data.index.slice(start_date, end_date)
+    events = window_stats.CrossingIndex(data.index.dates[start_row:stop_row],
+                                        data.values[start_row:stop_row, data.index.column(series)],
+                                        bands).events()
+    # rows of the dataset, as for trailing bands
+    return events.assign(row=events.row + start_row)
+
+# the stats and figure (a result_cache.WindowResult) of a window, reused if it
+# was drawn before by any session; keyed on the rows the window covers
+# with crossings the figure also marks where the series crossed its bands
+def window_result(data, start_date, end_date, series=dataset.DEFAULT_SERIES, show_lines=True,
+                  band_mode='Window', crossings=False):
+    start_row, stop_row = data.index.slice(start_date, end_date)
+    key = (data.version, series, int(start_row), int(stop_row), show_lines, band_mode,
+           crossings)
+    result = window_results.get(key)
+    if result is None:
+        percentiles = band_mode == 'Percentiles'
+        if percentiles:
+            with metrics.timer('calc_percentiles'):
+                df_date_filter, m, u1, d1, u2, d2 = calc_percentiles(
+                    data.frame, start_date, end_date, data.index, data.quantiles(series), series)
+        else:
+            with metrics.timer('calc_stds'):
+                df_date_filter, m, u1, d1, u2, d2 = calc_stds(data.frame, start_date, end_date,
+                                                              data.index, series)
+        with metrics.timer('figure'):
+            rolling = events = None
+            if band_mode in window_stats.ROLLING_WINDOWS:
+                rolling = data.rolling(window_stats.ROLLING_WINDOWS[band_mode], series)
+            if crossings:
+                events = window_crossings(data, start_date, end_date, series, band_mode,
+                                          (m, u1, d1, u2, d2))
+            series_label = None
+            if series != dataset.DEFAULT_SERIES:
+                series_label = dataset.series_label(series)
+            updated_figure = create_std_graph(df_date_filter, m, u1, d1, u2, d2, show_lines,
+                                              data.pyramids[series], rolling, band_mode,
+                                              series, series_label, percentiles, events)
+        result = window_results.put(key, (m, u1, d1, u2, d2), updated_figure)
+    return result
+
+# the P/E chart of a window, shared through the result cache like
+# window_result; its bands are the window's P/E (min, max), read off the
+# inverse pyramid
+def pe_result(data, start_date, end_date):
+    start_row, stop_row = data.index.slice(start_date, end_date)
+    key = ('pe', data.version, int(start_row), int(stop_row))
+    result = window_results.get(key)
+    if result is None:
+        with metrics.timer('figure_inverse'):
+            inverse_extrema = data.inverse_pyramid.window_extrema(int(start_row), int(stop_row))
+            figure = create_inverse_graph(data.frame.iloc[start_row:stop_row],
+                                          (data.inverse_pyramid, data.spx_pyramid),
+                                          inverse_extrema)
+        result = window_results.put(key, inverse_extrema, figure)
+    return result
+
+
+# function to get file from google drive
+# returns the reformatted frame and its version, served from the local
+# column cache when the workbook hasn't changed
+def pull_google_drive(url):
+    return data_cache.load_frame(data_cache.drive_download_url(url), reformat_df,
+                                 columns=SOURCE_COLUMNS)
+
+# the last version in the local column cache (or None), without downloading
+def cached_google_drive(url):
+    return data_cache.cached_frame(data_cache.drive_download_url(url), reformat_df,
+                                   columns=SOURCE_COLUMNS)
+
+# filter to columns needed and format names
+# besides Spread, any Spread_<name> columns (other indexes, sectors) are kept
+# as extra series; only these columns are read from the workbook
+SOURCE_COLUMNS = '^(Date|SPX_Price|Spread(_.+)?)$'
+
+def reformat_df(d):
+    tmp = d.filter(regex=SOURCE_COLUMNS)
+    tmp.columns = [x.lower() for x in tmp.columns]
+    tmp = tmp.assign(date=lambda t: pd.to_datetime(t.date),
+                   inverse=lambda t: 1 / (t.spread / 100))
+    tmp = tmp.sort_values(by='date').reset_index(drop=True)
+
+    return tmp
+
+# SPREAD_SOURCE can point at another copy of the workbook (a url or local path)
+SOURCE_URL = "https://drive.google.com/file/d/16NBIP4qGtBkNbcxfUElMDjWiADryMa-G/view?usp=sharing"
+
+# the streamlit app's refresher (see dataset.refresher), registered under the
+# app's name so every process on the host shares its store
+def app_datasets():
+    url = os.environ.get('SPREAD_SOURCE', SOURCE_URL)
+    return dataset.refresher('earnings_spread_streamlit', url,
+                             lambda: pull_google_drive(url),
+                             lambda: cached_google_drive(url))
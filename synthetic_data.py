@@ -0,0 +1,52 @@
+"""Synthetic stand-ins for the spread workbook, for benchmarks and load tests.
+
+``raw_frame`` returns a frame shaped like ``pd.read_excel`` of the real
+workbook (``Date``, ``Spread``, ``SPX_Price`` plus optional extra
+``Spread_Sector_<i>`` series and filler columns),
+with the rows shuffled so ``reformat_df`` has real sorting to do.
+"""
+import numpy as np
+import pandas as pd
+
+END_DATE = pd.Timestamp('2021-08-06')
+# datetime64[ns] only reaches back to 1677, so long series get rows closer
+# together than a day
+MAX_SPAN = pd.Timedelta(days=365 * 200)
+
+
+def dates(n_rows, end=END_DATE):
+    step = min(pd.Timedelta(days=1), MAX_SPAN / max(n_rows, 1))
+    offsets = (np.arange(n_rows)[::-1] * step.value).astype('timedelta64[ns]')
+    return np.datetime64(end, 'ns') - offsets
+
+
+def _spread(rng, n_rows):
+    spread = 3.5 + np.cumsum(rng.normal(0, 0.03, n_rows))
+    # keep it positive like the real spread so inverse stays finite
+    return np.clip(3.5 + (spread - spread.mean()) / max(spread.std(), 1e-9), 0.3, None)
+
+
+def raw_frame(n_rows, seed=0, extra_columns=0, shuffle=True, extra_series=0):
+    rng = np.random.default_rng(seed)
+    spread = _spread(rng, n_rows)
+    # log price random walk scaled to the same spread whatever the row count
+    walk = np.cumsum(rng.normal(0, 1, n_rows))
+    spx_price = 1400 * np.exp(0.5 * (walk - walk[:1]) / max(walk.std(), 1e-9))
+
+    columns = {'Date': dates(n_rows), 'Spread': spread, 'SPX_Price': spx_price}
+    for i in range(extra_series):
+        columns[f'Spread_Sector_{i}'] = _spread(rng, n_rows)
+    for i in range(extra_columns):
+        columns[f'Extra_{i}'] = rng.normal(size=n_rows)
+    raw = pd.DataFrame(columns)
+
+    if shuffle:
+        raw = raw.iloc[rng.permutation(n_rows)].reset_index(drop=True)
+    return raw
+
+
+def write_workbook(path, n_rows, seed=0, extra_columns=0, extra_series=0):
+    """Write a synthetic .xlsx (at most 1,048,575 rows, Excel's limit)."""
+    raw_frame(n_rows, seed, extra_columns, shuffle=False,
+              extra_series=extra_series).to_excel(path, index=False)
+    return path
@@ -0,0 +1,44 @@
+import base64
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+# the app modules live at the top of the repository, not in a package
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# data_cache, dataset and the apps read these at import: a throwaway cache
+# and no shared store, refresh or warm-up, so the tests never touch the
+# real apps' data
+TMP_DIR = tempfile.mkdtemp(prefix='spread-tests-')
+os.environ['SPREAD_CACHE_DIR'] = os.path.join(TMP_DIR, 'cache')
+os.environ['SPREAD_SHARED_DIR'] = ''
+os.environ['SPREAD_REFRESH_SECONDS'] = '0'
+os.environ['SPREAD_WARMUP'] = '0'
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(TMP_DIR, ignore_errors=True)
+
+
+@pytest.fixture(scope='session')
+def es():
+    """The dash app, imported against a small synthetic workbook."""
+    import synthetic_data
+    os.environ['SPREAD_SOURCE'] = synthetic_data.write_workbook(
+        os.path.join(TMP_DIR, 'spread.xlsx'), 1000)
+    import earnings_spread
+    return earnings_spread
+
+
+@pytest.fixture(scope='module')
+def client(es):
+    """A test client of the dash app's server, logged in."""
+    username, password = es.USERNAME_PASSWORD_PAIRS[0]
+    client = es.server.test_client()
+    client.environ_base['HTTP_AUTHORIZATION'] = 'Basic ' + base64.b64encode(
+        f'{username}:{password}'.encode()).decode()
+    return client
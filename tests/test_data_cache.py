@@ -0,0 +1,81 @@
+import os
+
+import pandas as pd
+import pytest
+
+import data_cache
+import synthetic_data
+
+COLUMNS = '^(Date|SPX_Price|Spread(_.+)?)$'
+
+
+def reformat(d):
+    tmp = d.filter(regex=COLUMNS)
+    tmp.columns = [x.lower() for x in tmp.columns]
+    tmp = tmp.assign(date=lambda t: pd.to_datetime(t.date),
+                     inverse=lambda t: 1 / (t.spread / 100))
+    return tmp.sort_values(by='date').reset_index(drop=True)
+
+
+def reformat_scaled(d):
+    return reformat(d).assign(spread=lambda t: t.spread * 2)
+
+
+@pytest.fixture
+def workbook(tmp_path):
+    return synthetic_data.write_workbook(str(tmp_path / 'spread.xlsx'), 200, extra_series=1)
+
+
+def versions(cache_dir):
+    entries = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir)]
+    assert len(entries) == 1
+    return {name for name in os.listdir(entries[0])
+            if os.path.isdir(os.path.join(entries[0], name))}
+
+
+def test_columns_and_reformat_are_part_of_the_key(workbook, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    frame, version = data_cache.load_frame(workbook, reformat, cache_dir, COLUMNS)
+    assert 'spread_sector_0' in frame.columns
+
+    # same workbook, fewer columns read: not served the cached columns
+    fewer, fewer_version = data_cache.load_frame(workbook, reformat, cache_dir,
+                                                 '^(Date|SPX_Price|Spread)$')
+    assert 'spread_sector_0' not in fewer.columns
+    assert fewer_version != version
+
+    # same workbook and columns, another reformat
+    scaled, scaled_version = data_cache.load_frame(workbook, reformat_scaled, cache_dir, COLUMNS)
+    assert scaled_version not in (version, fewer_version)
+    assert (scaled.spread == frame.spread * 2).all()
+
+    cached, cached_version = data_cache.cached_frame(workbook, reformat_scaled, cache_dir,
+                                                     COLUMNS)
+    assert cached_version == scaled_version
+    pd.testing.assert_frame_equal(cached, scaled)
+    assert data_cache.cached_frame(workbook, reformat, cache_dir, COLUMNS) is None
+
+
+def test_unchanged_workbook_is_served_from_the_cache(workbook, tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / 'cache')
+    frame, version = data_cache.load_frame(workbook, reformat, cache_dir, COLUMNS)
+
+    def read_workbook(*args):
+        raise AssertionError('parsed again')
+    monkeypatch.setattr(data_cache, 'read_workbook', read_workbook)
+    cached, cached_version = data_cache.load_frame(workbook, reformat, cache_dir, COLUMNS)
+    assert cached_version == version
+    pd.testing.assert_frame_equal(cached, frame)
+
+
+def test_previous_version_is_kept(tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    path = str(tmp_path / 'spread.xlsx')
+    stored = []
+    for seed in range(3):
+        synthetic_data.write_workbook(path, 100, seed=seed)
+        stored.append(data_cache.load_frame(path, reformat, cache_dir, COLUMNS)[1])
+        assert stored[-1] in versions(cache_dir)
+    # the one just stored and the one before it, which another process may
+    # be about to map
+    assert versions(cache_dir) == set(stored[-data_cache.KEEP_VERSIONS:])
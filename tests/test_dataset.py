@@ -0,0 +1,108 @@
+import mmap
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import dataset
+import streamlit_charts
+
+
+@pytest.fixture(scope='module')
+def frame():
+    rng = np.random.default_rng(0)
+    n = 500
+    spread = 3 + np.cumsum(rng.normal(0, 0.1, n))
+    return pd.DataFrame({'date': pd.bdate_range('2015-01-01', periods=n),
+                         'spx_price': 2000 * np.exp(np.cumsum(rng.normal(0, 0.01, n))),
+                         'spread': spread,
+                         'spread_tech': spread + rng.normal(0, 0.2, n),
+                         'inverse': 1 / (spread / 100)})
+
+
+def assert_read_only(frame):
+    for c in frame.columns:
+        values = frame[c].to_numpy()
+        assert not values.flags.writeable
+        with pytest.raises(ValueError):
+            values[0] = values[1]
+    with pytest.raises(ValueError):
+        frame.loc[frame.index[0], 'spread'] = 0.
+
+
+# what the apps do with a Dataset's frame: the pandas calc_stds /
+# calc_percentiles paths go through .query, the indexed ones slice it
+def use_frame(data):
+    start, end = data.frame.date.iloc[100], data.frame.date.iloc[300]
+    streamlit_charts.calc_stds(data.frame, start, end)
+    streamlit_charts.calc_percentiles(data.frame, start, end)
+    streamlit_charts.calc_stds(data.frame, start, end, data.index)
+    streamlit_charts.calc_percentiles(data.frame, start, end, data.index, data.quantiles())
+    data.frame.query('spread > 3')
+
+
+# a view of a memory-mapped file, however many views deep
+def mapped(a):
+    while a is not None:
+        if isinstance(a, (np.memmap, mmap.mmap)):
+            return True
+        a = a.base
+    return False
+
+
+def test_frame_is_read_only(frame):
+    data = dataset.Dataset(frame, 'v1')
+    assert_read_only(data.frame)
+    use_frame(data)
+    assert_read_only(data.frame)
+    # the frame it was built from is left writable
+    assert frame.spread.to_numpy().flags.writeable
+
+
+def test_attached_frame_is_read_only(frame, tmp_path):
+    dataset.Dataset(frame, 'v1').save(str(tmp_path))
+    data = dataset.Dataset.attach(str(tmp_path))
+    pd.testing.assert_frame_equal(data.frame, frame, check_freq=False)
+    assert_read_only(data.frame)
+    use_frame(data)
+    assert_read_only(data.frame)
+
+
+def test_attached_frame_stays_mapped(frame, tmp_path):
+    dataset.Dataset(frame, 'v1').save(str(tmp_path))
+    data = dataset.Dataset.attach(str(tmp_path))
+    use_frame(data)
+    for c in data.frame.columns:
+        assert mapped(data.frame[c].to_numpy())
+
+
+def test_extended_matches_a_rebuild(frame):
+    old = dataset.Dataset(frame.iloc[:400], 'v1')
+    old.rolling(1)
+    data = old.extended(frame, 'v2')
+    fresh = dataset.Dataset(frame, 'v2')
+    fresh.rolling(1)
+
+    # the extended index keeps the old shift, so compare window stats
+    starts, stops = np.arange(0, 450, 7), np.arange(50, 500, 7)
+    for got, want in zip(data.index.stats_many(starts, stops),
+                         fresh.index.stats_many(starts, stops)):
+        np.testing.assert_allclose(got, want)
+    for name, pyramid in fresh._all_pyramids().items():
+        for key, a in pyramid.arrays().items():
+            np.testing.assert_array_equal(data._all_pyramids()[name].arrays()[key], a)
+    for c in fresh.series:
+        bands, fresh_bands = data.rolling(1, c), fresh.rolling(1, c)
+        for name in ('mean', 'std', 'zscore'):
+            np.testing.assert_allclose(getattr(bands, name), getattr(fresh_bands, name))
+    assert_read_only(data.frame)
+    assert not data.index.sum.flags.writeable
+
+
+def test_extended_needs_an_unchanged_prefix(frame):
+    old = dataset.Dataset(frame.iloc[:400], 'v1')
+    edited = frame.copy()
+    edited.loc[10, 'spread_tech'] += 1
+    assert old.extended(edited, 'v2') is None
+    assert old.extended(frame.iloc[:400], 'v2') is None
+    assert old.extended(frame.drop(columns='spread_tech'), 'v2') is None
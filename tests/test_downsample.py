@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import downsample
+
+
+@pytest.fixture(scope='module')
+def pyramid():
+    rng = np.random.default_rng(5)
+    n = 5000
+    values = 3 + np.cumsum(rng.normal(0, 0.1, n))
+    values[rng.random(n) < 0.05] = np.nan
+    values[1000:1100] = np.nan
+    return downsample.MinMaxPyramid(pd.bdate_range('2000-01-03', periods=n).values, values)
+
+
+# random row windows, plus empty, one row and all NaN ones
+def row_windows(n, count=300, seed=6):
+    rng = np.random.default_rng(seed)
+    starts = rng.integers(0, n + 1, count)
+    stops = np.minimum(n, starts + rng.integers(0, n, count))
+    extra = [(0, 0), (n, n), (0, 1), (n - 1, n), (1010, 1020), (990, 1110), (0, n)]
+    return (np.concatenate((starts, [s for s, _ in extra])),
+            np.concatenate((stops, [s for _, s in extra])))
+
+
+def test_window_extrema_match_scan(pyramid):
+    for start, stop in zip(*row_windows(len(pyramid))):
+        low, high = pyramid.window_extrema(start, stop)
+        window = pyramid.values[start:stop]
+        if np.isnan(window).all():
+            assert np.isnan(low) and np.isnan(high)
+        else:
+            assert (low, high) == (np.nanmin(window), np.nanmax(window))
+
+
+@pytest.mark.parametrize('n_points', [50, 400, 2000])
+def test_rows_keep_ends_and_extremes(pyramid, n_points):
+    for start, stop in zip(*row_windows(len(pyramid))):
+        rows = pyramid.rows(start, stop, n_points)
+        if stop - start <= n_points:
+            np.testing.assert_array_equal(rows, np.arange(start, stop))
+            continue
+        assert (np.diff(rows) > 0).all()
+        assert rows[0] == start and rows[-1] == stop - 1
+        # two points per bucket, plus the ends and the partial buckets
+        assert len(rows) <= n_points + 6
+        window = pyramid.values[start:stop]
+        if not np.isnan(window).all():
+            picked = pyramid.values[rows]
+            assert np.nanmin(picked) == np.nanmin(window)
+            assert np.nanmax(picked) == np.nanmax(window)
+
+
+@pytest.mark.parametrize('old', [1, 2, 1000, 4096, 4999])
+def test_extend_matches_a_rebuild(pyramid, old):
+    start = downsample.MinMaxPyramid(pyramid.dates[:old], pyramid.values[:old])
+    extended = start.extend(pyramid.dates, pyramid.values)
+    assert extended.arrays().keys() == pyramid.arrays().keys()
+    for name, rows in pyramid.arrays().items():
+        np.testing.assert_array_equal(extended.arrays()[name], rows)
@@ -0,0 +1,116 @@
+import io
+import zipfile
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import excel_reader
+
+COLUMNS = '^(Date|SPX_Price|Spread(_.+)?)$'
+
+CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>
+<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>
+</Types>"""
+ROOT_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>
+</Relationships>"""
+WORKBOOK = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/></sheets>
+</workbook>"""
+WORKBOOK_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>
+</Relationships>"""
+SHEET = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+<dimension ref="A1:E{last}"/><sheetData>{rows}</sheetData></worksheet>"""
+
+
+def inline(ref, text):
+    return f'<c r="{ref}" t="inlineStr"><is><t>{text}</t></is></c>'
+
+
+def workbook(rows):
+    """An .xlsx of the header Date, Spread, SPX_Price, D, E and ``rows``,
+    each a list of raw <c> elements."""
+    header = [inline('A1', 'Date'), inline('B1', 'Spread'), inline('C1', 'SPX_Price'),
+              inline('D1', 'D'), inline('E1', 'E')]
+    xml = ''.join(f'<row r="{i}">{"".join(cells)}</row>'
+                  for i, cells in enumerate([header] + rows, start=1))
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, 'w') as archive:
+        archive.writestr('[Content_Types].xml', CONTENT_TYPES)
+        archive.writestr('_rels/.rels', ROOT_RELS)
+        archive.writestr('xl/workbook.xml', WORKBOOK)
+        archive.writestr('xl/_rels/workbook.xml.rels', WORKBOOK_RELS)
+        archive.writestr('xl/worksheets/sheet1.xml',
+                         SHEET.format(last=len(rows) + 1, rows=xml))
+    return out.getvalue()
+
+
+def shared_formula_rows(n):
+    # Spread filled down from B2 as Excel writes it: the master cell holds the
+    # formula text and the range, the others only refer to it by si
+    rows = []
+    for i in range(2, n + 2):
+        formula = ('<f t="shared" ref="B2:B{}" si="0">D2-E2</f>'.format(n + 1) if i == 2
+                   else '<f t="shared" si="0"/>')
+        rows.append([f'<c r="A{i}" s="1"><v>{44000 + i}</v></c>',
+                     f'<c r="B{i}" s="2">{formula}<v>{i / 4}</v></c>',
+                     f'<c r="C{i}"><v>{1000 + i}</v></c>',
+                     f'<c r="D{i}"><v>{i / 4 + 1}</v></c>',
+                     f'<c r="E{i}"><v>1</v></c>'])
+    return rows
+
+
+def expected(n):
+    rows = np.arange(2, n + 2)
+    return pd.DataFrame({
+        'Date': pd.Timestamp('1899-12-30') + pd.to_timedelta(44000 + rows, unit='D'),
+        'Spread': rows / 4,
+        'SPX_Price': (1000 + rows).astype(float),
+    })
+
+
+def openpyxl_unused(*args):
+    raise AssertionError('fell back to openpyxl')
+
+
+@pytest.mark.parametrize('chunk_bytes', [64, excel_reader.CHUNK_BYTES])
+def test_shared_formulas(monkeypatch, chunk_bytes):
+    monkeypatch.setattr(excel_reader, '_read_openpyxl', openpyxl_unused)
+    frame = excel_reader.read_columns(workbook(shared_formula_rows(50)), COLUMNS,
+                                      chunk_bytes=chunk_bytes)
+    pd.testing.assert_frame_equal(frame, expected(50))
+
+
+def test_attributes_and_date_cells(monkeypatch):
+    monkeypatch.setattr(excel_reader, '_read_openpyxl', openpyxl_unused)
+    rows = shared_formula_rows(3)
+    rows[0][0] = '<c r="A2" s="1" t="d" cm="1"><v>2020-06-20T00:00:00</v></c>'
+    rows[1][1] = '<c r="B3" s="2" vm="1" t="n"><f>D3-E3</f><v>0.75</v></c>'
+    rows[2][2] = '<c r="C4" cm="1" t="str"><v>1004</v></c>'
+    frame = excel_reader.read_columns(workbook(rows), COLUMNS)
+    pd.testing.assert_frame_equal(frame, expected(3))
+
+
+def test_unknown_cell_form_reads_with_openpyxl(monkeypatch):
+    rows = shared_formula_rows(20)
+    # a child element the cell regex doesn't know: the chunk's counts differ
+    rows[10][1] = '<c r="B12" s="2"><v>3</v><extLst/></c>'
+    calls = []
+    read_openpyxl = excel_reader._read_openpyxl
+    monkeypatch.setattr(excel_reader, '_read_openpyxl',
+                        lambda *args: calls.append(args) or read_openpyxl(*args))
+    frame = excel_reader.read_columns(workbook(rows), COLUMNS)
+    assert len(calls) == 1
+    want = expected(20)
+    want.loc[10, 'Spread'] = 3.0
+    pd.testing.assert_frame_equal(frame, want, check_dtype=False)
@@ -0,0 +1,220 @@
+"""fast_figures against the go.Figure code it replaced.
+
+The reference builders below are the apps' create_graph, create_std_graph
+and create_inverse_graph as they were before the charts were built as plain
+dicts, drawing every row.
+"""
+import json
+import re
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+import plotly.utils
+import pytest
+from plotly.subplots import make_subplots
+
+import fast_figures
+import plot_settings
+import result_cache
+
+HLINE_COLOR = "black"
+ARROW_FONT = dict(size=15, color="#767676")
+RANGE_BUTTONS = [dict(count=1, label="1m", step="month", stepmode="backward"),
+                 dict(count=6, label="6m", step="month", stepmode="backward"),
+                 dict(count=1, label="YTD", step="year", stepmode="todate"),
+                 dict(count=1, label="1y", step="year", stepmode="backward"),
+                 dict(count=2, label="2y", step="year", stepmode="backward"),
+                 dict(step="all")]
+
+
+def old_hlines(fig, mean, up1, down1, up2, down2):
+    fig.add_hline(y=mean, line_width=2, line_color=HLINE_COLOR,
+                  annotation_text=f"{mean:,.2f} (mean)", annotation_position="bottom right")
+    for y, dash in [(up1, "dash"), (up2, "dot"), (down1, "dash"), (down2, "dot")]:
+        fig.add_hline(y=y, line_dash=dash, line_width=1, line_color=HLINE_COLOR,
+                      annotation_text=f"{y:,.2f}", annotation_position="bottom right")
+
+
+def old_band_labels(mean, up1, down1, up2, down2):
+    points = [up2, up1, mean, down1, down2]
+    labels = ["+2\u03C3", "+1\u03C3", "mean", "-1\u03C3", "-2\u03C3"]
+    return [dict(xref='paper', x=1.005, y=p, xanchor='left', yanchor='middle', align='left',
+                 text=f"{p:.2f} ({l})", showarrow=False, font=dict(size=12, color=HLINE_COLOR))
+            for p, l in zip(points, labels)]
+
+
+def old_arrows(fig, mean, cheaper_ay, expensive_ay):
+    for text, y, ay in [("Cheaper", mean + .2, cheaper_ay),
+                        ("More Expensive", mean - .2, expensive_ay)]:
+        fig.add_annotation(x=0.03, y=y, xref='paper', yref='y', xanchor='left', align='left',
+                           borderpad=5, text=text, axref='pixel', ayref='y', ax=0.25, ay=ay,
+                           arrowhead=1, arrowsize=1., arrowside='start', arrowwidth=1.5,
+                           arrowcolor="#767676", showarrow=True, font=ARROW_FONT)
+
+
+def old_create_graph(plot_df, mean, up1, down1, up2, down2):
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(x=plot_df['date'], y=plot_df['spread']))
+    fig.update_traces(marker=dict(size=3))
+    old_hlines(fig, mean, up1, down1, up2, down2)
+    fig.update_xaxes(showgrid=False, range=[plot_df.date.min(), plot_df.date.max()])
+    fig.update_yaxes(showgrid=False, zeroline=False, title='Equity Risk Premium',
+                     ticksuffix="  ", range=[-.5, np.ceil(plot_df.spread.max())])
+    fig.update_layout(font_family="Avenir", font_color="#4c4c4c", font_size=14,
+                      showlegend=False,
+                      title=dict(font_size=22, text="<b>Equity risk premium mainly between "
+                                                    "15yr mean and -1 std in recent months</b>"),
+                      title_x=0.04, title_y=0.95)
+    fig.update_layout(annotations=old_band_labels(mean, up1, down1, up2, down2),
+                      template=plot_settings.dockstreet_template)
+    old_arrows(fig, mean, mean + 3.8, mean - 3.8)
+    fig.update_layout(xaxis=dict(
+        rangeselector=dict(buttons=RANGE_BUTTONS),
+        rangeslider=dict(visible=True, range=[plot_df.date.min(), plot_df.date.max()]),
+        type="date"))
+    for ser in fig['data']:
+        ser['hovertemplate'] = "%{x|%b %-d, %Y}, %{y:.2f}<extra></extra>"
+    return fig
+
+
+def old_create_std_graph(plot_df, mean, up1, down1, up2, down2, show_lines):
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(x=plot_df['date'], y=plot_df['spread']))
+    fig.update_traces(marker=dict(size=3))
+    if show_lines:
+        old_hlines(fig, mean, up1, down1, up2, down2)
+        fig.update_layout(annotations=old_band_labels(mean, up1, down1, up2, down2))
+        old_arrows(fig, mean, plot_df.spread.max(), np.floor(plot_df.spread.min()) - .8)
+    fig.update_xaxes(showgrid=not show_lines, range=[plot_df.date.min(), plot_df.date.max()])
+    fig.update_yaxes(showgrid=not show_lines, zeroline=False, title='Equity Risk Premium',
+                     ticksuffix="  ", range=[np.floor(plot_df.spread.min()) - 1.5,
+                                             np.ceil(plot_df.spread.max())])
+    fig.update_layout(font_family="Avenir", font_color="#4c4c4c", font_size=14,
+                      showlegend=False,
+                      title=dict(font_size=22, text="<b>Equity risk premium mainly between "
+                                                    "15yr mean and -1\u03C3 lately</b>"),
+                      title_x=0.04, title_y=0.95, plot_bgcolor='white')
+    fig.update_layout(template=plot_settings.dockstreet_template, height=500,
+                      margin=dict(b=0),
+                      xaxis=dict(rangeselector=dict(y=1.05, buttons=RANGE_BUTTONS),
+                                 rangeslider=dict(visible=True, range=[plot_df.date.min(),
+                                                                       plot_df.date.max()]),
+                                 type="date"))
+    for ser in fig['data']:
+        ser['hovertemplate'] = "%{x|%b %-d, %Y}, %{y:.2f}<extra></extra>"
+    return fig
+
+
+def old_create_inverse_graph(df_all):
+    fig = make_subplots(specs=[[{"secondary_y": True}]])
+    fig.add_trace(go.Scatter(x=df_all.date, y=df_all.inverse, name="Bond Adj. P/E Ratio"),
+                  secondary_y=False)
+    fig.add_trace(go.Scatter(x=df_all.date, y=df_all.spx_price, name="S&P 500 Price",
+                             line=dict(width=1.5)),
+                  secondary_y=True)
+    fig.update_layout(template=go.layout.Template(plot_settings.dockstreet_template),
+                      height=500, plot_bgcolor='white', hovermode='x', font_family="Avenir",
+                      font_color="#4c4c4c",
+                      title=dict(font_size=22,
+                                 text="<b>S&P price and Interest Rate Adjusted P/E ratio</b>",
+                                 x=0.04, y=0.93),
+                      legend=dict(orientation="h", yanchor="bottom", y=1, xanchor="right",
+                                  x=.28, font=dict(size=14)))
+    fig.update_yaxes(title_text="S&P Price", titlefont_size=18, color="#767676",
+                     tickcolor="#767676", tickfont_color="#767676", tickfont_size=13,
+                     showgrid=False, tickformat="$,", tickprefix="  ", title_standoff=20,
+                     secondary_y=True)
+    color = plot_settings.color_list[0]
+    fig.update_yaxes(title_text="Bond Adjusted P/E", titlefont_size=18, color=color,
+                     tickcolor=color, tickfont_color=color, tickfont_size=13,
+                     ticksuffix="   ",
+                     range=[df_all.inverse.min() - (df_all.inverse.min() % 10) - 2,
+                            df_all.inverse.max() + (df_all.inverse.max() % 10)],
+                     secondary_y=False)
+    fig.update_xaxes(showgrid=False)
+    fig.add_annotation(x=df_all.date.max(), y=df_all.spx_price.values[-1], xref='x',
+                       yref='y2', xanchor='left', align='left', borderpad=5,
+                       text=f"${df_all.spx_price.values[-1]:,.0f}", showarrow=False,
+                       font=dict(size=12, color="#767676"))
+    fig.add_annotation(x=df_all.date.max(), y=df_all.inverse.values[-1], xref='x',
+                       yref='y', xanchor='left', align='left', borderpad=5,
+                       text=f"{df_all.inverse.values[-1]:,.1f}", showarrow=False,
+                       font=dict(size=12, color=color))
+    for ser in fig['data']:
+        if ser['name'] == "Bond Adj. P/E Ratio":
+            ser['hovertemplate'] = "%{x|%b %-d, %Y}, %{y:,.2f}<extra></extra>"
+        else:
+            ser['hovertemplate'] = "%{x|%b %-d, %Y}, %{y:$,.2f}<extra></extra>"
+    return fig
+
+
+# plotly writes pandas Timestamps as '2021-08-06 00:00:00' and datetime64
+# arrays as '2021-08-06T00:00:00'; plotly.js reads both the same
+DATETIME = re.compile(r'^(\d{4}-\d\d-\d\d)[ T](\d\d:\d\d:\d\d)$')
+
+
+def normalized(value):
+    if isinstance(value, dict):
+        return {k: normalized(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [normalized(v) for v in value]
+    if isinstance(value, str):
+        return DATETIME.sub(r'\1T\2', value)
+    return value
+
+
+def old_json(fig):
+    # the go.Figure's template is validated into the full Template object;
+    # compare it as the plain template dict it was built from
+    figure = json.loads(json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder))
+    figure['layout']['template'] = json.loads(json.dumps(
+        go.layout.Template(plot_settings.dockstreet_template),
+        cls=plotly.utils.PlotlyJSONEncoder))
+    return normalized(figure)
+
+
+def new_json(figure):
+    figure = json.loads(result_cache.figure_json(figure))
+    figure['layout']['template'] = json.loads(json.dumps(
+        go.layout.Template(figure['layout']['template']), cls=plotly.utils.PlotlyJSONEncoder))
+    return normalized(figure)
+
+
+@pytest.fixture(scope='module')
+def window():
+    rng = np.random.default_rng(0)
+    n = 1500
+    spread = 3.5 + np.cumsum(rng.normal(0, 0.05, n))
+    spx_price = 1400 * np.exp(np.cumsum(rng.normal(0, 0.01, n)))
+    return pd.DataFrame({'date': pd.bdate_range('2010-01-04', periods=n), 'spread': spread,
+                         'spx_price': spx_price, 'inverse': 1 / (spread / 100 + 0.01)})
+
+
+def bands(window):
+    mean, std = window.spread.mean(), window.spread.std()
+    return mean, mean + std, mean - std, mean + 2 * std, mean - 2 * std
+
+
+def test_dash_spread_figure(window):
+    # the dash chart always draws the bands
+    figure = fast_figures.spread_figure(window.date.values, window.spread.values,
+                                        bands(window), style='dash')
+    assert new_json(figure) == old_json(old_create_graph(window, *bands(window)))
+
+
+@pytest.mark.parametrize('show_lines', [True, False])
+def test_streamlit_spread_figure(window, show_lines):
+    figure = fast_figures.spread_figure(window.date.values, window.spread.values,
+                                        bands(window), show_lines, style='streamlit')
+    assert new_json(figure) == old_json(old_create_std_graph(window, *bands(window),
+                                                             show_lines))
+
+
+def test_pe_figure(window):
+    figure = fast_figures.pe_figure(window.date.values, window.inverse.values,
+                                    window.date.values, window.spx_price.values,
+                                    (window.inverse.min(), window.inverse.max()),
+                                    window.date.values[-1], window.inverse.values[-1],
+                                    window.spx_price.values[-1])
+    assert new_json(figure) == old_json(old_create_inverse_graph(window))
@@ -0,0 +1,25 @@
+import gzip
+import json
+
+import benchmarks
+
+BODY = benchmarks.dash_callback_payload('2018-01-01', '2019-12-31')
+URL = '/_dash-update-component'
+
+
+def test_repeated_callback_is_served_from_the_payload_cache(es, client, monkeypatch):
+    es.figure_responses.clear()
+    first = client.post(URL, json=BODY)
+    assert first.status_code == 200
+    assert 'my_graph' in json.loads(first.data)['response']
+
+    # the second request never reaches dash's dispatch
+    def window_figure(*args, **kwargs):
+        raise AssertionError('figure built again')
+    monkeypatch.setattr(es, 'window_figure', window_figure)
+    again = client.post(URL, json=BODY)
+    assert again.data == first.data
+    gzipped = client.post(URL, json=BODY, headers={'Accept-Encoding': 'gzip'})
+    assert gzipped.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(gzipped.data) == first.data
+    assert 'Accept-Encoding' in gzipped.headers['Vary']
@@ -0,0 +1,14 @@
+import importlib.util
+
+import pytest
+
+import import_report
+
+
+@pytest.mark.parametrize('module', import_report.ENTRY_POINTS)
+def test_deferred_modules_not_imported_at_startup(module, tmp_path):
+    if module == 'earnings_spread_streamlit' and importlib.util.find_spec('streamlit') is None:
+        pytest.skip('streamlit is not installed')
+    report = import_report.module_report(module, import_report.offline_env(str(tmp_path)),
+                                         repeat=1)
+    assert report['deferred_imported'] == []
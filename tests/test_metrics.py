@@ -0,0 +1,27 @@
+import base64
+
+import metrics
+
+
+def test_render_escapes_label_values():
+    metrics.observe('stage "quoted" \\ with\nnewline', 0.01)
+    text = metrics.render()
+    assert 'stage="stage \\"quoted\\" \\\\ with\\nnewline"' in text
+    # the buckets, sum and count, each still one sample line
+    lines = [line for line in text.splitlines() if 'quoted' in line]
+    assert len(lines) == len(metrics.BUCKETS) + 2
+    assert all(line.startswith('spread_stage_seconds_') for line in lines)
+
+
+def test_request_histograms_are_labelled_by_route(es):
+    username, password = es.USERNAME_PASSWORD_PAIRS[0]
+    auth = {'Authorization': 'Basic ' + base64.b64encode(
+        f'{username}:{password}'.encode()).decode()}
+    client = es.server.test_client()
+    before = set(metrics._histograms)
+    for path in ['/no/such/page', '/other%22page', '/_dash-layout', '/_nope']:
+        client.get(path, headers=auth)
+        client.get(path)
+    added = set(metrics._histograms) - before
+    assert all(stage.startswith('request ') for stage in added)
+    assert not any('such' in stage or 'other' in stage or 'nope' in stage for stage in added)
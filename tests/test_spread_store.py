@@ -0,0 +1,80 @@
+import pandas as pd
+import pytest
+
+import spread_store
+import synthetic_data
+from test_data_cache import reformat
+
+
+@pytest.fixture
+def raw():
+    return synthetic_data.raw_frame(300, shuffle=False)
+
+
+class Counting:
+    def __init__(self):
+        self.rows = []
+
+    def __call__(self, d):
+        self.rows.append(len(d))
+        return reformat(d)
+
+
+def test_append_reformats_only_the_new_rows(raw):
+    counting = Counting()
+    store = spread_store.SpreadStore(counting)
+    assert store.ingest(raw.iloc[:250]) == 250
+    assert store.ingest(raw.iloc[:250]) == 0
+    assert store.ingest(raw) == 50
+    assert counting.rows == [250, 0, 50]
+    pd.testing.assert_frame_equal(store.frame(), reformat(raw))
+
+
+def test_edited_earlier_row_reloads_whole(raw):
+    counting = Counting()
+    store = spread_store.SpreadStore(counting)
+    store.ingest(raw.iloc[:250])
+
+    edited = raw.copy()
+    edited.loc[10, 'Spread'] += 1
+    assert store.ingest(edited) == 300
+    assert counting.rows == [250, 300]
+    pd.testing.assert_frame_equal(store.frame(), reformat(edited))
+
+
+def test_from_frame_keeps_the_digest(raw):
+    store = spread_store.SpreadStore(reformat)
+    store.ingest(raw.iloc[:250])
+    restored = spread_store.SpreadStore.from_frame(reformat, store.frame(),
+                                                   store.raw_rows, store.raw_digest)
+    assert restored.ingest(raw) == 50
+
+    edited = raw.copy()
+    edited.loc[10, 'Spread'] += 1
+    restored = spread_store.SpreadStore.from_frame(reformat, store.frame(),
+                                                   store.raw_rows, store.raw_digest)
+    assert restored.ingest(edited) == 300
+
+
+def test_many_small_appends(raw):
+    store = spread_store.SpreadStore(reformat)
+    for stop in range(1, len(raw) + 1, 7):
+        store.ingest(raw.iloc[:stop])
+    store.ingest(raw)
+    assert store.size == len(raw)
+    pd.testing.assert_frame_equal(store.frame(), reformat(raw))
+
+
+def test_fewer_or_earlier_rows_reload_whole(raw):
+    counting = Counting()
+    store = spread_store.SpreadStore(counting)
+    store.ingest(raw.iloc[:250])
+    assert store.ingest(raw.iloc[:200]) == 200
+    pd.testing.assert_frame_equal(store.frame(), reformat(raw.iloc[:200]))
+
+    # a new row dated before the ones already ingested
+    earlier = pd.concat([raw.iloc[:200], raw.iloc[[0]].assign(
+        Date=raw.Date.iloc[0] - pd.Timedelta(days=1))], ignore_index=True)
+    assert store.ingest(earlier) == 201
+    assert counting.rows == [250, 200, 1, 201]
+    pd.testing.assert_frame_equal(store.frame(), reformat(earlier))
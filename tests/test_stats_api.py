@@ -0,0 +1,54 @@
+import gzip
+import io
+import json
+
+import pytest
+
+import stats_api
+
+
+BODY = {'windows': [['2018-01-01', '2019-12-31'], ['2019-01-01', '2019-06-30']]}
+
+
+def test_post_json(client):
+    response = client.post('/api/stats.json', json=BODY)
+    assert response.status_code == 200
+    table = json.loads(response.data)
+    assert table['columns'] == stats_api.COLUMNS
+    assert len(table['rows']) == 2
+
+
+def test_chunked_body_over_the_limit(client):
+    # no Content-Length: the server only learns the size by reading it
+    body = json.dumps(dict(BODY, padding='x' * stats_api.MAX_BYTES)).encode()
+    response = client.post('/api/stats.json', input_stream=io.BytesIO(body),
+                           content_type='application/json',
+                           environ_overrides={'CONTENT_LENGTH': '',
+                                              'wsgi.input_terminated': True})
+    assert response.status_code == 413
+    assert 'error' in response.get_json()
+
+
+@pytest.mark.parametrize('series', [5, [5], {'spread': 1}, [['spread']]])
+def test_bad_series(client, series):
+    response = client.post('/api/stats.json', json=dict(BODY, series=series))
+    assert response.status_code == 400
+    assert 'series' in response.get_json()['error']
+
+
+@pytest.mark.parametrize('fmt', ['json', 'csv'])
+def test_streamed_gzip(client, fmt):
+    plain = client.post(f'/api/stats.{fmt}', json=BODY)
+    gzipped = client.post(f'/api/stats.{fmt}', json=BODY, headers={'Accept-Encoding': 'gzip'})
+    assert gzipped.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(gzipped.data) == plain.data
+    # neither buffered by flask-compress, which would set a Content-Length
+    for response in (plain, gzipped):
+        assert 'Content-Length' not in response.headers
+
+
+def test_other_encodings_stream_uncompressed(client):
+    response = client.post('/api/stats.json', json=BODY, headers={'Accept-Encoding': 'br'})
+    assert 'Content-Encoding' not in response.headers
+    assert 'Content-Length' not in response.headers
+    assert len(json.loads(response.data)['rows']) == 2
@@ -0,0 +1,214 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import window_stats
+
+SERIES = ['spread', 'spread_a', 'spread_b']
+
+
+@pytest.fixture(scope='module')
+def frame():
+    rng = np.random.default_rng(0)
+    n = 2000
+    # business days, so random calendar dates fall between rows too
+    dates = pd.bdate_range('2000-01-03', periods=n)
+    values = 3 + np.cumsum(rng.normal(0, 0.1, (n, len(SERIES))), axis=0)
+    values[rng.random(values.shape) < 0.05] = np.nan
+    values[500:520, 0] = np.nan
+    return pd.DataFrame({'date': dates, **dict(zip(SERIES, values.T))})
+
+
+# random windows over and around the frame's dates, plus empty ones (end
+# before start, between two rows, before the data) and one row windows
+def windows(frame, n=300, seed=1):
+    rng = np.random.default_rng(seed)
+    dates = frame.date
+    first, last = dates.iloc[0], dates.iloc[-1]
+    span = (last - first).days + 60
+    out = []
+    for _ in range(n):
+        start = first - pd.Timedelta(days=30) + pd.Timedelta(days=int(rng.integers(span)))
+        end = start + pd.Timedelta(days=int(rng.integers(-10, span)))
+        out.append((start, end))
+    one_row = [(dates.iloc[i], dates.iloc[i]) for i in (0, 510, 1000, len(dates) - 1)]
+    empty = [(last, first), (pd.Timestamp('2000-01-08'), pd.Timestamp('2000-01-09')),
+             (first - pd.Timedelta(days=10), first - pd.Timedelta(days=1)),
+             (dates.iloc[505], dates.iloc[510])]
+    return out + one_row + empty
+
+
+def assert_same(indexed, pandas):
+    period, *bands = pandas
+    period_indexed, *bands_indexed = indexed
+    pd.testing.assert_frame_equal(period_indexed.reset_index(drop=True), period)
+    np.testing.assert_allclose(bands_indexed, bands, rtol=1e-9, atol=1e-12)
+
+
+def test_calc_stds_matches_pandas(es, frame):
+    index = window_stats.WindowIndex(frame.date.values, frame.spread.values)
+    for start, end in windows(frame):
+        assert_same(es.calc_stds(frame, start, end, index),
+                    es.calc_stds(frame, start, end))
+
+
+@pytest.mark.parametrize('series', SERIES)
+def test_calc_stds_matches_pandas_multi_series(es, frame, series):
+    index = window_stats.WindowIndex(frame.date.values, frame[SERIES].values, SERIES)
+    for start, end in windows(frame):
+        assert_same(es.calc_stds(frame, start, end, index, series),
+                    es.calc_stds(frame, start, end, series=series))
+
+
+def test_windows_matches_window(frame):
+    index = window_stats.WindowIndex(frame.date.values, frame[SERIES].values, SERIES)
+    starts, ends = zip(*windows(frame))
+    rows_start, rows_stop, means, stds = index.windows(
+        pd.DatetimeIndex(starts).values, pd.DatetimeIndex(ends).values)
+    for i, (start, end) in enumerate(zip(starts, ends)):
+        window_start, window_stop, mean, std = index.window(start, end)
+        assert (rows_start[i], rows_stop[i]) == (window_start, window_stop)
+        np.testing.assert_allclose(means[i], mean, rtol=1e-12)
+        np.testing.assert_allclose(stds[i], std, rtol=1e-12)
+
+
+# a series with NaNs and with many ties (values rounded to a coarse grid)
+@pytest.fixture(scope='module', params=['distinct', 'ties'])
+def quantile_values(request):
+    rng = np.random.default_rng(2)
+    values = 3 + np.cumsum(rng.normal(0, 0.1, 1500))
+    if request.param == 'ties':
+        values = np.round(values, 1)
+    values[rng.random(len(values)) < 0.05] = np.nan
+    values[700:710] = np.nan
+    return values
+
+
+# random row windows, plus empty, one row and all NaN ones
+def row_windows(n, count=300, seed=3):
+    rng = np.random.default_rng(seed)
+    starts = rng.integers(0, n + 1, count)
+    stops = np.minimum(n, starts + rng.integers(0, n, count))
+    extra = [(0, 0), (n, n), (5, 5), (0, 1), (n - 1, n), (703, 704), (700, 710), (0, n)]
+    return (np.concatenate((starts, [s for s, _ in extra])),
+            np.concatenate((stops, [s for _, s in extra])))
+
+
+def test_kth_matches_sort(quantile_values):
+    index = window_stats.QuantileIndex(quantile_values)
+    rng = np.random.default_rng(4)
+    starts, stops = row_windows(len(quantile_values))
+    for start, stop in zip(starts, stops):
+        window = np.sort(quantile_values[start:stop][~np.isnan(quantile_values[start:stop])])
+        assert index.count(start, stop) == len(window)
+        if len(window):
+            ks = rng.integers(0, len(window), 5)
+            np.testing.assert_array_equal(index.kth(start, stop, ks), window[ks])
+
+
+# pandas' median of the empty windows warns
+@pytest.mark.filterwarnings('ignore:Mean of empty slice')
+def test_quantiles_and_mad_match_pandas(quantile_values):
+    index = window_stats.QuantileIndex(quantile_values)
+    qs = [0, .05, .25, .5, .75, .95, 1]
+    starts, stops = row_windows(len(quantile_values))
+    quantiles = index.quantiles(starts, stops, qs)
+    mads = index.mad(starts, stops)
+    for i, (start, stop) in enumerate(zip(starts, stops)):
+        window = pd.Series(quantile_values[start:stop])
+        np.testing.assert_allclose(quantiles[i], window.quantile(qs).values, rtol=1e-12)
+        mad = (window - window.median()).abs().median()
+        np.testing.assert_allclose(mads[i], mad, rtol=1e-12, atol=1e-12)
+
+
+def test_calc_percentiles_matches_pandas(es, frame):
+    index = window_stats.WindowIndex(frame.date.values, frame[SERIES].values, SERIES)
+    quantiles = window_stats.QuantileIndex(frame.spread.values)
+    for start, end in windows(frame):
+        assert_same(es.calc_percentiles(frame, start, end, index, quantiles),
+                    es.calc_percentiles(frame, start, end))
+
+
+# the regime of every row, and the crossings between the rows that have one,
+# a row at a time
+def crossings_by_row(values, levels):
+    levels = np.column_stack([np.broadcast_to(level, values.shape) for level in levels])
+    rows, regimes = [], []
+    for i, value in enumerate(values):
+        if np.isnan(value) or np.isnan(levels[i]).any():
+            continue
+        regime = int((value >= levels[i]).sum())
+        if regimes and regime != regimes[-1][1]:
+            rows.append((i, regimes[-1][1], regime))
+        regimes.append((i, regime))
+    return rows, regimes
+
+
+def test_crossings_match_rows(frame):
+    values = frame.spread.values
+    index = window_stats.WindowIndex(frame.date.values, values)
+    bands = window_stats.rolling_bands(index, values, 1)
+    mean, std = bands.mean, bands.std
+    # trailing bands, NaN for the first year, and fixed ones
+    for levels in [(mean, mean + std, mean - std, mean + 2 * std, mean - 2 * std),
+                   (3, 3.5, 2.5, 4, 2)]:
+        crossings = window_stats.CrossingIndex(frame.date.values, values, levels)
+        rows, regimes = crossings_by_row(values, levels)
+        assert len(crossings) == len(rows)
+        events = crossings.events()
+        assert list(zip(events.row, events.before, events.after)) == rows
+        assert (events.direction == np.sign(events.after - events.before)).all()
+        assert (events.value.values == values[events.row]).all()
+
+        table = crossings.regimes()
+        assert table.rows.sum() == len(regimes)
+        assert list(table.regime) == [regimes[0][1]] + [after for _, _, after in rows]
+        assert table.end.iloc[-1] == frame.date.iloc[regimes[-1][0]]
+
+
+def test_crossing_levels_and_ranges():
+    dates = pd.bdate_range('2020-01-01', periods=8).values
+    # a value equal to a level is at it; NaN rows are skipped
+    values = np.array([0.5, 1.0, np.nan, 1.5, -0.5, -2.5, -2.0, 3.0])
+    crossings = window_stats.CrossingIndex(dates, values, (0, 1, -1, 2, -2))
+    events = crossings.events()
+    assert list(events.row) == [1, 4, 5, 6, 7]
+    assert list(events.before) == [3, 4, 2, 0, 1]
+    assert list(events.after) == [4, 2, 0, 1, 5]
+    assert list(events.levels_crossed) == [1, 2, 2, 1, 4]
+    assert list(crossings.regimes().rows) == [1, 2, 1, 1, 1, 1]
+
+    # inclusive date ranges; regimes overlapping the range, not clipped
+    assert list(crossings.events(dates[4], dates[6]).row) == [4, 5, 6]
+    assert list(crossings.events(dates[2], dates[3]).row) == []
+    regimes = crossings.regimes(dates[2], dates[3])
+    assert list(regimes.regime) == [4]
+    assert regimes.start.iloc[0] == dates[1] and regimes.end.iloc[0] == dates[4]
+
+
+@pytest.mark.parametrize('values', [np.array([]), np.full(5, np.nan)])
+def test_crossings_of_nothing(values):
+    dates = pd.bdate_range('2020-01-01', periods=len(values)).values
+    crossings = window_stats.CrossingIndex(dates, values, (0, 1, -1, 2, -2))
+    assert len(crossings) == 0
+    assert crossings.events().empty
+    assert crossings.regimes().empty
+    assert crossings.events('2020-01-01', '2020-12-31').empty
+    assert crossings.regimes('2020-01-01', '2020-12-31').empty
+
+
+def test_rolling_bands_match_pandas(frame):
+    index = window_stats.WindowIndex(frame.date.values, frame[SERIES].values, SERIES)
+    bands = window_stats.rolling_bands(index, frame[SERIES].values, 1)
+    assert bands.mean.shape == (len(frame), len(SERIES))
+
+    year_ago = frame.date - pd.DateOffset(years=1)
+    incomplete = (year_ago < frame.date.iloc[0]).values
+    assert np.isnan(bands.mean[incomplete]).all()
+    for i in np.flatnonzero(~incomplete)[::37]:
+        window = frame[SERIES][(frame.date > year_ago[i]) & (frame.index <= i)]
+        np.testing.assert_allclose(bands.mean[i], window.mean(), rtol=1e-9)
+        np.testing.assert_allclose(bands.std[i], window.std(), rtol=1e-9)
+        np.testing.assert_allclose(
+            bands.zscore[i], (frame[SERIES].values[i] - window.mean()) / window.std(),
+            rtol=1e-9)
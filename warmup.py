@@ -0,0 +1,85 @@
+"""Warm-up of the most common windows for each new dataset version.
+
+The rangeselector windows (1m, 6m, YTD, 1y, 2y, all) and the dash app's
+default 2007 -> today view are most of the traffic. ``on_publish`` computes
+their stats and figures as soon as a dataset version is published, in a
+background thread, so the first request for them is already a result cache
+hit:
+    warmup.on_publish(datasets, lambda data, start, end: window_figure(data, start, end))
+
+Windows are declared as strings, relative to the last date of the data:
+    '<n>d', '<n>w', '<n>m', '<n>y'   the last n days / weeks / months / years
+    'ytd'                            since January 1st of the last year
+    'all'                            the whole series
+    'since <date>'                   from a date, e.g. 'since 2007-01-01'
+WINDOWS lists the defaults; SPREAD_WARM_WINDOWS adds more (comma separated,
+e.g. '15y,since 2000-01-01'). Set SPREAD_WARMUP=0 to turn the warm-up off.
+"""
+import logging
+import os
+import re
+import threading
+
+import pandas as pd
+
+import metrics
+
+ENABLED = os.environ.get('SPREAD_WARMUP', '1') != '0'
+WINDOWS = ['1m', '6m', 'ytd', '1y', '2y', 'all', 'since 2007-01-01'] + [
+    w.strip() for w in os.environ.get('SPREAD_WARM_WINDOWS', '').split(',') if w.strip()]
+
+OFFSETS = {'d': 'days', 'w': 'weeks', 'm': 'months', 'y': 'years'}
+
+log = logging.getLogger(__name__)
+
+
+def window_dates(spec, first, last):
+    """``(start, end)`` Timestamps of a window spec over data from ``first``
+    to ``last``."""
+    first, last = pd.Timestamp(first), pd.Timestamp(last)
+    spec = spec.strip().lower()
+    if spec == 'all':
+        return first, last
+    if spec == 'ytd':
+        return max(first, pd.Timestamp(last.year, 1, 1)), last
+    if spec.startswith('since '):
+        return pd.Timestamp(spec[len('since '):]), last
+    match = re.fullmatch(r'(\d+)\s*([dwmy])', spec)
+    if match is None:
+        raise ValueError(f'unknown window {spec!r}')
+    offset = pd.DateOffset(**{OFFSETS[match.group(2)]: int(match.group(1))})
+    return max(first, last - offset), last
+
+
+def warm(data, compute, windows=None):
+    """Call ``compute(data, start, end)`` for each window of ``data``."""
+    dates = data.frame.date
+    if len(dates) == 0:
+        return
+    for spec in windows or WINDOWS:
+        start, end = window_dates(spec, dates.iloc[0], dates.iloc[-1])
+        with metrics.timer('warmup'):
+            compute(data, start, end)
+
+
+def _warm_logged(data, compute, windows):
+    try:
+        warm(data, compute, windows)
+        log.info('warmed %d windows of dataset version %s',
+                 len(windows or WINDOWS), data.version[:12])
+    except Exception:
+        # requests still compute the windows themselves
+        log.exception('warm-up of dataset version %s failed', data.version[:12])
+
+
+def on_publish(refresher, compute, windows=None, name='warmup'):
+    """Warm the windows of the current and every newly published Dataset of
+    ``refresher`` in a background thread. Calling it again with the same
+    ``name`` (as each streamlit rerun does) only replaces ``compute``."""
+    if not ENABLED:
+        return
+
+    def start(data):
+        threading.Thread(target=_warm_logged, args=(data, compute, windows),
+                         name='dataset-warmup', daemon=True).start()
+    refresher.add_listener(start, name)
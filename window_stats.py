@@ -0,0 +1,455 @@
+"""Window statistics over the sorted spread series.
+
+``WindowIndex`` keeps prefix sums of the spread so the mean / std of any date
+window comes from two ``searchsorted`` calls instead of a filter and a pass
+over the slice. Build it once per dataset version:
+    index = WindowIndex(df.date.values, df.spread.values)
+    start, stop, mean, std = index.window(start_date, end_date)
+
+Given a 2-D ``(rows, series)`` array it does every series at once and the
+stats come back as arrays with one value per series:
+    index = WindowIndex(dates, values, names=['spread', 'spread_tech'])
+    start, stop, means, stds = index.window(start_date, end_date)
+    means[index.column('spread_tech')]
+
+``windows`` does the same for arrays of start and end dates at once.
+
+``rolling_bands`` uses the same prefix sums for trailing mean / std bands.
+
+When the data only gains rows, ``WindowIndex.extend`` and ``rolling_bands``
+with ``previous`` sum and compute just the new rows.
+
+``QuantileIndex`` does the same for order statistics (median, percentiles,
+MAD) in O(log n) per window, for the robust band mode.
+
+``CrossingIndex`` finds where a series crosses its mean and band lines and
+how long each regime between crossings lasted.
+"""
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+# prefix sums are accumulated inside fixed size chunks and the chunk totals
+# are summed separately, which keeps the rounding error of a long cumsum down
+CHUNK_SIZE = 1024
+
+
+def to_datetime64(d):
+    return pd.Timestamp(d).to_datetime64()
+
+
+# cumulative sum down the first axis with a leading 0, chunked for accuracy
+def _prefix_sum(x):
+    n, tail = len(x), x.shape[1:]
+    n_chunks = -(-n // CHUNK_SIZE)
+    padded = np.zeros((n_chunks * CHUNK_SIZE,) + tail)
+    padded[:n] = x
+    chunks = padded.reshape((n_chunks, CHUNK_SIZE) + tail)
+
+    within = np.cumsum(chunks, axis=1)
+    offsets = np.concatenate((np.zeros((1,) + tail), np.cumsum(chunks.sum(axis=1), axis=0)[:-1]))
+
+    out = np.empty((n + 1,) + tail)
+    out[0] = 0.
+    out[1:] = (within + offsets[:, None]).reshape((-1,) + tail)[:n]
+    return out
+
+
+class WindowIndex:
+    """Prefix sums of ``values`` (and its squares) over sorted ``dates``.
+
+    ``values`` is one series, or a ``(rows, series)`` array of several series
+    sharing the date axis, named by ``names``. Each series is shifted by its
+    overall mean before being summed, so the variance formula doesn't subtract
+    two large nearly equal numbers. NaNs are skipped like pandas does.
+    """
+    def __init__(self, dates, values, names=None):
+        self.dates = np.asarray(dates, dtype='datetime64[ns]')
+        self.names = list(names) if names is not None else None
+        values = np.asarray(values, dtype=float)
+
+        valid = ~np.isnan(values)
+        n_valid = valid.sum(axis=0)
+        totals = np.where(valid, values, 0.).sum(axis=0)
+        self.shift = np.where(n_valid > 0, totals / np.maximum(n_valid, 1), 0.)[()]
+        centered = np.where(valid, values - self.shift, 0.)
+
+        self.count = np.concatenate((np.zeros((1,) + values.shape[1:], dtype=int),
+                                     np.cumsum(valid, axis=0)))
+        self.sum = _prefix_sum(centered)
+        self.sum_sq = _prefix_sum(centered ** 2)
+
+    @classmethod
+    def from_arrays(cls, dates, arrays, names=None):
+        """An index over the prefix sums saved by ``arrays`` (e.g. memory
+        mapped), without recomputing them."""
+        index = cls.__new__(cls)
+        index.dates = dates
+        index.names = list(names) if names is not None else None
+        index.shift = arrays['shift'][()]
+        index.count = arrays['count']
+        index.sum = arrays['sum']
+        index.sum_sq = arrays['sum_sq']
+        return index
+
+    def arrays(self):
+        return {'shift': np.asarray(self.shift), 'count': self.count,
+                'sum': self.sum, 'sum_sq': self.sum_sq}
+
+    def extend(self, dates, values):
+        """The index of this one's rows followed by new ones: ``dates`` of
+        every row (this index's first), ``values`` of the new rows only.
+        Only the new rows are summed, centered on this index's shift."""
+        values = np.asarray(values, dtype=float)
+        valid = ~np.isnan(values)
+        centered = np.where(valid, values - self.shift, 0.)
+
+        index = WindowIndex.__new__(WindowIndex)
+        index.dates = np.asarray(dates, dtype='datetime64[ns]')
+        index.names = self.names
+        index.shift = self.shift
+        index.count = np.concatenate((self.count, self.count[-1] + np.cumsum(valid, axis=0)))
+        index.sum = np.concatenate((self.sum, self.sum[-1] + _prefix_sum(centered)[1:]))
+        index.sum_sq = np.concatenate((self.sum_sq,
+                                       self.sum_sq[-1] + _prefix_sum(centered ** 2)[1:]))
+        return index
+
+    def __len__(self):
+        return len(self.dates)
+
+    # position of a named series in the stats arrays
+    def column(self, name):
+        return self.names.index(name)
+
+    # positions [start, stop) of the rows with start_date <= date <= end_date
+    def slice(self, start_date, end_date):
+        start = self.dates.searchsorted(to_datetime64(start_date), side='left')
+        stop = self.dates.searchsorted(to_datetime64(end_date), side='right')
+        return start, max(start, stop)
+
+    def stats(self, start, stop):
+        """Mean and sample std (ddof=1) of rows ``[start, stop)``; arrays
+        over the series when the index holds several."""
+        if self.sum.ndim > 1:
+            return self.stats_many(start, stop)
+        n = self.count[stop] - self.count[start]
+        if n == 0:
+            return np.nan, np.nan
+        s = self.sum[stop] - self.sum[start]
+        s2 = self.sum_sq[stop] - self.sum_sq[start]
+
+        mean = self.shift + s / n
+        if n == 1:
+            return mean, np.nan
+        var = max(s2 - s * s / n, 0.) / (n - 1)
+        return mean, np.sqrt(var)
+
+    def stats_many(self, starts, stops):
+        """Vectorized ``stats`` over arrays of row ranges."""
+        n = self.count[stops] - self.count[starts]
+        s = self.sum[stops] - self.sum[starts]
+        s2 = self.sum_sq[stops] - self.sum_sq[starts]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = self.shift + s / n
+            std = np.sqrt(np.maximum(s2 - s * s / n, 0.) / (n - 1))
+        mean[n == 0] = np.nan
+        std[n < 2] = np.nan
+        return mean, std
+
+    def window(self, start_date, end_date):
+        start, stop = self.slice(start_date, end_date)
+        mean, std = self.stats(start, stop)
+        return start, stop, mean, std
+
+    def windows(self, start_dates, end_dates):
+        """``window`` over arrays of dates, all in one pass: row ranges and
+        stats with one row per window (and a column per series)."""
+        starts = self.dates.searchsorted(np.asarray(start_dates, dtype='datetime64[ns]'),
+                                         side='left')
+        stops = self.dates.searchsorted(np.asarray(end_dates, dtype='datetime64[ns]'),
+                                        side='right')
+        stops = np.maximum(starts, stops)
+        mean, std = self.stats_many(starts, stops)
+        return starts, stops, mean, std
+
+
+class QuantileIndex:
+    """Order statistics of one series over any row window.
+
+    A wavelet matrix over the rank of each value: one bit level per bit of
+    the rank, each storing how many of the first rows have a 0 at that bit.
+    The k-th smallest value of rows ``[start, stop)`` then takes one step per
+    level, O(log n), and ``kth`` / ``quantiles`` / ``mad`` run that for
+    arrays of windows at once. NaNs rank last and are skipped.
+        quantiles = QuantileIndex(df.spread.values)
+        start, stop = index.slice(start_date, end_date)
+        p5, p25, median, p75, p95 = quantiles.quantile(start, stop, [.05, .25, .5, .75, .95])
+    """
+    def __init__(self, values):
+        values = np.asarray(values, dtype=float)
+        n = len(values)
+        order = np.argsort(values, kind='stable')
+        self.sorted = values[order]
+        self.valid = np.concatenate(([0], np.cumsum(~np.isnan(values))))
+
+        ranks = np.empty(n, dtype=np.int64)
+        ranks[order] = np.arange(n)
+        n_bits = max(1, int(n - 1).bit_length())
+        self.zeros = np.zeros((n_bits, n + 1), dtype=np.int32 if n < 2**31 else np.int64)
+        self.n_zeros = np.zeros(n_bits, dtype=np.int64)
+        for level in range(n_bits):
+            one = (ranks >> (n_bits - 1 - level)) & 1 == 1
+            np.cumsum(~one, out=self.zeros[level, 1:])
+            self.n_zeros[level] = self.zeros[level, -1]
+            # stable partition: rows with a 0 at this bit first
+            ranks = np.concatenate((ranks[~one], ranks[one]))
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        index = cls.__new__(cls)
+        index.sorted = arrays['sorted']
+        index.valid = arrays['valid']
+        index.zeros = arrays['zeros']
+        index.n_zeros = arrays['n_zeros']
+        return index
+
+    def arrays(self):
+        return {'sorted': self.sorted, 'valid': self.valid, 'zeros': self.zeros,
+                'n_zeros': self.n_zeros}
+
+    def __len__(self):
+        return len(self.sorted)
+
+    def count(self, starts, stops):
+        """Number of non-NaN values in rows ``[start, stop)``."""
+        return self.valid[stops] - self.valid[starts]
+
+    def kth(self, starts, stops, k):
+        """The k-th smallest (from 0) value of rows ``[start, stop)``;
+        arguments broadcast against each other and need 0 <= k < count."""
+        lo, hi, k = (np.array(a, dtype=np.int64) for a in np.broadcast_arrays(starts, stops, k))
+        rank = np.zeros_like(k)
+        for level in range(len(self.n_zeros)):
+            zeros = self.zeros[level]
+            zeros_lo, zeros_hi = zeros[lo], zeros[hi]
+            n_zeros = zeros_hi - zeros_lo
+            one = k >= n_zeros
+            k = np.where(one, k - n_zeros, k)
+            lo = np.where(one, self.n_zeros[level] + lo - zeros_lo, zeros_lo)
+            hi = np.where(one, self.n_zeros[level] + hi - zeros_hi, zeros_hi)
+            rank = (rank << 1) | one
+        return self.sorted[rank]
+
+    def quantiles(self, starts, stops, qs):
+        """Quantiles ``qs`` of rows ``[start, stop)`` for arrays of windows,
+        interpolated linearly like pandas; shape ``(windows, len(qs))``, NaN
+        for windows without values."""
+        starts = np.asarray(starts)[..., None]
+        stops = np.asarray(stops)[..., None]
+        qs = np.asarray(qs, dtype=float)
+        n = self.count(starts, stops)
+        if len(self) == 0:
+            return np.full(np.broadcast(n, qs).shape, np.nan)
+
+        empty = n == 0
+        # empty windows read row 0 instead and are masked after
+        starts, stops, n = np.where(empty, 0, starts), np.where(empty, 1, stops), np.maximum(n, 1)
+        position = qs * (n - 1)
+        below = np.floor(position).astype(np.int64)
+        above = np.minimum(below + 1, n - 1)
+        low = self.kth(starts, stops, below)
+        high = self.kth(starts, stops, above)
+        result = low + (high - low) * (position - below)
+        return np.where(empty, np.nan, result)
+
+    def quantile(self, start, stop, qs):
+        """``quantiles`` of a single window: one value per q."""
+        return self.quantiles(np.array([start]), np.array([stop]), qs)[0]
+
+    def mad(self, starts, stops):
+        """Median absolute deviation from the median of rows ``[start, stop)``
+        for arrays of windows, NaN for windows without values.
+
+        The deviations are two sorted runs, the values below the median read
+        downwards and those above it read upwards, so each order statistic of
+        the deviations is a binary search over how many come from the first
+        run: O(log^2 n).
+        """
+        starts, stops = np.asarray(starts), np.asarray(stops)
+        n = self.count(starts, stops)
+        median = self.quantiles(starts, stops, [.5])[..., 0]
+        empty = n == 0
+        starts, stops, n = np.where(empty, 0, starts), np.where(empty, 1, stops), np.maximum(n, 1)
+        if len(self) == 0:
+            return np.full(n.shape, np.nan)
+
+        # below[i] = median - value[split - 1 - i], above[t] = value[split + t] - median
+        split = (n + 1) // 2
+        n_below, n_above = split, n - split
+
+        def below(i):
+            return median - self.kth(starts, stops, np.clip(split - 1 - i, 0, n - 1))
+
+        def above(t):
+            return self.kth(starts, stops, np.clip(split + t, 0, n - 1)) - median
+
+        def kth_deviation(k):
+            # fewest taken from below with below[i] >= above[k - i]
+            lo = np.maximum(0, k + 1 - n_above)
+            hi = np.minimum(k + 1, n_below)
+            for _ in range(int(len(self)).bit_length() + 1):
+                mid = (lo + hi) // 2
+                found = (mid >= n_below) | (k - mid < 0) | (below(mid) >= above(k - mid))
+                hi = np.where(found, mid, hi)
+                lo = np.where(found, lo, np.minimum(mid + 1, hi))
+            i = hi
+            taken_below = np.where(i > 0, below(i - 1), -np.inf)
+            taken_above = np.where(k - i >= 0, above(k - i), -np.inf)
+            return np.maximum(taken_below, taken_above)
+
+        mad = (kth_deviation((n - 1) // 2) + kth_deviation(n // 2)) / 2
+        return np.where(empty, np.nan, mad)
+
+
+# quantiles of the percentile band mode, in the order calc_stds returns the
+# mean and bands: median, p75, p25, p95, p5
+BAND_QUANTILES = [.5, .75, .25, .95, .05]
+
+# trailing windows for the rolling band mode, in years
+ROLLING_WINDOWS = {'1y': 1, '3y': 3, '5y': 5}
+
+# full length arrays; mean/std/zscore are NaN until a full window of history
+RollingBands = namedtuple('RollingBands', ['dates', 'values', 'mean', 'std', 'zscore'])
+
+
+def rolling_bands(index, values, years, previous=None):
+    """Trailing ``years`` mean, std and z-score at every row, in one
+    vectorized pass over the index's prefix sums. With ``previous``, the
+    bands of the rows this index extends, only the rows after them are
+    computed."""
+    dates = index.dates
+    values = np.asarray(values, dtype=float)
+    first = 0 if previous is None else len(previous.dates)
+    lower = (pd.DatetimeIndex(dates[first:]) - pd.DateOffset(years=years)).values
+
+    starts = dates.searchsorted(lower, side='right')
+    stops = np.arange(first + 1, len(dates) + 1)
+    mean, std = index.stats_many(starts, stops)
+
+    # rows with less than a full window of history; with several series the
+    # arrays are (rows, series) and this masks whole rows
+    incomplete = lower < dates[0] if len(dates) else np.zeros(0, dtype=bool)
+    mean[incomplete] = np.nan
+    std[incomplete] = np.nan
+    with np.errstate(divide='ignore', invalid='ignore'):
+        zscore = (values[first:] - mean) / std
+
+    if previous is not None:
+        mean = np.concatenate((previous.mean, mean))
+        std = np.concatenate((previous.std, std))
+        zscore = np.concatenate((previous.zscore, zscore))
+    return RollingBands(dates, values, mean, std, zscore)
+
+
+# start/stop positions of the window spanned by dates, in a sorted series
+def date_slice(series_dates, dates):
+    if len(dates) == 0:
+        return 0, 0
+    start = series_dates.searchsorted(to_datetime64(dates[0]), side='left')
+    stop = series_dates.searchsorted(to_datetime64(dates[-1]), side='right')
+    return start, max(start, stop)
+
+
+# the levels, in the order calc_stds returns them, from lowest to highest
+ASCENDING_LEVELS = [4, 2, 0, 1, 3]
+
+
+class CrossingIndex:
+    """Crossings of a series through its mean and band lines, and the
+    regimes between them.
+
+    ``levels`` are ``(mean, up1, down1, up2, down2)`` as calc_stds (or
+    calc_percentiles) returns them, each a number or, for trailing bands, an
+    array with a value per row. The regime of a row is how many of the five
+    levels its value is at or above, 0 (below -2 std / p5) to 5 (above +2
+    std / p95); it comes from five comparisons over the whole array and the
+    crossings are where it changes, so building is O(n) with no loop over
+    rows. Events and regimes are kept
+    sorted by date, so the ones inside a zoomed range are found by binary
+    search:
+        crossings = CrossingIndex(dates, values, (mean, up1, down1, up2, down2))
+        crossings.events(start_date, end_date)
+        crossings.regimes(start_date, end_date)
+    Rows where the value or a level is NaN are skipped.
+    """
+    def __init__(self, dates, values, levels):
+        dates = np.asarray(dates)
+        values = np.asarray(values, dtype=float)
+        levels = np.column_stack([np.broadcast_to(np.asarray(level, dtype=float), values.shape)
+                                  for level in levels]) if len(values) else np.empty((0, 5))
+        valid = np.flatnonzero(~np.isnan(values) & ~np.isnan(levels).any(axis=1))
+        regime = (values[valid, None] >= levels[valid]).sum(axis=1)
+
+        # positions in valid where the regime changes, and the runs between
+        change = np.flatnonzero(regime[1:] != regime[:-1]) + 1
+        starts = np.concatenate(([0], change)) if len(valid) else change
+        stops = np.concatenate((change, [len(valid)])) if len(valid) else change
+
+        self.rows = valid[change]
+        self.dates = dates[self.rows]
+        self.values = values[self.rows]
+        self.before = regime[change - 1]
+        self.after = regime[change]
+
+        self.regime = regime[starts]
+        self.regime_starts = dates[valid[starts]]
+        self.regime_rows = stops - starts
+        # a regime lasts until the next crossing; the last one until the last row
+        self.regime_ends = np.concatenate((self.dates, dates[valid[-1:]]))
+
+    def arrays(self):
+        return {'rows': self.rows, 'dates': self.dates, 'values': self.values,
+                'before': self.before, 'after': self.after, 'regime': self.regime,
+                'regime_starts': self.regime_starts, 'regime_rows': self.regime_rows,
+                'regime_ends': self.regime_ends}
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def regime_days(self):
+        return (self.regime_ends - self.regime_starts) / np.timedelta64(1, 'D')
+
+    def _range(self, dates, start_date, end_date):
+        lo = 0 if start_date is None else dates.searchsorted(to_datetime64(start_date), 'left')
+        hi = len(dates) if end_date is None else dates.searchsorted(to_datetime64(end_date),
+                                                                    'right')
+        return lo, max(lo, hi)
+
+    def events(self, start_date=None, end_date=None):
+        """The crossings dated in ``[start_date, end_date]``: the row and
+        value where the series got to its new regime, the regimes before and
+        after, ``direction`` (+1 up, -1 down), how many levels it crossed,
+        and the days the regime it left had lasted."""
+        lo, hi = self._range(self.dates, start_date, end_date)
+        before, after = self.before[lo:hi], self.after[lo:hi]
+        return pd.DataFrame({'date': self.dates[lo:hi], 'row': self.rows[lo:hi],
+                             'value': self.values[lo:hi], 'before': before, 'after': after,
+                             'direction': np.sign(after - before),
+                             'levels_crossed': np.abs(after - before),
+                             'days_before': self.regime_days[lo:hi]})
+
+    def regimes(self, start_date=None, end_date=None):
+        """The regimes overlapping ``[start_date, end_date]`` (not clipped to
+        it): regime, start, end (the next crossing, or the last row for the
+        current one), days and rows."""
+        lo = 0 if start_date is None else self.regime_ends.searchsorted(
+            to_datetime64(start_date), 'left')
+        hi = len(self.regime) if end_date is None else self.regime_starts.searchsorted(
+            to_datetime64(end_date), 'right')
+        hi = max(lo, hi)
+        return pd.DataFrame({'regime': self.regime[lo:hi], 'start': self.regime_starts[lo:hi],
+                             'end': self.regime_ends[lo:hi], 'days': self.regime_days[lo:hi],
+                             'rows': self.regime_rows[lo:hi]})